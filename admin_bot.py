@@ -3,8 +3,10 @@ import logging
 import requests
 import psycopg2
 from datetime import datetime
+from jobs import JobQueue
+from bot_webhooks import application_builder, serve
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler
+from telegram.ext import CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler
 
 # --- НАСТРОЙКИ (ВСЕ КЛЮЧИ ВНУТРИ) ---
 
@@ -44,11 +46,12 @@ def save_contract_to_db(data):
             contract_num, track_number, fio, phone, 
             product, declared_weight, declared_volume, 
             client_city, agreed_rate, total_price_final, 
-            status, created_at, manager
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
+            status, warehouse_code, created_at, manager
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
         ON CONFLICT (track_number) DO UPDATE SET
             fio = EXCLUDED.fio,
-            contract_num = EXCLUDED.contract_num;
+            contract_num = EXCLUDED.contract_num,
+            warehouse_code = EXCLUDED.warehouse_code;
         """
         
         # Генерируем временный трек (или берем из договора)
@@ -67,6 +70,7 @@ def save_contract_to_db(data):
             float(data['rate']),    # agreed_rate
             float(data['total_sum']), # total_price_final
             "Оформлен",             # status
+            data['city'],           # warehouse_code: склад приемки = warehouse_name из warehouses.json
             "Manager_Bot"           # manager
         ))
 
@@ -79,6 +83,44 @@ def save_contract_to_db(data):
     finally:
         if conn: conn.close()
 
+# --- ФОНОВЫЕ ЗАДАНИЯ ---
+# Сохранение в БД и печать договора в Make идут в фоне с повторами; менеджер сразу получает ответ,
+# а итог каждого задания приходит ему отдельным сообщением (через Bot API, из потока очереди)
+job_queue = JobQueue()
+
+def notify_manager(chat_id, text):
+    job_queue.enqueue('contract.notify', {'chat_id': chat_id, 'text': text})
+
+def send_notification(job):
+    response = requests.post(
+        f"https://api.telegram.org/bot{TOKEN}/sendMessage",
+        json={'chat_id': job['chat_id'], 'text': job['text']},
+        timeout=10
+    )
+    response.raise_for_status()
+
+def save_contract_job(job):
+    contract = job['contract']
+    if not save_contract_to_db(contract):
+        raise RuntimeError(f"договор {contract['contract_num']} не записан в БД")
+    notify_manager(job['chat_id'], f"✅ Договор {contract['contract_num']} сохранен в Базе!")
+
+def render_contract_job(job):
+    contract = job['contract']
+    response = requests.post(MAKE_CONTRACT_WEBHOOK, json=contract, timeout=30)
+    response.raise_for_status()
+    notify_manager(job['chat_id'], f"📄 Договор {contract['contract_num']} отправлен на печать, PDF скоро придет.")
+
+def save_contract_failed(job, error):
+    notify_manager(job['chat_id'], f"⚠️ Ошибка сохранения договора {job['contract']['contract_num']} в Базу: {error}")
+
+def render_contract_failed(job, error):
+    notify_manager(job['chat_id'], f"❌ Ошибка Make по договору {job['contract']['contract_num']}: {error}")
+
+job_queue.register('contract.save', save_contract_job, on_failure=save_contract_failed)
+job_queue.register('contract.render', render_contract_job, on_failure=render_contract_failed)
+job_queue.register('contract.notify', send_notification)
+
 # --- СТАРТ БОТА ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("📝 Создать Договор (PDF)", callback_data='create_contract')]]
@@ -185,8 +227,6 @@ async def generate_contract(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Отменено.")
         return ConversationHandler.END
     
-    await query.edit_message_text("⏳ **Сохраняю в Базу и печатаю договор...**")
-    
     # Данные
     contract_num = f"CN-{datetime.now().strftime('%m%d%H')}"
     payload = {
@@ -205,24 +245,19 @@ async def generate_contract(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "manager_id": query.from_user.id
     }
     
-    # 1. Сохраняем в БД
-    db_success = save_contract_to_db(payload)
-    
-    # 2. Отправляем в Make
-    try:
-        requests.post(MAKE_CONTRACT_WEBHOOK, json=payload)
-        if db_success:
-            await query.message.reply_text(f"✅ **Договор {contract_num} сохранен в Базе!**\n📄 PDF скоро придет.")
-        else:
-            await query.message.reply_text(f"⚠️ PDF отправлен, но **ошибка сохранения в Базу**.")
-            
-    except Exception as e:
-        await query.message.reply_text(f"❌ Ошибка Make: {e}")
+    # БД и Make - в фоне, ответ менеджеру не ждет ни того, ни другого
+    job = {'contract': payload, 'chat_id': query.message.chat_id}
+    save_id = job_queue.enqueue('contract.save', job)
+    render_id = job_queue.enqueue('contract.render', job)
+    await query.edit_message_text(
+        f"⏳ **Договор {contract_num} принят.** Сохранение в Базу и печать идут в фоне "
+        f"(задания #{save_id}, #{render_id}), результат придет отдельным сообщением."
+    )
 
     return ConversationHandler.END
 
-def main():
-    app = Application.builder().token(TOKEN).build()
+def build_application():
+    app = application_builder(TOKEN, state='admin').build()
     
     handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(start_contract_process, pattern='^create_contract$')],
@@ -239,13 +274,20 @@ def main():
             ASK_ADDITIONAL: [MessageHandler(filters.TEXT, get_additional)],
             CONFIRM: [CallbackQueryHandler(generate_contract)]
         },
-        fallbacks=[CommandHandler('cancel', start)]
+        fallbacks=[CommandHandler('cancel', start)],
+        name='contract',
+        persistent=True
     )
     
     app.add_handler(CommandHandler("start", start))
     app.add_handler(handler)
+    return app
+
+def main():
+    app = build_application()
+    job_queue.start()
     print("Post Pro Admin Bot запущен (DB + Make)...")
-    app.run_polling()
+    serve({'admin': app})
 
 if __name__ == '__main__':
     main()
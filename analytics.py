@@ -0,0 +1,374 @@
+"""
+Аналитика по грузам: дневные итоги в таблице shipment_rollups.
+
+Итоги за день по каждому разрезу (все грузы, город, статус, склад, менеджер) ведут триггеры
+на shipments: вставка прибавляет строку к итогам ее значений, удаление вычитает, изменение статуса,
+веса, объема, цены или даты вычитает старую строку и прибавляет новую. Поэтому отчеты /reports/* читают только shipment_rollups, а время
+ответа не зависит от размера shipments. Триггеры одинаковы для PostgreSQL (боевая база) и SQLite
+(локальный стенд).
+
+    python analytics.py install --db postgres://...        # таблица, триггеры и первичное заполнение
+    python analytics.py backfill --db ...                  # пересчитать итоги с нуля
+    python analytics.py synth --db /tmp/shipments.db --rows 2000000
+    python analytics.py verify --db /tmp/shipments.db      # итоги против GROUP BY по shipments
+    python analytics.py bench --db /tmp/shipments.db       # отчет из итогов против полного прохода
+    python analytics.py report city --db ... --from 2024-01-01 --to 2024-01-31
+"""
+import os
+import time
+import random
+import logging
+from datetime import date, datetime, timedelta
+
+from shipments_db import ShipmentsDatabase, STANDIN_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 'shipment_rollups'
+
+# Разрезы итогов - колонки shipments (NULL хранится как ''); TOTAL - все грузы дня
+TOTAL = 'total'
+DIMENSIONS = ['client_city', 'status', 'warehouse_code', 'manager']
+MEASURES = ['declared_weight', 'actual_weight', 'declared_volume', 'actual_volume', 'agreed_rate', 'total_price_final']
+ROLLED_COLUMNS = DIMENSIONS + MEASURES + ['created_at']
+
+# Отчет -> (разрез, колонка группировки; None - одна строка итогов)
+REPORTS = {
+    'summary': (TOTAL, None),
+    'daily': (TOTAL, 'day'),
+    'city': ('client_city', 'value'),
+    'status': ('status', 'value'),
+    'warehouse': ('warehouse_code', 'value'),
+    'manager': ('manager', 'value'),
+}
+DEFAULT_PERIOD_DAYS = 30
+
+DAY_EXPRESSION = {
+    'postgres': "COALESCE(({row}.created_at)::date, DATE '1970-01-01')",
+    'sqlite': "COALESCE(date({row}.created_at), '1970-01-01')",
+}
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shipment_rollups (
+    day {day_type} NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    shipments BIGINT NOT NULL DEFAULT 0,
+    {measures},
+    PRIMARY KEY (dimension, day, value)
+)
+"""
+
+ROLLUP_COLUMNS = ['day', 'dimension', 'value', 'shipments'] + MEASURES
+
+
+def dimension_value(row, dimension):
+    return "''" if dimension == TOTAL else f"COALESCE({row}.{dimension}, '')"
+
+
+def rollup_upserts(dialect, row, sign):
+    """Прибавляет строку shipments (NEW/OLD в триггере) к ее итогам по каждому разрезу со знаком sign"""
+    updates = ', '.join(f"{column} = {ROLLUP_TABLE}.{column} + excluded.{column}" for column in ['shipments'] + MEASURES)
+    statements = []
+    for dimension in [TOTAL] + DIMENSIONS:
+        values = (
+            [DAY_EXPRESSION[dialect].format(row=row), f"'{dimension}'", dimension_value(row, dimension), str(sign)]
+            + [f"{sign} * COALESCE({row}.{column}, 0)" for column in MEASURES]
+        )
+        statements.append(
+            f"INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}) VALUES ({', '.join(values)}) "
+            f"ON CONFLICT (dimension, day, value) DO UPDATE SET {updates};"
+        )
+    return '\n'.join(statements)
+
+
+def schema_statements(dialect):
+    """Таблица итогов и триггеры, поддерживающие ее при каждой записи в shipments"""
+    measures = ',\n    '.join(f"{column} DOUBLE PRECISION NOT NULL DEFAULT 0" for column in MEASURES)
+    statements = [
+        ROLLUP_SCHEMA.format(day_type='DATE' if dialect == 'postgres' else 'TEXT', measures=measures),
+    ]
+    rolled = ', '.join(ROLLED_COLUMNS)
+
+    if dialect == 'postgres':
+        statements += [
+            f"""
+            CREATE OR REPLACE FUNCTION shipment_rollup_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    {rollup_upserts(dialect, 'OLD', -1)}
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    {rollup_upserts(dialect, 'NEW', 1)}
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS shipment_rollup ON shipments",
+            f"""
+            CREATE TRIGGER shipment_rollup AFTER INSERT OR UPDATE OF {rolled} OR DELETE ON shipments
+            FOR EACH ROW EXECUTE PROCEDURE shipment_rollup_trigger()
+            """,
+        ]
+    else:
+        statements += [
+            f"""
+            CREATE TRIGGER IF NOT EXISTS shipment_rollup_insert AFTER INSERT ON shipments BEGIN
+                {rollup_upserts(dialect, 'NEW', 1)}
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS shipment_rollup_update AFTER UPDATE OF {rolled} ON shipments BEGIN
+                {rollup_upserts(dialect, 'OLD', -1)}
+                {rollup_upserts(dialect, 'NEW', 1)}
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS shipment_rollup_delete AFTER DELETE ON shipments BEGIN
+                {rollup_upserts(dialect, 'OLD', -1)}
+            END
+            """,
+        ]
+    return statements
+
+
+def grouped_select(dialect, dimension, where=""):
+    """Итоги одного разреза прямо по shipments: тот же результат, что копят триггеры"""
+    return (
+        f"SELECT {DAY_EXPRESSION[dialect].format(row='s')} AS day, '{dimension}' AS dimension, "
+        f"{dimension_value('s', dimension)} AS value, COUNT(*) AS shipments, "
+        + ', '.join(f"SUM(COALESCE(s.{column}, 0)) AS {column}" for column in MEASURES)
+        + f" FROM shipments s {where} GROUP BY 1, 2, 3"
+    )
+
+
+def parse_day(value, default):
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class ShipmentAnalytics(ShipmentsDatabase):
+    """
+    Отчеты по shipments из таблицы итогов. database - строка подключения PostgreSQL (postgres://...)
+    или путь к файлу SQLite (локальный стенд).
+    """
+
+    # --- УСТАНОВКА И ПЕРЕСЧЕТ ---
+    def install(self):
+        """Таблица и триггеры; пустые итоги при непустой shipments заполняются сразу"""
+        for statement in schema_statements(self.dialect):
+            self.execute(statement)
+        self.commit()
+        has_rollups = self.execute(f"SELECT 1 FROM {ROLLUP_TABLE} LIMIT 1").fetchone()
+        has_shipments = self.execute("SELECT 1 FROM shipments LIMIT 1").fetchone()
+        if has_shipments and not has_rollups:
+            self.backfill()
+        logger.info("✅ Итоги по грузам установлены")
+
+    def backfill(self):
+        """Пересчет итогов с нуля по shipments; записи в shipments на это время блокируются"""
+        started = time.perf_counter()
+        connection = self.connection()
+        if self.dialect == 'postgres':
+            self.execute("LOCK TABLE shipments IN SHARE ROW EXCLUSIVE MODE")
+        else:
+            connection.commit()
+            self.execute("BEGIN IMMEDIATE")
+        self.execute(f"DELETE FROM {ROLLUP_TABLE}")
+        for dimension in [TOTAL] + DIMENSIONS:
+            self.execute(f"INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}) {grouped_select(self.dialect, dimension)}")
+        rows = self.execute(f"SELECT COUNT(*) FROM {ROLLUP_TABLE}").fetchone()[0]
+        connection.commit()
+        logger.info(f"✅ Итоги пересчитаны: {rows} строк за {time.perf_counter() - started:.1f} с")
+        return rows
+
+    # --- ОТЧЕТЫ ---
+    def report(self, name, date_from=None, date_to=None, full_scan=False):
+        """
+        Отчет за период (по умолчанию - последние DEFAULT_PERIOD_DAYS дней) из итогов:
+        читается не больше (дней x значений разреза) строк. full_scan=True считает тот же отчет
+        проходом по shipments (для bench).
+        """
+        if name not in REPORTS:
+            raise ValueError(f"Неизвестный отчет: {name}")
+        day_to = parse_day(date_to, date.today())
+        day_from = parse_day(date_from, day_to - timedelta(days=DEFAULT_PERIOD_DAYS))
+        dimension, group = REPORTS[name]
+
+        source = ROLLUP_TABLE
+        if full_scan:
+            day = DAY_EXPRESSION[self.dialect].format(row='s')
+            source = f"({grouped_select(self.dialect, dimension, f'WHERE {day} BETWEEN ? AND ?')}) AS raw"
+            params = (day_from.isoformat(), day_to.isoformat())
+        else:
+            params = ()
+        sums = ', '.join(f"SUM({column})" for column in ['shipments'] + MEASURES)
+        sql = f"SELECT {group + ', ' if group else ''}{sums} FROM {source} WHERE dimension = ? AND day BETWEEN ? AND ?"
+        if group:
+            sql += f" GROUP BY {group} HAVING SUM(shipments) <> 0 ORDER BY {'day' if group == 'day' else 'SUM(total_price_final) DESC'}"
+
+        rows = []
+        for values in self.execute(sql, params + (dimension, day_from.isoformat(), day_to.isoformat())).fetchall():
+            key, values = (str(values[0]), values[1:]) if group else (None, values)
+            shipments = values[0] or 0
+            totals = dict(zip(MEASURES, (round(value or 0, 2) for value in values[1:])))
+            rows.append({
+                'key': key,
+                'shipments': shipments,
+                **{column: totals[column] for column in MEASURES if column != 'agreed_rate'},
+                'average_rate': round(totals['agreed_rate'] / shipments, 2) if shipments else 0,
+            })
+        return {'report': name, 'from': day_from.isoformat(), 'to': day_to.isoformat(), 'rows': rows}
+
+    # --- ПРОВЕРКА ---
+    def verify(self):
+        """Расхождения итогов с GROUP BY по shipments: список ключей (день, разрез, значение)"""
+        expected = {}
+        for dimension in [TOTAL] + DIMENSIONS:
+            expected.update((tuple(map(str, row[:3])), row[3:]) for row in self.execute(grouped_select(self.dialect, dimension)).fetchall())
+        actual = {
+            tuple(map(str, row[:3])): row[3:] for row in self.execute(
+                f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM {ROLLUP_TABLE} WHERE shipments <> 0"
+            ).fetchall()
+        }
+        mismatches = []
+        for key in expected.keys() | actual.keys():
+            left, right = expected.get(key), actual.get(key)
+            if left is None or right is None or any(abs((a or 0) - (b or 0)) > 1e-6 * max(1, abs(a or 0)) for a, b in zip(left, right)):
+                mismatches.append(key)
+        return mismatches
+
+
+def create_analytics():
+    """Аналитика боевой базы (ANALYTICS_DATABASE_URL или DATABASE_URL) или None, если база не задана"""
+    database = os.getenv('ANALYTICS_DATABASE_URL') or os.getenv('DATABASE_URL')
+    return ShipmentAnalytics(database) if database else None
+
+
+# --- СИНТЕТИЧЕСКИЕ ДАННЫЕ ---
+
+SYNTH_CITIES = ["Алматы", "Астана", "Шымкент", "Караганда", "Актобе", "Тараз", "Павлодар", "Усть-Каменогорск", "Семей", "Атырау", None]
+SYNTH_STATUSES = ["Оформлен", "принят на складе", "в пути до границы", "на границе", "доставлен"]
+SYNTH_WAREHOUSES = ["Гуанчжоу", "Иу", None]
+SYNTH_MANAGERS = ["Manager_Bot", "Айгерим", "Данияр", "Сергей", "Мария"]
+
+
+def synthesize(analytics, rows, updates, seed=42, batch=50000):
+    """
+    Заполняет стенд SQLite: rows вставок (через триггеры), затем updates смен статуса и приемок
+    с фактическим весом, как это делают admin_bot и warehouse_bot
+    """
+    rng = random.Random(seed)
+    connection = analytics.connection()
+    analytics.execute(STANDIN_SCHEMA)
+    analytics.install()
+    start_day = datetime(2024, 1, 1)
+    offset = analytics.execute("SELECT COALESCE(MAX(id), 0) FROM shipments").fetchone()[0]
+
+    def generate(count):
+        for i in range(offset, offset + count):
+            weight = round(rng.uniform(5, 2000), 1)
+            volume = round(weight / rng.uniform(80, 400), 3)
+            rate = round(rng.uniform(1.5, 4.5), 2)
+            yield (
+                f"SYN{i:08d}", f"CN-{i}", f"Клиент {i}", "+7700", "товар",
+                weight, weight * rng.uniform(0.95, 1.05), volume, volume,
+                rate, round(weight * rate, 2),
+                rng.choice(SYNTH_CITIES), rng.choice(SYNTH_STATUSES), rng.choice(SYNTH_WAREHOUSES), rng.choice(SYNTH_MANAGERS),
+                (start_day + timedelta(minutes=rng.randrange(0, 730 * 24 * 60))).strftime("%Y-%m-%d %H:%M:%S"),
+            )
+
+    started = time.perf_counter()
+    inserted = 0
+    while inserted < rows:
+        count = min(batch, rows - inserted)
+        connection.executemany(
+            "INSERT INTO shipments (track_number, contract_num, fio, phone, product, declared_weight, actual_weight, "
+            "declared_volume, actual_volume, agreed_rate, total_price_final, client_city, status, warehouse_code, manager, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            generate(count)
+        )
+        connection.commit()
+        offset += count
+        inserted += count
+    insert_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(updates):
+        track = f"SYN{rng.randrange(offset):08d}"
+        if rng.random() < 0.5:
+            connection.execute("UPDATE shipments SET status = ? WHERE track_number = ?", (rng.choice(SYNTH_STATUSES), track))
+        else:
+            connection.execute(
+                "UPDATE shipments SET status = 'принят на складе', actual_weight = ?, created_at = datetime('now') WHERE track_number = ?",
+                (round(rng.uniform(5, 2000), 1), track)
+            )
+    connection.execute("DELETE FROM shipments WHERE track_number = ?", (f"SYN{rng.randrange(offset):08d}",))
+    connection.commit()
+    update_seconds = time.perf_counter() - started
+
+    print(f"📦 Вставлено {rows} строк за {insert_seconds:.1f} с ({insert_seconds / max(rows, 1) * 1e6:.0f} мкс на строку с триггером)")
+    print(f"🔄 Изменено {updates} строк за {update_seconds:.1f} с")
+
+
+def bench(analytics, repeats=5):
+    """Время отчетов: из итогов против того же отчета полным проходом по shipments"""
+    total = analytics.execute("SELECT COUNT(*) FROM shipments").fetchone()[0]
+    print(f"📊 Строк в shipments: {total}")
+    for name in REPORTS:
+        timings = {}
+        for label, full_scan in (('итоги', False), ('полный проход', True)):
+            best = float('inf')
+            for _ in range(1 if full_scan else repeats):
+                started = time.perf_counter()
+                analytics.report(name, '2024-01-01', '2025-12-31', full_scan=full_scan)
+                best = min(best, time.perf_counter() - started)
+            timings[label] = best * 1000
+        print(f"⏱ {name:<10} итоги: {timings['итоги']:8.2f} мс   полный проход: {timings['полный проход']:9.1f} мс")
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Итоги и отчеты по грузам")
+    parser.add_argument('--db', default=os.getenv('ANALYTICS_DATABASE_URL') or os.getenv('DATABASE_URL') or 'data/shipments.db',
+                        help="postgres://... или путь к SQLite")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('install', help="таблица итогов и триггеры")
+    commands.add_parser('backfill', help="пересчитать итоги с нуля")
+    commands.add_parser('verify', help="сверить итоги с shipments")
+    synth_parser = commands.add_parser('synth', help="заполнить стенд SQLite синтетическими грузами")
+    synth_parser.add_argument('--rows', type=int, default=1000000)
+    synth_parser.add_argument('--updates', type=int, default=20000)
+    bench_parser = commands.add_parser('bench', help="отчеты из итогов против полного прохода")
+    bench_parser.add_argument('--repeats', type=int, default=5)
+    report_parser = commands.add_parser('report', help="напечатать отчет")
+    report_parser.add_argument('name', choices=list(REPORTS))
+    report_parser.add_argument('--from', dest='date_from')
+    report_parser.add_argument('--to', dest='date_to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    analytics = ShipmentAnalytics(args.db)
+    if args.command == 'install':
+        analytics.install()
+    elif args.command == 'backfill':
+        analytics.backfill()
+    elif args.command == 'synth':
+        if analytics.dialect != 'sqlite':
+            sys.exit("❌ Синтетические данные - только для стенда SQLite")
+        synthesize(analytics, args.rows, args.updates)
+    elif args.command == 'bench':
+        bench(analytics, args.repeats)
+    elif args.command == 'report':
+        print(json.dumps(analytics.report(args.name, args.date_from, args.date_to), ensure_ascii=False, indent=2))
+    else:
+        mismatches = analytics.verify()
+        for key in mismatches[:20]:
+            print(f"❌ Расхождение: {key}")
+        print(f"🔍 Расхождений итогов с shipments: {len(mismatches)}")
+        sys.exit(1 if mismatches else 0)
@@ -0,0 +1,200 @@
+"""
+ASGI-точка входа рядом с wsgi.py: /chat, /health, /track/<номер> и страница чата.
+Логика общая с app.py (chat_service), но ожидание ответа Gemini не занимает поток:
+один процесс держит тысячи диалогов, которые ждут модель.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000      # uvicorn - из requirements.txt
+
+Сессии хранятся в памяти процесса, поэтому запускать нужно один процесс (без --workers).
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import mimetypes
+import asyncio
+import threading
+from http.cookies import SimpleCookie, CookieError
+
+from rate_limit import RateLimitExceeded, client_ip
+from logging_setup import set_request_id, reset_request_id, get_request_id
+from chat_service import CHAT_ERROR_RESPONSE, rate_limited_payload, respond_async, track_status, health_status, job_queue
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = 'postpro_sid'
+# Как PERMANENT_SESSION_LIFETIME в app.py
+SESSION_LIFETIME = 1800
+MAX_SESSIONS = 100_000
+MAX_BODY_BYTES = 64 * 1024
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+
+
+class SessionStore:
+    """Сессии в памяти процесса: sid -> [данные сессии, время последнего обращения]"""
+
+    def __init__(self, lifetime=SESSION_LIFETIME, max_sessions=MAX_SESSIONS):
+        self.lifetime = lifetime
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        """Сессия по sid из cookie; новая, если sid неизвестен или сессия истекла"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(sid) if sid else None
+            if entry is None or now - entry[1] > self.lifetime:
+                sid = uuid.uuid4().hex
+                entry = [{'sid': sid}, now]
+                self.sessions[sid] = entry
+                self._prune(now)
+            entry[1] = now
+            return sid, entry[0]
+
+    def _prune(self, now):
+        if len(self.sessions) <= self.max_sessions:
+            return
+        expired = [sid for sid, (_, last_seen) in self.sessions.items() if now - last_seen > self.lifetime]
+        for sid in expired:
+            del self.sessions[sid]
+
+
+sessions = SessionStore()
+
+
+# --- HTTP ---
+
+def request_headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def request_ip(scope, headers):
+    """IP клиента: адрес, который дописал в X-Forwarded-For прокси Render (см. rate_limit.client_ip)"""
+    client = scope.get('client')
+    return client_ip(headers.get('x-forwarded-for', ''), client[0] if client else None)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Слишком большой запрос")
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    if not isinstance(body, bytes):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ] + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# --- ОБРАБОТЧИКИ ---
+
+def session_cookie(headers):
+    """Идентификатор сессии из Cookie; заголовок, который не разбирается, - запрос без сессии"""
+    try:
+        cookie = SimpleCookie(headers.get('cookie', ''))
+    except CookieError:
+        return None
+    return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+
+
+async def chat(scope, receive, send):
+    headers = request_headers(scope)
+    sid, session = sessions.get(session_cookie(headers))
+    identities = {'session': sid, 'ip': request_ip(scope, headers)}
+    extra_headers = [('set-cookie', f"{SESSION_COOKIE}={sid}; Path=/; HttpOnly; SameSite=Lax; Max-Age={SESSION_LIFETIME}")]
+
+    try:
+        payload = json.loads(await read_body(receive) or b'{}')
+        user_message = payload.get('message', '').strip()
+        status, body = 200, {"response": await respond_async(user_message, session, identities)}
+    except RateLimitExceeded as e:
+        body, retry_after = rate_limited_payload(e)
+        status = 429
+        extra_headers.append(('retry-after', str(retry_after)))
+    except Exception as e:
+        logger.error(f"Ошибка обработки: {e}")
+        status, body = 200, {"response": CHAT_ERROR_RESPONSE}
+
+    await send_response(send, status, body, headers=extra_headers)
+
+
+async def send_file(send, path, base_dir):
+    """Файл из base_dir; пути за его пределами - 404"""
+    path = os.path.normpath(os.path.join(base_dir, path))
+    if not path.startswith(base_dir + os.sep) or not os.path.isfile(path):
+        await send_response(send, 404, {"error": "Not found"})
+        return
+    with open(path, 'rb') as f:
+        body = f.read()
+    await send_response(send, 200, body, mimetypes.guess_type(path)[0] or 'application/octet-stream')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            job_queue.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # ID запроса для записей лога; тот же ID уходит клиенту в заголовке x-request-id
+    token = set_request_id(request_headers(scope).get('x-request-id'))
+    request_id = get_request_id().encode('latin-1', 'replace')
+
+    async def send_with_request_id(message):
+        if message['type'] == 'http.response.start':
+            message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', request_id)]
+        await send(message)
+
+    try:
+        await route(scope, receive, send_with_request_id)
+    finally:
+        reset_request_id(token)
+
+
+async def route(scope, receive, send):
+    path, method = scope['path'], scope['method']
+    if path == '/chat':
+        if method != 'POST':
+            await send_response(send, 405, {"error": "Method not allowed"}, headers=[('allow', 'POST')])
+            return
+        await chat(scope, receive, send)
+    elif path == '/health':
+        # job_queue.counts() - запрос к SQLite (до 30 с при блокировке), не в цикле событий
+        await send_response(send, 200, await asyncio.to_thread(health_status))
+    elif path.startswith('/track/') and len(path) > len('/track/'):
+        await send_response(send, 200, track_status(path[len('/track/'):]))
+    elif path == '/':
+        await send_file(send, 'index.html', TEMPLATES_DIR)
+    elif path.startswith('/static/'):
+        await send_file(send, path[len('/static/'):], STATIC_DIR)
+    else:
+        await send_response(send, 404, {"error": "Not found"})
@@ -0,0 +1,276 @@
+"""
+Состояние диалогов Telegram-ботов в SQLite: недозаполненный договор или приемка переживают перезапуск.
+
+Хранятся user_data и шаги ConversationHandler (persistent=True), каждая запись - одна строка
+с компактным JSON. Изменения копятся в памяти и пишутся одной транзакцией раз в
+BOT_STATE_FLUSH_SECONDS (update_interval python-telegram-bot). Разговор, к которому не возвращались
+дольше BOT_STATE_TTL_HOURS, удаляется и из базы, и из памяти бота, поэтому память не растет
+от брошенных диалогов. Несколько ботов делят один файл: записи разделены namespace (код бота).
+
+    python bot_persistence.py stats
+    python bot_persistence.py bench --operators 5000
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+BOT_STATE_DB = os.getenv('BOT_STATE_DB', 'data/bot_state.db')
+BOT_STATE_FLUSH_SECONDS = float(os.getenv('BOT_STATE_FLUSH_SECONDS', '5'))
+BOT_STATE_TTL = float(os.getenv('BOT_STATE_TTL_HOURS', '48')) * 3600
+# Как часто искать брошенные разговоры
+EXPIRY_INTERVAL = 600
+
+USER = 'user'
+CONVERSATION = 'conversation:'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bot_state (
+    namespace TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, kind, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bot_state_updated ON bot_state (namespace, updated_at);
+"""
+
+UPSERT = """
+INSERT INTO bot_state (namespace, kind, key, value, updated_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (namespace, kind, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+"""
+
+
+def pack(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot: user_data и разговоры одного бота (namespace)"""
+
+    def __init__(self, namespace, path=BOT_STATE_DB, ttl=BOT_STATE_TTL, update_interval=BOT_STATE_FLUSH_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.namespace = namespace
+        self.path = path
+        self.ttl = ttl
+        self.connection = None
+        # (kind, key) -> JSON или None (удалить); пишется одной транзакцией
+        self.pending = {}
+        self.write_scheduled = False
+
+    def db(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def load(self, kind):
+        """Непросроченные записи вида kind: [(key, value)]"""
+        rows = self.db().execute(
+            "SELECT key, value FROM bot_state WHERE namespace = ? AND kind = ? AND updated_at >= ?",
+            (self.namespace, kind, time.time() - self.ttl)
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def put(self, kind, key, value):
+        if value is not None:
+            try:
+                value = pack(value)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"⚠️ Состояние {self.namespace}/{kind}/{key} не сохранено: {e}")
+                return
+        self.pending[(kind, key)] = value
+        # Application.update_persistence вызывает update_* для всех измененных записей разом;
+        # запись в базу - после них, одной транзакцией
+        if not self.write_scheduled:
+            self.write_scheduled = True
+            asyncio.get_running_loop().call_soon(self.write_pending)
+
+    def write_pending(self):
+        self.write_scheduled = False
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        now = time.time()
+        db = self.db()
+        with db:
+            db.executemany(UPSERT, [
+                (self.namespace, kind, key, value, now) for (kind, key), value in pending.items() if value is not None
+            ])
+            db.executemany("DELETE FROM bot_state WHERE namespace = ? AND kind = ? AND key = ?", [
+                (self.namespace, kind, key) for (kind, key), value in pending.items() if value is None
+            ])
+
+    def expired(self):
+        """Удаляет из базы записи старше TTL; возвращает их [(kind, key)]"""
+        cutoff = time.time() - self.ttl
+        db = self.db()
+        with db:
+            rows = db.execute(
+                "SELECT kind, key FROM bot_state WHERE namespace = ? AND updated_at < ?", (self.namespace, cutoff)
+            ).fetchall()
+            db.execute("DELETE FROM bot_state WHERE namespace = ? AND updated_at < ?", (self.namespace, cutoff))
+        return rows
+
+    # --- BasePersistence ---
+    async def get_user_data(self):
+        return {int(key): value for key, value in self.load(USER)}
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state for key, state in self.load(CONVERSATION + name)}
+
+    async def update_user_data(self, user_id, data):
+        self.put(USER, str(user_id), data)
+
+    async def drop_user_data(self, user_id):
+        self.put(USER, str(user_id), None)
+
+    async def update_conversation(self, name, key, new_state):
+        self.put(CONVERSATION + name, pack(list(key)), new_state)
+
+    async def flush(self):
+        self.write_pending()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # chat_data, bot_data и callback_data ботам не нужны (store_data их выключает)
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def drop_expired(application):
+    """Убирает брошенные разговоры из базы и из памяти бота; возвращает число удаленных записей"""
+    persistence = application.persistence
+    persistence.write_pending()
+    conversations = {
+        handler.name: handler
+        for handlers in application.handlers.values() for handler in handlers
+        if isinstance(handler, ConversationHandler) and handler.persistent
+    }
+    rows = persistence.expired()
+    for kind, key in rows:
+        if kind == USER:
+            application.drop_user_data(int(key))
+        elif kind.startswith(CONVERSATION) and kind[len(CONVERSATION):] in conversations:
+            # Публичного способа завершить чужой разговор у ConversationHandler нет
+            conversations[kind[len(CONVERSATION):]]._conversations.pop(tuple(json.loads(key)), None)
+    if rows:
+        logger.info(f"🧹 Бот {persistence.namespace}: удалено брошенных записей: {len(rows)}")
+    return len(rows)
+
+
+async def expire_abandoned(application, interval=EXPIRY_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            drop_expired(application)
+        except Exception as e:
+            logger.error(f"❌ Очистка состояния бота: {e}")
+
+
+def start_expiry(applications):
+    """Фоновые задачи очистки для ботов с SQLitePersistence (вызывать в работающем цикле событий)"""
+    return [
+        asyncio.create_task(expire_abandoned(application))
+        for application in applications if isinstance(application.persistence, SQLitePersistence)
+    ]
+
+
+# --- ЗАМЕР ---
+async def bench(operators, path):
+    """N операторов посреди договора: время сброса, размер базы, восстановление и очистка по TTL"""
+    if os.path.exists(path):
+        os.remove(path)
+    persistence = SQLitePersistence('bench', path=path)
+    for user_id in range(operators):
+        await persistence.update_user_data(user_id, {
+            'c_name': f"Клиент {user_id}", 'c_phone': '+7 700 000 00 00', 'c_city': 'Алматы',
+            'c_cargo': 'Одежда', 'c_weight': 120.5, 'c_volume': 0.8, 'c_density': 150.6,
+        })
+        await persistence.update_conversation('contract', (user_id, user_id), 7)
+    started = time.perf_counter()
+    persistence.write_pending()
+    flushed = time.perf_counter() - started
+    await persistence.flush()
+    size = os.path.getsize(path) + (os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0)
+    print(f"💾 Сброс {operators} операторов: {flushed * 1000:.0f} мс, база {size / operators:.0f} байт на оператора")
+
+    # "Перезапуск": новый экземпляр поднимает те же разговоры
+    restarted = SQLitePersistence('bench', path=path)
+    users, conversations = await restarted.get_user_data(), await restarted.get_conversations('contract')
+    assert len(users) == operators and conversations[(0, 0)] == 7 and users[0]['c_weight'] == 120.5
+    print(f"✅ После перезапуска: {len(users)} user_data, {len(conversations)} разговоров")
+
+    restarted.ttl = 0
+    assert len(restarted.expired()) == 2 * operators and not await restarted.get_user_data()
+    print("✅ Просроченные записи удалены")
+    await restarted.flush()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Состояние диалогов ботов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="записей по ботам")
+    bench_parser = commands.add_parser('bench', help="сброс, восстановление и очистка на N операторах")
+    bench_parser.add_argument('--operators', type=int, default=5000)
+    bench_parser.add_argument('--path', default='data/bot_state_bench.db')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'stats':
+        connection = sqlite3.connect(BOT_STATE_DB)
+        connection.executescript(SCHEMA)
+        rows = connection.execute("""
+            SELECT namespace, kind, COUNT(*), SUM(LENGTH(value)), MIN(updated_at)
+            FROM bot_state GROUP BY namespace, kind ORDER BY namespace, kind
+        """).fetchall()
+        for namespace, kind, count, size, oldest in rows:
+            print(f"📦 {namespace} {kind}: {count} записей, {size} байт, самая старая {(time.time() - oldest) / 3600:.1f} ч назад")
+    else:
+        asyncio.run(bench(args.operators, args.path))
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
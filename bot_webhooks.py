@@ -0,0 +1,367 @@
+"""
+Доставка обновлений Telegram ботам: long polling или webhook.
+
+BOT_MODE=polling (по умолчанию) - каждый бот сам опрашивает getUpdates, как раньше.
+BOT_MODE=webhook - Telegram сам присылает обновления POST-запросом на WEBHOOK_BASE_URL/telegram/<код бота>.
+Запрос без верного заголовка X-Telegram-Bot-Api-Secret-Token (TELEGRAM_WEBHOOK_SECRET) отклоняется.
+Обновление кладется в очередь бота (BOT_UPDATE_QUEUE_SIZE); если очередь полна, отвечаем 503,
+и Telegram повторит доставку позже.
+
+Процесс webhook должен быть ровно один (uvicorn без --workers, один экземпляр сервиса): состояние диалогов
+ConversationHandler живет в памяти процесса и в его локальном файле SQLite (bot_persistence), поэтому
+обновления одного оператора, попавшие в разные процессы, видели бы разные шаги диалога.
+
+    uvicorn bot_webhooks:app --host 0.0.0.0 --port $PORT     # все боты (админ и склады) в одном процессе
+    python bot_webhooks.py bench --updates 2000               # обновлений в секунду: polling против webhook
+    python bot_webhooks.py replay updates.jsonl --url http://127.0.0.1:8443/telegram/guangzhou
+"""
+import os
+import hmac
+import json
+import time
+import signal
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler
+from telegram.request import BaseRequest
+
+from bot_persistence import SQLitePersistence, start_expiry
+
+logger = logging.getLogger(__name__)
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес сервиса (https://...), на него Telegram шлет обновления
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')
+WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+WEBHOOK_PATH = '/telegram/'
+# Сколько обновлений бот держит в очереди, пока обработчики заняты
+UPDATE_QUEUE_SIZE = int(os.getenv('BOT_UPDATE_QUEUE_SIZE', '1000'))
+# Одновременных запросов от Telegram на бота (max_connections в setWebhook, не больше 100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+MAX_UPDATE_BYTES = 1024 * 1024
+PORT = int(os.getenv('PORT', '8443'))
+
+
+def application_builder(token, mode=None, state=None):
+    """
+    Builder приложения бота с очередью обновлений ограниченного размера; в режиме webhook - без Updater.
+    state - namespace бота в bot_persistence: разговоры переживают перезапуск.
+    """
+    builder = Application.builder().token(token).update_queue(asyncio.Queue(UPDATE_QUEUE_SIZE))
+    if (mode or BOT_MODE) == 'webhook':
+        builder = builder.updater(None)
+    if state:
+        builder = builder.persistence(SQLitePersistence(state))
+    return builder
+
+
+# --- WEBHOOK ---
+class WebhookServer:
+    """
+    ASGI-приложение: POST /telegram/<код> кладет Update в очередь бота с этим кодом.
+    Одно на сервис - диалоги ботов хранятся в этом процессе (см. описание модуля).
+    """
+
+    def __init__(self, bots, secret=WEBHOOK_SECRET, base_url=WEBHOOK_BASE_URL):
+        if not secret:
+            raise RuntimeError("❌ TELEGRAM_WEBHOOK_SECRET не задан: без него webhook принимал бы обновления от кого угодно")
+        self.bots = bots
+        self.secret = secret.encode('utf-8')
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.received = 0
+        self.rejected = 0
+        self.sweepers = []
+
+    async def startup(self):
+        for code, application in self.bots.items():
+            await application.initialize()
+            await application.start()
+            # Без base_url (тесты, bench) webhook в Telegram не регистрируется
+            if self.base_url:
+                await application.bot.set_webhook(
+                    f"{self.base_url}{WEBHOOK_PATH}{code}",
+                    secret_token=self.secret.decode('utf-8'),
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS
+                )
+            logger.info(f"🚀 Бот {code}: webhook {WEBHOOK_PATH}{code}")
+        self.sweepers = start_expiry(self.bots.values())
+
+    async def shutdown(self):
+        # Webhook в Telegram не снимаем: при перезапуске обновления подождут на стороне Telegram
+        for sweeper in self.sweepers:
+            sweeper.cancel()
+        for application in self.bots.values():
+            await application.stop()
+            await application.shutdown()
+
+    def deliver(self, code, secret, body):
+        """(статус, ответ) для одного обновления от Telegram"""
+        application = self.bots.get(code)
+        if application is None:
+            return 404, {"error": "Not found"}
+        if not hmac.compare_digest((secret or '').encode('utf-8'), self.secret):
+            self.rejected += 1
+            return 403, {"error": "Forbidden"}
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception as e:
+            logger.warning(f"⚠️ Бот {code}: не разобрали обновление: {e}")
+            return 400, {"error": "Bad update"}
+        try:
+            application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(f"⚠️ Бот {code}: очередь обновлений полна ({UPDATE_QUEUE_SIZE}), Telegram повторит доставку")
+            return 503, {"error": "Busy"}
+        self.received += 1
+        return 200, {"ok": True}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await self.startup()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await self.shutdown()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path']
+        if path == '/health':
+            status, body = 200, {"bots": sorted(self.bots), "received": self.received, "rejected": self.rejected}
+        elif scope['method'] != 'POST' or not path.startswith(WEBHOOK_PATH):
+            status, body = 404, {"error": "Not found"}
+        else:
+            headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+            payload = b''
+            while True:
+                message = await receive()
+                payload += message.get('body', b'')
+                if len(payload) > MAX_UPDATE_BYTES or not message.get('more_body'):
+                    break
+            if len(payload) > MAX_UPDATE_BYTES:
+                status, body = 413, {"error": "Too large"}
+            else:
+                status, body = self.deliver(path[len(WEBHOOK_PATH):], headers.get('x-telegram-bot-api-secret-token'), payload)
+
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('latin-1'))],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+# --- POLLING ---
+async def run_polling(bots):
+    """Все боты в одном цикле событий, у каждого свой getUpdates, до SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    started, sweepers = [], []
+    try:
+        for code, application in bots.items():
+            await application.initialize()
+            await application.start()
+            # start_polling сам снимает webhook, если бот раньше работал в режиме webhook
+            await application.updater.start_polling()
+            started.append(application)
+            logger.info(f"🚀 Бот {code}: polling")
+        sweepers = start_expiry(started)
+        await stop.wait()
+    finally:
+        for sweeper in sweepers:
+            sweeper.cancel()
+        for application in reversed(started):
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+
+
+def serve(bots):
+    """Запуск ботов {код: Application} в режиме BOT_MODE"""
+    if BOT_MODE == 'webhook':
+        import uvicorn
+        uvicorn.run(WebhookServer(bots), host='0.0.0.0', port=PORT)
+    else:
+        asyncio.run(run_polling(bots))
+
+
+def load_all_bots():
+    """Админ-бот и все склады с токенами; заодно запускает их очереди заданий"""
+    import admin_bot
+    import warehouse_bot
+
+    bots = {'admin': admin_bot.build_application()}
+    bots.update(warehouse_bot.build_bots())
+    admin_bot.job_queue.start()
+    warehouse_bot.outbox.start()
+    return bots
+
+
+_server = None
+
+async def app(scope, receive, send):
+    """uvicorn bot_webhooks:app - боты создаются при первом обращении (lifespan), а не при импорте"""
+    global _server
+    if _server is None:
+        _server = WebhookServer(load_all_bots())
+    await _server(scope, receive, send)
+
+
+# --- ЗАМЕР ---
+def sample_update(update_id):
+    """Записанное обновление: команда /start от одного из 50 кладовщиков"""
+    user = {"id": 1000 + update_id % 50, "is_bot": False, "first_name": "Склад"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private"},
+            "from": user,
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+
+class RecordedBotApi(BaseRequest):
+    """Bot API без сети: getUpdates отдает записанные обновления, sendMessage сразу отвечает успехом"""
+
+    def __init__(self, updates=()):
+        self.updates = list(updates)
+        self.sent = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif api_method == 'getUpdates':
+            offset = int(parameters.get('offset') or 0)
+            # offset подтверждает все обновления до него
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            result = self.updates[:100]
+            if not result:
+                # Долгий опрос без новых обновлений
+                await asyncio.sleep(0.05)
+        elif api_method == 'sendMessage':
+            self.sent += 1
+            result = {"message_id": self.sent, "date": int(time.time()), "chat": {"id": int(parameters['chat_id']), "type": "private"}, "text": parameters.get('text')}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode('utf-8')
+
+
+async def bench_mode(mode, count, concurrency=WEBHOOK_MAX_CONNECTIONS):
+    """Обновлений в секунду от получения до ответа бота: polling (getUpdates) или webhook (POST в ASGI)"""
+    import httpx
+
+    updates = [sample_update(update_id) for update_id in range(1, count + 1)]
+    api = RecordedBotApi(updates if mode == 'polling' else ())
+    application = application_builder('1:bench', mode).request(api).get_updates_request(api).build()
+    handled = asyncio.Event()
+
+    async def start(update, context):
+        await update.message.reply_text("🏭 Ожидание команд...")
+        if api.sent >= count:
+            handled.set()
+
+    application.add_handler(CommandHandler('start', start))
+
+    started = time.perf_counter()
+    if mode == 'polling':
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling(poll_interval=0)
+        await handled.wait()
+        elapsed = time.perf_counter() - started
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        return elapsed
+
+    server = WebhookServer({'bench': application}, secret='bench-secret', base_url=None)
+    await server.startup()
+    slots = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': 'bench-secret'}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server), base_url='http://bench') as client:
+        async def post(update):
+            async with slots:
+                while (await client.post(f"{WEBHOOK_PATH}bench", json=update, headers=headers)).status_code == 503:
+                    await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(post(update) for update in updates))
+        await handled.wait()
+        elapsed = time.perf_counter() - started
+        # Проверка секрета: чужой запрос не доходит до бота
+        forbidden = await client.post(f"{WEBHOOK_PATH}bench", json=updates[0], headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        assert forbidden.status_code == 403 and api.sent == count
+    await server.shutdown()
+    return elapsed
+
+
+def replay(path, url, secret, sample=0):
+    """Отправляет записанные обновления (JSON по строке) в запущенный webhook; возвращает {статус: количество}"""
+    import requests
+
+    if sample:
+        updates = [sample_update(update_id) for update_id in range(1, sample + 1)]
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    statuses = {}
+    started = time.perf_counter()
+    with requests.Session() as session:
+        for update in updates:
+            response = session.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret or ''}, timeout=10)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+    print(f"📨 Отправлено {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с): {statuses}")
+    return statuses
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Webhook и polling для Telegram-ботов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="обновлений в секунду в обоих режимах")
+    bench_parser.add_argument('--updates', type=int, default=2000)
+    replay_parser = commands.add_parser('replay', help="отправить записанные обновления в webhook")
+    replay_parser.add_argument('path', nargs='?', help="файл с Update JSON, по одному на строку")
+    replay_parser.add_argument('--url', required=True, help="http://хост:порт/telegram/<код бота>")
+    replay_parser.add_argument('--secret', default=WEBHOOK_SECRET)
+    replay_parser.add_argument('--sample', type=int, default=0, help="вместо файла - N команд /start")
+    args = parser.parse_args()
+
+    # В bench очередь заполняется нарочно - предупреждения о 503 не печатаем
+    logging.basicConfig(level=logging.ERROR if args.command == 'bench' else logging.WARNING, format='%(message)s')
+    if args.command == 'bench':
+        for mode in ('polling', 'webhook'):
+            elapsed = asyncio.run(bench_mode(mode, args.updates))
+            print(f"📊 {mode}: {args.updates} обновлений за {elapsed:.2f} с, {args.updates / elapsed:.0f} обновлений/с")
+    else:
+        if not args.path and not args.sample:
+            parser.error("нужен файл с обновлениями или --sample N")
+        replay(args.path, args.url, args.secret, args.sample)
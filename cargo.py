@@ -0,0 +1,353 @@
+import re
+import csv
+import io
+import math
+import logging
+
+from tariffs import DEFAULT_CATEGORY, COMMISSION
+
+logger = logging.getLogger(__name__)
+
+# Разделители позиций в одном сообщении: перенос строки, ";", "+", "плюс", "и"
+ITEM_SEPARATOR_PATTERN = re.compile(r'\n|;|\+|\s(?:плюс|и|а также)\s')
+QUANTITY_PATTERN = re.compile(
+    r'(?<!\d)(\d+)\s*(?:шт\w*|штук\w*|коробк\w*|короб\w*|мест\w*|ящик\w*|паллет\w*|мешк\w*|упаков\w*|пачк\w*|рулон\w*)'
+)
+# "2 дивана", "10 стульев" - число в начале позиции перед словом, которое не является единицей измерения
+LEADING_QUANTITY_PATTERN = re.compile(
+    r'^\s*(\d+)\s+(?!(?:кг|kg|кило|килограмм|куб|м3|м³|м|m|см|cm|мм|x|х|на)\b)[а-яa-z]'
+)
+WEIGHT_PATTERN = re.compile(r'(по\s+|каждая\s+|каждый\s+)?(?<!\d)(\d+(?:[.,]\d+)?)\s*(?:кг|kg|килограмм\w*|кило)')
+PER_PIECE_VOLUME_PATTERN = re.compile(r'(?:по|кажд\w*)\s+\d+(?:[.,]\d+)?\s*(?:куб|м3|м³)')
+
+CSV_COLUMNS = {
+    'product': ('product', 'товар', 'наименование'),
+    'quantity': ('quantity', 'количество', 'кол-во', 'мест'),
+    'weight': ('weight', 'вес', 'вес_кг'),
+    'volume': ('volume', 'объем', 'объём'),
+    'length': ('length', 'длина'),
+    'width': ('width', 'ширина'),
+    'height': ('height', 'высота'),
+}
+
+# Максимум позиций в одном расчете и мест в одной позиции
+MAX_ITEMS = 1000
+MAX_QUANTITY = 100000
+
+# Позиций в сессии /chat: сессия живет в cookie, а браузер отбрасывает cookie больше 4 КБ
+MAX_SESSION_ITEMS = 40
+
+
+def parse_number(value):
+    if value is None:
+        return None
+    value = str(value).strip().replace(',', '.')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def make_item(product, category, quantity, weight, volume):
+    """Позиция груза: вес и объем - суммарные по всем местам позиции"""
+    return {
+        'product': product,
+        'category': category or DEFAULT_CATEGORY,
+        'quantity': quantity,
+        'weight': weight,
+        'volume': volume,
+    }
+
+
+def parse_items_from_text(text, find_category, extract_dimensions, extract_volume):
+    """
+    Разбирает сообщение с несколькими позициями груза:
+    "10 коробок косметики по 5 кг 40x30x30 + 2 дивана по 80 кг 220x90x80"
+    Возвращает список позиций; позиции без веса или объема пропускаются.
+    """
+    segments = []
+    for part in ITEM_SEPARATOR_PATTERN.split(text.lower()):
+        part = part.strip(' ,.')
+        if not part:
+            continue
+        # Кусок без цифр ("столы и стулья") относится к соседней позиции
+        if segments and not re.search(r'\d', part):
+            segments[-1] = f"{segments[-1]} {part}"
+        elif segments and not re.search(r'\d', segments[-1]):
+            segments[-1] = f"{segments[-1]} {part}"
+        else:
+            segments.append(part)
+
+    items = []
+    for segment in segments[:MAX_ITEMS]:
+        quantity_match = QUANTITY_PATTERN.search(segment) or LEADING_QUANTITY_PATTERN.search(segment)
+        quantity = int(quantity_match.group(1)) if quantity_match else 1
+        quantity = max(quantity, 1)
+
+        weight_match = WEIGHT_PATTERN.search(segment)
+        if not weight_match:
+            continue
+        weight = float(weight_match.group(2).replace(',', '.'))
+        if weight_match.group(1):
+            weight *= quantity
+
+        # Габариты указываются на одно место, объем - на одно место только с "по"
+        volume = extract_volume(segment)
+        if volume:
+            if PER_PIECE_VOLUME_PATTERN.search(segment):
+                volume *= quantity
+        else:
+            length, width, height = extract_dimensions(segment)
+            if length and width and height:
+                volume = length * width * height * quantity
+        if not volume:
+            continue
+
+        items.append(make_item(segment, find_category(segment), quantity, weight, volume))
+
+    return items
+
+
+def checked_number(raw_value, number, name):
+    """Неотрицательное конечное число из поля позиции; пустое поле - None, иначе ValueError"""
+    if raw_value in (None, ''):
+        return None
+    value = parse_number(raw_value)
+    if value is None or not math.isfinite(value) or value < 0:
+        raise ValueError(f"Позиция {number}: {name} должен быть неотрицательным числом")
+    return value
+
+
+def checked_quantity(raw_value, number):
+    """Количество мест: целое от 1 до MAX_QUANTITY, пустое поле - 1"""
+    if raw_value in (None, ''):
+        return 1
+    quantity = parse_number(raw_value)
+    if quantity is None or not math.isfinite(quantity) or quantity < 1 or quantity != int(quantity) or quantity > MAX_QUANTITY:
+        raise ValueError(f"Позиция {number}: количество должно быть целым числом от 1 до {MAX_QUANTITY}")
+    return int(quantity)
+
+
+def parse_items_from_csv(csv_text, find_category):
+    """
+    Разбирает CSV с позициями груза.
+    Колонки (рус. или англ.): товар, количество, вес (на место, кг), объем (на место, м³) или длина/ширина/высота (см).
+    Строки без веса или объема пропускаются; отрицательные, нечисловые и бесконечные значения - ValueError.
+    """
+    reader = csv.DictReader(io.StringIO(csv_text), delimiter=';' if csv_text.count(';') > csv_text.count(',') else ',')
+    if not reader.fieldnames:
+        return []
+
+    columns = {}
+    for field in reader.fieldnames:
+        name = field.strip().lower()
+        for column, aliases in CSV_COLUMNS.items():
+            if name in aliases:
+                columns[column] = field
+
+    items = []
+    for number, row in enumerate(reader, 1):
+        if len(items) >= MAX_ITEMS:
+            logger.warning(f"CSV обрезан до {MAX_ITEMS} позиций")
+            break
+
+        def value(column, name):
+            return checked_number(row.get(columns[column]), number, name) if column in columns else None
+
+        product = (row.get(columns['product']) or '').strip() if 'product' in columns else ''
+        quantity = checked_quantity(row.get(columns['quantity']) if 'quantity' in columns else None, number)
+        weight = value('weight', "вес")
+        volume = value('volume', "объем")
+        if not volume:
+            length, width, height = value('length', "длина"), value('width', "ширина"), value('height', "высота")
+            if length and width and height:
+                volume = length * width * height / 1_000_000
+        if not weight or not volume:
+            continue
+
+        items.append(make_item(product, find_category(product), quantity, weight * quantity, volume * quantity))
+
+    return items
+
+
+def parse_items_from_json(raw_items, find_category):
+    """
+    Разбирает позиции из JSON: [{"product", "quantity", "weight" (на место, кг), "volume" (на место, м³)}].
+    Позиции без веса или объема пропускаются, как в CSV; нечисловые значения - ValueError.
+    """
+    if not isinstance(raw_items, list):
+        raise ValueError("items должен быть списком позиций")
+    if len(raw_items) > MAX_ITEMS:
+        raise ValueError(f"Не больше {MAX_ITEMS} позиций в одном расчете")
+
+    items = []
+    for number, raw in enumerate(raw_items, 1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"Позиция {number}: ожидается объект")
+
+        product = str(raw.get('product') or '').strip()
+        weight = checked_number(raw.get('weight'), number, "вес")
+        volume = checked_number(raw.get('volume'), number, "объем")
+        quantity = checked_quantity(raw.get('quantity'), number)
+        if not weight or not volume:
+            continue
+
+        items.append(make_item(product, find_category(product), quantity, weight * quantity, volume * quantity))
+
+    return items
+
+
+def pack_items(items):
+    """
+    Позиции для сессии: только [категория, мест, вес, объем], без текста сообщения.
+    Если позиций больше MAX_SESSION_ITEMS, позиции одной категории объединяются в одну партию.
+    """
+    packed = [[item['category'], item['quantity'], item['weight'], item['volume']] for item in items]
+    if len(packed) > MAX_SESSION_ITEMS:
+        merged = {}
+        for category, quantity, weight, volume in packed:
+            total = merged.setdefault(category, [category, 0, 0, 0])
+            total[1] += quantity
+            total[2] += weight
+            total[3] += volume
+        packed = list(merged.values())[:MAX_SESSION_ITEMS]
+    return packed
+
+
+def unpack_items(packed):
+    """Позиции из сессии: вместо названия товара - категория. Полные позиции из старых сессий - как есть."""
+    return [entry if isinstance(entry, dict) else make_item(entry[0], *entry) for entry in packed]
+
+
+class CargoQuoter:
+    """
+    Расчет сборного груза из нескольких позиций.
+    Тарифы - те же, что в /chat (TariffCalculator): поиск тарифа Т1 - бинарный поиск по порогам плотности,
+    Т2 считается один раз на весь груз.
+    """
+
+    def __init__(self, calculator):
+        self.calculator = calculator
+
+    def price_t1(self, category, weight, volume):
+        """Стоимость Т1 в USD для партии одной категории. None если тариф не подобран."""
+        density = weight / volume
+        rule = self.calculator.find_rule(category, density)
+        if not rule:
+            return None, None, density
+        return self.calculator.t1_cost_usd(rule, weight, volume), rule, density
+
+    def _price_groups(self, groups):
+        """Цена набора партий: [(название, категория, вес, объем)] -> (USD, детали) или None"""
+        total_usd = 0
+        details = []
+        for name, category, weight, volume in groups:
+            cost_usd, rule, density = self.price_t1(category, weight, volume)
+            if cost_usd is None:
+                return None, None
+            total_usd += cost_usd
+            details.append({
+                'name': name, 'category': category, 'weight': weight, 'volume': volume,
+                'density': density, 'rule': rule, 't1_cost_usd': cost_usd
+            })
+        return total_usd, details
+
+    def quote(self, items, zone, rate):
+        """
+        Считает варианты группировки позиций по курсу rate (RateSnapshot) и выбирает самый дешевый:
+        - separate: каждая позиция по своей плотности
+        - by_category: позиции одной категории объединяются
+        - consolidated: весь груз одной партией по самой дорогой из категорий груза
+        """
+        if not items:
+            return None
+
+        total_weight = sum(item['weight'] for item in items)
+        total_volume = sum(item['volume'] for item in items)
+
+        by_category = {}
+        for item in items:
+            weight, volume = by_category.get(item['category'], (0, 0))
+            by_category[item['category']] = (weight + item['weight'], volume + item['volume'])
+
+        consolidated = None
+        for category in by_category:
+            cost_usd, details = self._price_groups([("весь груз", category, total_weight, total_volume)])
+            if cost_usd is not None and (consolidated is None or cost_usd > consolidated[0]):
+                consolidated = (cost_usd, details)
+
+        variants = {
+            'separate': self._price_groups(
+                [(item['product'], item['category'], item['weight'], item['volume']) for item in items]
+            ),
+            'by_category': self._price_groups(
+                [(category, category, weight, volume) for category, (weight, volume) in by_category.items()]
+            ),
+            'consolidated': consolidated or (None, None),
+        }
+
+        t2_cost_kzt = self.calculator.t2_cost(total_weight, zone)
+
+        groupings = []
+        for name, (t1_cost_usd, details) in variants.items():
+            if t1_cost_usd is None:
+                continue
+            t1_cost_kzt = t1_cost_usd * rate.rate
+            groupings.append({
+                'grouping': name,
+                'groups': details,
+                't1_cost_usd': t1_cost_usd,
+                't1_cost': t1_cost_kzt,
+                't2_cost': t2_cost_kzt,
+                'total': (t1_cost_kzt + t2_cost_kzt) * COMMISSION,
+            })
+
+        if not groupings:
+            return None
+
+        return {
+            'items': items,
+            'total_weight': total_weight,
+            'total_volume': total_volume,
+            'zone': zone,
+            'groupings': groupings,
+            'best': min(groupings, key=lambda grouping: grouping['total']),
+            'exchange_rate': rate.rate,
+            'rate_timestamp': rate.timestamp,
+        }
+
+
+GROUPING_NAMES = {
+    'separate': "Каждая позиция отдельно",
+    'by_category': "Объединение по категориям",
+    'consolidated': "Сборный груз одной партией",
+}
+
+
+def format_cargo_quote(quote, city):
+    """Текст ответа для сборного груза"""
+    best = quote['best']
+    lines = [f"📦 **Сборный груз: {len(quote['items'])} позиций в г. {city.capitalize()}**\n"]
+    for item in quote['items']:
+        lines.append(
+            f"• {item['product']} — {item['quantity']} шт., {item['weight']:g} кг, "
+            f"{item['volume']:.3f} м³ ({item['category']})"
+        )
+    lines.append(f"\n⚖️ **Итого:** {quote['total_weight']:g} кг, {quote['total_volume']:.3f} м³\n")
+
+    lines.append("**Варианты группировки (Т1 + Т2 + комиссия 20%):**")
+    for grouping in sorted(quote['groupings'], key=lambda grouping: grouping['total']):
+        mark = "✅" if grouping is best else "▫️"
+        lines.append(f"{mark} {GROUPING_NAMES[grouping['grouping']]}: ≈ **{grouping['total']:,.0f} тенге**")
+
+    lines.append(
+        f"\n💰 **Лучший вариант:** {GROUPING_NAMES[best['grouping']]}\n"
+        f"• Т1: ${best['t1_cost_usd']:.2f} = {best['t1_cost']:.0f} тенге\n"
+        f"• Т2 до двери: {best['t2_cost']:.0f} тенге\n"
+        f"• ИТОГО: ≈ **{best['total']:,.0f} тенге**\n\n"
+        f"✅ **Оставить заявку?** Напишите ваше имя и телефон!\n"
+        f"🔄 **Новый расчет?** Напишите **Старт**"
+    )
+    return "\n".join(lines)
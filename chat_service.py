@@ -0,0 +1,981 @@
+"""
+Логика чата без привязки к веб-фреймворку: конфигурация, тарифы, извлечение данных, диалог и сессия.
+Используется точками входа app.py (Flask, WSGI) и asgi.py. Сессия - любой словарь,
+идентификаторы клиента для лимитов передает точка входа.
+"""
+import os
+import re
+import json
+import math
+import asyncio
+import logging
+from datetime import datetime
+import google.generativeai as genai
+from google.generativeai.types import GenerationConfig
+from dotenv import load_dotenv
+import extraction
+from extraction import (
+    find_product_category, extract_dimensions, extract_packages, extract_volume, check_dimensions_exceeded,
+    extract_contact_info
+)
+from dimensions import total_volume
+from faq_engine import FaqEngine
+from track_registry import TrackRegistry, load_track_registry
+from cargo import CargoQuoter, parse_items_from_text, format_cargo_quote, pack_items, unpack_items
+from rate_limit import create_rate_limiter
+from exchange_rates import create_rate_provider
+from tariffs import TariffCalculator, DEFAULT_CATEGORY, find_zone
+from tariff_tables import TariffTables, TABLE_KEYS, open_tariff_tables
+from dialogue import KeywordClassifier, DialogueStateMachine, LlmRequest, STATES, COLLECTING, QUOTED, AWAITING_CONTACTS
+from logging_setup import setup_logging, log_payload
+from parse_guard import guarded, clip, scan_has_parameters
+from jobs import JobQueue
+from eta import create_eta_model
+
+# Настройка логирования: запись в stderr (и в LOG_FILE, если задан) идет в фоновом потоке
+setup_logging()
+logger = logging.getLogger(__name__)
+
+def load_track_numbers():
+    """
+    Загружает трек-номера в компактный реестр (бинарный файл через mmap, если собран, иначе текстовый)
+    """
+    try:
+        track_numbers = load_track_registry('data/test_track_numbers.txt', 'data/track_numbers.bin')
+        logger.info(f"✅ Загружено {len(track_numbers)} трек-номеров")
+        return track_numbers
+    except FileNotFoundError:
+        logger.error("❌ Файл с трек-номерами не найден")
+        return TrackRegistry()
+
+# Загружаем трек-номера при старте приложения
+track_numbers = load_track_numbers()
+# ETA по истории статусов: таблицы в памяти, история дочитывается в фоне
+eta_model = create_eta_model()
+
+load_dotenv()
+GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+
+# Вес: число + кг
+DELIVERY_WEIGHT_PATTERN = re.compile(r'(?<!\d)\d+\s*(кг|kg|килограмм)')
+# Габариты: число×число×число или числа с единицами
+DELIVERY_SIZE_PATTERN = re.compile(r'(?<!\d)\d+[×x*]\d+[×x*]\d+|(?<!\d)\d+\s*(метр|м|m|см|cm|мм)')
+
+@guarded(scan_has_parameters)
+def has_delivery_parameters(message_lower):
+    """Есть ли в сообщении вес или габариты"""
+    return bool(DELIVERY_WEIGHT_PATTERN.search(message_lower) or DELIVERY_SIZE_PATTERN.search(message_lower))
+
+# ↓↓↓ ВСТАВИТЬ ЗДЕСЬ - класс SmartIntentManager ↓↓↓
+class SmartIntentManager:
+    def __init__(self):
+        self.load_intent_config()
+    
+    def load_intent_config(self):
+        with open('intent_config.json', 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+    
+    def should_switch_to_delivery(self, message):
+        """
+        Строгая проверка - ТОЛЬКО явные признаки доставки
+        Возвращает True только если есть четкие параметры доставки
+        """
+        message_lower = message.lower()
+        
+        # 1. Проверяем числа с единицами измерения
+        has_parameters = self._has_delivery_parameters(message_lower)
+        
+        # 2. Проверяем явные ключевые слова доставки
+        has_delivery_keywords = any(
+            keyword in message_lower 
+            for keyword in self.config["delivery_triggers"]["explicit_keywords"]
+        )
+        
+        # 3. Проверяем города доставки
+        has_city = any(
+            city in message_lower 
+            for city in self.config["delivery_triggers"]["city_keywords"]
+        )
+        
+        # 4. Проверяем типы товаров
+        has_product = any(
+            product in message_lower 
+            for product in self.config["delivery_triggers"]["product_keywords"]
+        )
+        
+        # АКТИВИРУЕМ РЕЖИМ ДОСТАВКИ ТОЛЬКО ЕСЛИ:
+        # - Есть параметры (числа + единицы) ИЛИ
+        # - Явный запрос доставки И параметры/город/товар
+        if has_parameters or (has_delivery_keywords and (has_parameters or has_city or has_product)):
+            return True
+        
+        # ВСЕ остальные случаи - свободный диалог
+        return False
+    
+    def _has_delivery_parameters(self, message_lower):
+        """Проверяет наличие параметров доставки"""
+        return has_delivery_parameters(message_lower)
+    
+    def get_intent_type(self, message):
+        """Определяет тип интента для шаблонных ответов"""
+        message_lower = message.lower()
+        
+        for category, keywords in self.config["free_chat_priority"].items():
+            if any(keyword in message_lower for keyword in keywords):
+                return category
+        
+        return "general_chat"
+# ↑↑↑ КОНЕЦ ВСТАВКИ КЛАССА ↑↑↑
+
+# Локальные ответы на частые вопросы - без обращения к Gemini
+faq_engine = FaqEngine()
+
+# --- ЗАГРУЗКА КОНФИГУРАЦИИ ---
+
+# --- ЗАГРУЗКА КОНФИГУРАЦИИ ---
+def load_config():
+    """Загружает конфигурацию из файла config.json."""
+    try:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            config_data = json.load(f)
+            logger.info(">>> Файл config.json успешно загружен.")
+            return config_data
+    except FileNotFoundError:
+        logger.error("!!! КРИТИЧЕСКАЯ ОШИБКА: Файл config.json не найден!")
+        return None
+    except json.JSONDecodeError:
+        logger.error("!!! КРИТИЧЕСКАЯ ОШИБКА: Неверный формат данных в config.json!")
+        return None
+    except Exception as e:
+        logger.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА при загрузке config.json: {e}")
+        return None
+
+config = load_config()
+
+# Справочники тарифов (T1_RATES_DENSITY, DESTINATION_ZONES, T2_RATES...) процесс держит только
+# в таблицах tariff_tables ниже; из config.json в словарях остаются категории товаров и приветствия
+if config:
+    EXCHANGE_RATE = config.get("EXCHANGE_RATE", {}).get("rate", 550)
+    GREETINGS = config.get("GREETINGS", [])
+    PRODUCT_CATEGORIES = config.get("PRODUCT_CATEGORIES", {})
+else:
+    logger.error("!!! Приложение запускается с значениями по умолчанию из-за ошибки загрузки config.json")
+    EXCHANGE_RATE, GREETINGS, PRODUCT_CATEGORIES = 550, [], {}
+
+# Курс USD/KZT: EXCHANGE_RATE из конфига - только стартовое значение, актуальный курс обновляется в фоне
+rate_provider = create_rate_provider(config)
+
+# Лимиты запросов по сессии и IP (в памяти процесса или в Redis, если задан REDIS_URL)
+rate_limiter = create_rate_limiter(config)
+
+def find_destination_zone(city_name, destination_zones):
+    """
+    Находит зону назначения по названию города
+    """
+    return find_zone(city_name, destination_zones)
+
+# Единый расчет Т1 + Т2. Таблицы тарифов собираются в файл один раз (мастером gunicorn, см. gunicorn.conf.py)
+# и отображаются через mmap: воркеры читают общие страницы вместо собственных копий справочников.
+# Разобранные справочники из config.json после этого не нужны - ссылки на них убираем
+tariff_tables = open_tariff_tables(config) if config else TariffTables.from_config({}, {})
+if config:
+    for key in TABLE_KEYS:
+        config.pop(key, None)
+tariff_calculator = TariffCalculator.from_tables(tariff_tables)
+
+def calculate_shipping_cost(category, weight, volume, destination_city, rate=None):
+    """
+    Полный расчет стоимости доставки по известной категории (тот же расчет, что calculate_quick_cost)
+    """
+    if not tariff_calculator.zone(destination_city):
+        return "Город не найден"
+    if not tariff_calculator.has_category(category):
+        return "Категория не найдена"
+
+    quote = tariff_calculator.quote(weight, category, destination_city, volume, rate or rate_provider.current())
+    if not quote:
+        return "Не удалось подобрать тариф"
+    return quote
+
+# --- ЗАГРУЗКА ПРОМПТА ЛИЧНОСТИ ---
+def load_personality_prompt():
+    """Загружает промпт личности из файла personality_prompt.txt."""
+    try:
+        with open('personality_prompt.txt', 'r', encoding='utf-8') as f:
+            prompt_text = f.read()
+            logger.info(">>> Файл personality_prompt.txt успешно загружен.")
+            return prompt_text
+    except FileNotFoundError:
+        logger.error("!!! Файл personality_prompt.txt не найден! Бот будет отвечать стандартно.")
+        return "Ты — дружелюбный и профессиональный ассистент логистической компании Post Pro. Общайся вежливо, с лёгким позитивом и эмодзи, как живой человек."
+
+PERSONALITY_PROMPT = load_personality_prompt()
+
+# --- СИСТЕМНЫЙ ПРОМПТ ---
+SYSTEM_INSTRUCTION = """
+Ты — умный ассистент компании PostPro. Твоя главная цель — помочь клиенту рассчитать стоимость доставки и оформировать заявку.
+
+***ВАЖНЫЕ ПРАВИЛА:***
+
+1. **СКЛАДЫ В КИТАЕ:** У нас только 2 склада - ИУ и Гуанчжоу. Если клиент спрашивает "откуда заберете?" - отвечай: "Уточните у вашего поставщика, какой склад ему ближе - ИУ или Гуанчжоу"
+
+2. **ТАРИФЫ:**
+   - Т1: Доставка из Китая до Алматы (только до склада, самовывоз)
+   - Т2: Доставка до двери в ЛЮБОМ городе Казахстана, включая доставку по Алматы
+
+3. **ОПЛАТА:**
+   - У нас пост-оплата: вы платите при получении груза
+   - Форматы оплата: безналичный расчет, наличные, Kaspi, Halyk, Freedom Bank
+   - Если спрашивают про оплату - всегда объясняй эту систему
+
+4. **ЛОГИКА ДИАЛОГА:**
+   - Сначала собери все данные для расчета
+   - Покажи итоговую стоимость
+   - Предложи детальный расчет
+   - В конце предлагай заявку
+
+5. **СБОР ЗАЯВКИ:**
+   - Когда клиент пишет имя и телефон - сохраняй заявку
+   - Формат: [ЗАЯВКА] Имя: [имя], Телефон: [телефон]
+
+6. **ОБЩИЕ ВОПРОСЫ:**
+   - Если вопрос не о доставке (погода, имя бота и т.д.) - отвечай нормально
+   - Не зацикливайся только на доставке
+
+7. **НЕ УПОМИНАЙ:** другие города Китая кроме ИУ и Гуанчжоу
+
+Всегда будь дружелюбным и профессиональным! 😊
+"""
+
+# --- ИНИЦИАЛИЗАЦИЯ МОДЕЛИ ---
+model = None
+try:
+    if GEMINI_API_KEY:
+        genai.configure(api_key=GEMINI_API_KEY)
+        model = genai.GenerativeModel(
+            model_name='models/gemini-2.0-flash'
+        )
+        logger.info(">>> Модель Gemini успешно инициализирована.")
+    else:
+        logger.error("!!! API ключ не найден")
+except Exception as e:
+    logger.error(f"!!! Ошибка инициализации Gemini: {e}")
+
+
+def get_t1_density_rule(product_type, weight, volume):
+    """Находит и возвращает правило тарифа Т1 на основе плотности груза."""
+    if not volume or volume <= 0:
+        return None, None
+
+    density = weight / volume
+    category = find_product_category(product_type, PRODUCT_CATEGORIES) or DEFAULT_CATEGORY
+    return tariff_calculator.find_rule(category, density), density
+
+def calculate_t2_cost(weight: float, zone: str):
+    """Расчет стоимости Т2 по прогрессивным тарифам из Excel"""
+    return tariff_calculator.t2_cost(weight, zone)
+
+def calculate_quick_cost(weight: float, product_type: str, city: str, volume: float = None, length: float = None, width: float = None, height: float = None, rate=None):
+    """Быстрый расчет стоимости - единый центр всех расчетов. rate - зафиксированный курс (RateSnapshot), по умолчанию текущий."""
+    try:
+        category = find_product_category(product_type, PRODUCT_CATEGORIES) or DEFAULT_CATEGORY
+        quote = tariff_calculator.quote(weight, category, city, volume, rate or rate_provider.current())
+        if not quote:
+            return None
+
+        quote.update({'length': length, 'width': width, 'height': height})
+        return quote
+    except Exception as e:
+        logger.error(f"Ошибка расчета: {e}")
+        return None
+
+# Расчет сборного груза из нескольких позиций (те же таблицы Т1 и Т2)
+cargo_quoter = CargoQuoter(tariff_calculator)
+
+@guarded()
+def parse_cargo_items(text):
+    """Извлекает несколько позиций груза из одного сообщения"""
+    return parse_items_from_text(
+        text,
+        lambda segment: find_product_category(segment, PRODUCT_CATEGORIES),
+        extract_dimensions,
+        extract_volume
+    )
+
+def calculate_cargo_cost(items, city, rate=None):
+    """Расчет сборного груза: возвращает варианты группировки и самый дешевый"""
+    zone = tariff_calculator.zone(city)
+    if not zone:
+        return None
+    return cargo_quoter.quote(items, str(zone), rate or rate_provider.current())
+
+def calculate_detailed_cost(quick_cost, weight: float, product_type: str, city: str):
+    """Детальный расчет с разбивкой по плотности"""
+    if not quick_cost:
+        return "Ошибка расчета"
+    
+    t1_cost = quick_cost['t1_cost']
+    t2_cost = quick_cost['t2_cost'] 
+    zone = quick_cost['zone']
+    t2_rate = quick_cost['t2_rate']
+    volume = quick_cost['volume']
+    density = quick_cost['density']
+    rule = quick_cost['rule']
+    t1_cost_usd = quick_cost['t1_cost_usd']
+    
+    price = rule['price']
+    unit = rule['unit']
+    if unit == "kg":
+        calculation_text = f"${price}/кг × {weight} кг = ${t1_cost_usd:.2f} USD"
+    elif unit == "m3":
+        calculation_text = f"${price}/м³ × {volume:.3f} м³ = ${t1_cost_usd:.2f} USD"
+    else:
+        calculation_text = f"${price}/кг × {weight} кг = ${t1_cost_usd:.2f} USD"
+    
+    city_name = city.capitalize()
+    
+    # Проверяем габариты на превышение
+    length = quick_cost.get('length')
+    width = quick_cost.get('width') 
+    height = quick_cost.get('height')
+    
+    if check_dimensions_exceeded(length, width, height):
+        # Груз превышает размеры - только самовывоз
+        t2_explanation = f"❌ **Ваш груз превышает максимальный размер посылки 230×180×110 см**\n• Доставка только до склада Алматы (самовывоз)"
+        t2_cost = 0
+        zone_text = "только самовывоз"
+        comparison_text = f"💡 **Самовывоз со склада в Алматы:** {t1_cost * 1.20:.0f} тенге (включая комиссию 20%)"
+    else:
+        # Груз в пределах размеров - можно до двери
+        if zone == "алматы":
+            t2_explanation = f"• Доставка по городу Алматы до вашего адреса"
+            zone_text = "город Алматы"
+            comparison_text = f"💡 **Если самовывоз со склада в Алматы:** {t1_cost * 1.20:.0f} тенге (включая комиссию 20%)"
+        else:
+            t2_explanation = f"• Доставка до вашего адреса в {city_name}"
+            zone_text = f"Зона {zone}"
+            comparison_text = f"💡 **Если самовывоз из Алматы:** {t1_cost * 1.20:.0f} тенге (включая комиссию 20%)"
+
+        # Пересчитываем итоговую стоимость
+    if check_dimensions_exceeded(length, width, height):
+        total_cost = t1_cost * 1.20  # Только Т1 с комиссией
+    else:
+        total_cost = (t1_cost + t2_cost) * 1.20
+        
+    response = (
+        f"📊 **Детальный расчет для {weight} кг «{product_type}» в г. {city_name}:**\n\n"
+        
+        f"**Т1: Доставка из Китая до Алматы**\n"
+        f"• Плотность вашего груза: **{density:.1f} кг/м³**\n"
+        f"• Применен тариф Т1: **${price} за {unit}**\n"
+        f"• Расчет: {calculation_text}\n"
+        f"• По курсу {quick_cost.get('exchange_rate', EXCHANGE_RATE)} тенge/$ = **{t1_cost:.0f} тенge**\n\n"
+        
+        f"**Т2: Доставка до двери ({zone_text})**\n"
+        f"{t2_explanation}\n"
+        f"• Прогрессивный тариф для {weight} кг = **{t2_cost:.0f} тенge**\n\n"
+        
+        f"**Комиссия компании (20%):**\n"
+        f"• ({t1_cost:.0f} + {t2_cost:.0f}) × 20% = **{(t1_cost + t2_cost) * 0.20:.0f} тенge**\n\n"
+        
+        f"------------------------------------\n"
+        f"💰 **ИТОГО с доставкой до двери:** ≈ **{total_cost:,.0f} тенge**\n\n"
+        
+        f"{comparison_text}\n\n"
+        f"💡 **Страхование:** дополнительно 1% от стоимости груза\n"
+        f"💳 **Оплата:** пост-оплата при получении\n\n"
+        f"✅ **Оставить заявку?** Напишите ваше имя и телефон!\n"
+        f"🔄 **Новый расчет?** Напишите **Старт**"
+    )
+    return response
+
+def explain_tariffs():
+    """Объяснение тарифов Т1 и Т2"""
+    return """🚚 **Объяснение тарифов:**
+
+**Т1 - Доставка до склада в Алматы:**
+• Доставка из Китая до нашего сортировочного склада в Алматы
+• Вы забираете груз самовывозом со склада
+• ТОЛЬКО склад в Алматы, без доставки по городу
+• **НОВОЕ:** Расчет по плотности груза (вес/объем) - чем выше плотность, тем выгоднее тариф!
+
+**Т2 - Доставка до двери:**
+• Доставка из Китая + доставка до вашего адреса в ЛЮБОМ городе Казахстана
+• Включая доставку по городу Алматы до вашего адреса
+• Мы привозим груз прямо к вам
+
+💡 **Важно:** Даже если вы в Алматы, но нужна доставка до адреса - это Т2
+
+💳 **Оплата:** пост-оплата при получении (наличные, Kaspi, Halyk, Freedom Bank, безнал)"""
+
+def get_payment_info():
+    """Информация о способах оплаты"""
+    return """💳 **Условия оплаты:**
+
+💰 **Пост-оплата:** Вы платите при получении груза в удобном для вас формате:
+
+• **Безналичный расчет** перечислением на счет
+• **Наличными** 
+• **Kaspi Bank**
+• **Halyk Bank** 
+• **Freedom Bank**
+
+💡 Оплата производится только после доставки и осмотра груза!"""
+
+def get_delivery_procedure():
+    return """📦 **Процедура доставки:**
+
+1. **Прием груза в Китае:** Ваш груз прибудет на наш склад в Китае (ИУ или Гуанчжоу)
+2. **Осмотр и обработка:** Взвешиваем, фотографируем, упаковываем
+3. **Подтверждение:** Присылаем детали груза
+4. **Отправка:** Доставляем до Алматы (Т1) или до двери (Т2)
+5. **Получение и оплата:** Забираете груз и оплачиваете удобным способом
+
+💳 **Оплата:** пост-оплата при получении (наличные, Kaspi, Halyk, Freedom Bank, безнал)
+
+✅ **Хотите оформить заявку?** Напишите ваше имя и телефон!"""
+
+def write_application(details):
+    """Задание 'application': запись заявки в файл; ошибка уходит в очередь на повтор"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = f"Новая заявка: {timestamp}\n{details}\n"
+    with open("applications.txt", "a", encoding="utf-8") as f: 
+        f.write("="*50 + "\n" + log_entry + "="*50 + "\n\n")
+    logger.info(f"Заявка сохранена: {details}")
+
+# Заявки пишутся в фоне: ответ клиенту не ждет ни диска, ни повторов после сбоя
+job_queue = JobQueue()
+job_queue.register('application', lambda job: write_application(job['details']))
+
+def save_application(details):
+    try:
+        job_id = job_queue.enqueue('application', {'details': details})
+        logger.info(f"Заявка поставлена в очередь: задание #{job_id}")
+    except Exception as e: 
+        logger.error(f"Ошибка постановки заявки в очередь: {e}")
+        try:
+            write_application(details)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения: {e}")
+
+GEMINI_UNAVAILABLE_RESPONSE = "Извините, сейчас я могу отвечать только на вопросы по доставке."
+GEMINI_ERROR_RESPONSE = "Ой, кажется, у меня что-то пошло не так с креативной частью! Давайте лучше вернемся к расчету доставки, с этим я точно справлюсь. 😊"
+
+def build_gemini_request(user_message, context=""):
+    """Промпт и параметры генерации - общие для синхронного и асинхронного вызова"""
+    full_prompt = f"{PERSONALITY_PROMPT}\n\nТекущий контекст диалога:\n{context}\n\nВопрос клиента: {user_message}\n\nТвой ответ:"
+    return {
+        'contents': full_prompt,
+        'generation_config': GenerationConfig(
+            temperature=0.8,
+            max_output_tokens=1000,
+        )
+    }
+
+def get_gemini_response(user_message, context="", identities=None):
+    """Получает ответ от Gemini для общих вопросов (блокирует поток до ответа модели)."""
+    if not model:
+        return GEMINI_UNAVAILABLE_RESPONSE
+
+    # Отдельный бюджет для запросов, которые доходят до Gemini
+    if identities:
+        rate_limiter.check("llm", identities)
+
+    try:
+        response = model.generate_content(**build_gemini_request(user_message, context))
+        return response.text
+    except Exception as e:
+        logger.error(f"Ошибка Gemini: {e}")
+        return GEMINI_ERROR_RESPONSE
+
+async def get_gemini_response_async(user_message, context="", identities=None):
+    """То же для asgi.py: ожидание ответа модели не занимает поток"""
+    if not model:
+        return GEMINI_UNAVAILABLE_RESPONSE
+
+    if identities:
+        rate_limiter.check("llm", identities)
+
+    try:
+        request = build_gemini_request(user_message, context)
+        generate_async = getattr(model, 'generate_content_async', None)
+        if generate_async:
+            response = await generate_async(**request)
+        else:
+            response = await asyncio.to_thread(model.generate_content, **request)
+        return response.text
+    except Exception as e:
+        logger.error(f"Ошибка Gemini: {e}")
+        return GEMINI_ERROR_RESPONSE
+
+def extract_delivery_info(text):
+    """Извлечение данных о доставки"""
+    return extraction.extract_delivery_info(text, tariff_tables.city_names(), PRODUCT_CATEGORIES)
+
+# 🎯 НАЧАЛО_НОВЫХ_ФУНКЦИЙ
+def generate_delivery_response(message):
+    """
+    Обрабатывает сообщение в режиме доставки
+    """
+    try:
+        # Извлекаем данные о доставке
+        weight, product_type, city = extract_delivery_info(message)
+        packages = extract_packages(message)
+        volume_direct = extract_volume(message)
+        
+        # Расчет объема (все места груза)
+        volume = volume_direct
+        if not volume and packages:
+            volume = total_volume(packages)
+        
+        # Проверяем наличие всех данных
+        if not weight:
+            return "📊 Укажите вес груза в кг (например: 50 кг)"
+        if not product_type:
+            return "📦 Укажите тип товара (мебель, техника, косметика и т.д.)"
+        if not city:
+            return "🏙️ Укажите город доставки (Алматы, Астана и т.д.)"
+        if not volume:
+            return "📐 Укажите габариты (например: 1.2×0.8×0.5 м) или объем"
+        
+        # Производим расчет
+        quick_cost = calculate_quick_cost(weight, product_type, city, volume)
+        
+        if quick_cost:
+            return calculate_detailed_cost(quick_cost, weight, product_type, city)
+        else:
+            return "❌ Не удалось рассчитать стоимость. Проверьте данные."
+            
+    except Exception as e:
+        logger.error(f"Ошибка в generate_delivery_response: {e}")
+        return "⚠️ Ошибка расчета. Попробуйте еще раз."
+
+def generate_free_response(message, intent_type=None):
+    """
+    Обрабатывает сообщение в режиме свободного диалога
+    """
+    try:
+        # Используем Gemini для свободного диалога
+        bot_response = get_gemini_response(message)
+        return bot_response
+        
+    except Exception as e:
+        logger.error(f"Ошибка в generate_free_response: {e}")
+        return "💬 Давайте поговорим о чем-то другом! Чем еще могу помочь?"
+# 🎯 КОНЕЦ_НОВЫХ_ФУНКЦИЙ
+    
+# ↓↓↓ ВСТАВИТЬ ЗДЕСЬ - основная функция обработки (версия с обработкой ошибок) ↓↓↓
+def handle_message_universal(user_id, message):
+    intent_manager = SmartIntentManager()
+    
+    try:
+        if intent_manager.should_switch_to_delivery(message):
+            response = generate_delivery_response(message)
+            return response
+        else:
+            intent_type = intent_manager.get_intent_type(message)
+            response = generate_free_response(message, intent_type)
+            return response
+    except NameError as e:
+        logger.error(f"Function not found: {e}")
+        return "⚠️ Системная ошибка: функции обработки не найдены"
+# ↑↑↑ КОНЕЦ ВСТАВКИ ФУНКЦИИ ↑↑↑
+
+# --- ДИАЛОГ: ОБРАБОТЧИКИ СОСТОЯНИЙ ---
+EMPTY_DELIVERY_DATA = {'weight': None, 'product_type': None, 'city': None, 'volume': None}
+
+START_COMMANDS = ['старт', 'start', 'новый расчет', 'сначала', 'новая заявка']
+
+PARAMETERS_HINT = "📦 **Для расчета укажите 4 параметра:**\n• **Вес груза** (в кг)\n• **Тип товара** (мебель, техника, одежда и т.д.)\n• **Габариты** (Д×Ш×В в метрах или сантиметрах)\n• **Город доставки**\n\n💡 **Пример:** \"50 кг мебель в Астану, габариты 120×80×50\""
+
+message_classifier = KeywordClassifier(
+    {
+        'non_calc': ['привет', 'как дела', 'что умеешь', 'кто ты', 'погода', 'бот', 'помощь', 'помоги', 'как настроение', 'расскажи о себе', 'что ты'],
+        'payment': ['оплат', 'платеж', 'заплатит', 'деньги', 'как платит', 'наличн', 'безнал', 'kaspi', 'halyk', 'freedom', 'банк'],
+        'tariffs': ['т1', 'т2', 'тариф', 'что такое т', 'объясни тариф'],
+        'application': ['заявк', 'оставь', 'свяж', 'контакт', 'позвон', 'менеджер'],
+        'procedure': ['процедур', 'процесс', 'как достав', 'как получ'],
+        'technology': ['на каком ии', 'какой ии', 'технология'],
+        'detail': ['детальн', 'подробн', 'разбей', 'тариф', 'да', 'yes', 'конечно'],
+        'proceed': ['заявк', 'оставь', 'свяж', 'контакт', 'позвон', 'менеджер', 'дальше', 'продолж'],
+    },
+    exact_intents={
+        'greeting': GREETINGS,
+        'start': START_COMMANDS,
+    }
+)
+
+def get_delivery_data(session_data):
+    return session_data.get('delivery_data') or dict(EMPTY_DELIVERY_DATA)
+
+def reset_dialogue(ctx, chat_history):
+    """Сбрасывает данные расчета и возвращает диалог в начало"""
+    ctx.session.update({
+        'delivery_data': dict(EMPTY_DELIVERY_DATA),
+        'chat_history': chat_history,
+        'cargo_items': None,
+        'quick_cost': None
+    })
+    ctx.transition(COLLECTING)
+
+def reply_with_history(ctx, response):
+    """Добавляет ответ ассистента в историю (последние 10 сообщений)"""
+    chat_history = ctx.session.get('chat_history', [])
+    chat_history.append(f"Ассистент: {response}")
+    ctx.session['chat_history'] = chat_history[-10:]
+    return response
+
+def handle_greeting(ctx):
+    reset_dialogue(ctx, [f"Клиент: {ctx.message}"])
+    logger.info(f"=== ВОЗВРАТ ПРИВЕТСТВИЯ ===")
+    return "Привет! 👋 Я ассистент Post Pro. Помогу рассчитать доставку из Китая в Казахстан!\n\n" + PARAMETERS_HINT
+
+def handle_start(ctx):
+    reset_dialogue(ctx, [])
+    logger.info(f"=== ВОЗВРАТ СТАРТ ===")
+    return "🔄 Начинаем новый расчет!\n\n" + PARAMETERS_HINT
+
+def handle_contacts(ctx):
+    """Ждем контакты после показа расчета"""
+    name, phone = extract_contact_info(ctx.message)
+    if not (name and phone):
+        return "Не удалось распознать контакты. Пожалуйста, укажите в формате: 'Имя, 87001234567'"
+
+    delivery_data = get_delivery_data(ctx.session)
+    details = f"Имя: {name}, Телефон: {phone}"
+    if delivery_data['weight']:
+        details += f", Вес: {delivery_data['weight']} кг"
+    if delivery_data['product_type']:
+        details += f", Товар: {delivery_data['product_type']}"
+    if delivery_data['city']:
+        details += f", Город: {delivery_data['city']}"
+    if delivery_data.get('volume'):
+        details += f", Объем: {delivery_data['volume']:.3f} м³"
+
+    save_application(details)
+    reset_dialogue(ctx, [])
+    return "🎉 Спасибо, что выбрали Post Pro! Менеджер свяжется с вами в течение часа. 📞⏰ **Рабочее время:** с 9:00 до 19:00 по времени Астаны"
+
+def handle_free_chat(ctx):
+    """Общие вопросы - локальный FAQ или Gemini до логики расчетов"""
+    faq_response = faq_engine.answer(ctx.message)
+    if faq_response:
+        return reply_with_history(ctx, faq_response)
+    return LlmRequest(ctx.message, lambda bot_response: reply_with_history(ctx, bot_response))
+
+def handle_payment(ctx):
+    logger.info(f"=== ВОЗВРАТ ОПЛАТА ===")
+    return get_payment_info()
+
+def handle_tariffs(ctx):
+    logger.info(f"=== ВОЗВРАТ ТАРИФЫ ===")
+    return explain_tariffs()
+
+def handle_application_too_early(ctx):
+    return "Сначала давайте рассчитаем стоимость доставки. Укажите вес, тип товара, габариты и город доставки."
+
+def handle_procedure(ctx):
+    return get_delivery_procedure()
+
+def handle_technology(ctx):
+    return "Я работаю на базе Post Pro ИИ! 🚀"
+
+def update_delivery_data(message, delivery_data):
+    """Извлекает данные из сообщения в delivery_data. Возвращает список подтверждений для клиента."""
+    weight, product_type, city = extract_delivery_info(message)
+    packages = extract_packages(message)
+    volume_direct = extract_volume(message)
+
+    confirmation_parts = []
+
+    if weight and weight != delivery_data['weight']:
+        delivery_data['weight'] = weight
+        confirmation_parts.append(f"📊 **Вес:** {weight} кг")
+
+    if product_type and product_type != delivery_data['product_type']:
+        delivery_data['product_type'] = product_type
+        confirmation_parts.append(f"📦 **Товар:** {product_type}")
+
+    if city and city != delivery_data['city']:
+        delivery_data['city'] = city
+        confirmation_parts.append(f"🏙️ **Город:** {city.capitalize()}")
+
+    # Обработка габаритов и объема (объем имеет приоритет)
+    if volume_direct and volume_direct != delivery_data.get('volume'):
+        delivery_data['volume'] = volume_direct
+        delivery_data['length'] = None
+        delivery_data['width'] = None
+        delivery_data['height'] = None
+        confirmation_parts.append(f"📏 **Объем:** {volume_direct:.3f} м³")
+    elif packages:
+        calculated_volume = total_volume(packages)
+        current_volume = delivery_data.get('volume')
+        if current_volume is None or abs(calculated_volume - current_volume) > 0.001:
+            # Для проверки размеров доставки до двери запоминаем самое крупное место
+            largest = max(packages, key=lambda package: package.length * package.width * package.height)
+            delivery_data['length'], delivery_data['width'], delivery_data['height'] = largest.dimensions()
+            delivery_data['volume'] = calculated_volume
+            for package in packages:
+                pieces = f" × {package.count} шт" if package.count > 1 else ""
+                confirmation_parts.append(
+                    f"📐 **Габариты:** {package.length:.2f}×{package.width:.2f}×{package.height:.2f} м{pieces}"
+                )
+            confirmation_parts.append(f"📏 **Объем:** {calculated_volume:.3f} м³")
+
+    return confirmation_parts
+
+def has_all_delivery_data(delivery_data):
+    return bool(
+        delivery_data['weight'] and
+        delivery_data['product_type'] and
+        delivery_data['city'] and
+        delivery_data.get('volume')
+    )
+
+def handle_cargo(ctx, cargo_items, city):
+    """Сборный груз: несколько позиций в одном сообщении"""
+    delivery_data = get_delivery_data(ctx.session)
+    cargo_city = city or delivery_data['city']
+    if not cargo_city:
+        return f"📦 Принято позиций: {len(cargo_items)}\n🏙️ Укажите город доставки (Алматы, Астана и т.д.)"
+
+    cargo_quote = calculate_cargo_cost(cargo_items, cargo_city)
+    if not cargo_quote:
+        return "❌ Не удалось рассчитать стоимость. Проверьте правильность введенных данных."
+
+    delivery_data.update({
+        'weight': cargo_quote['total_weight'],
+        'product_type': ", ".join(sorted({item['category'] for item in cargo_items})),
+        'city': cargo_city,
+        'volume': cargo_quote['total_volume']
+    })
+    ctx.session['cargo_items'] = None
+    ctx.session['delivery_data'] = delivery_data
+    ctx.transition(AWAITING_CONTACTS)
+    return format_cargo_quote(cargo_quote, cargo_city)
+
+def handle_collecting(ctx):
+    """Сбор данных для расчета: подтверждаем новые данные, считаем, когда собрано все"""
+    _, _, city = extract_delivery_info(ctx.message)
+
+    cargo_items = parse_cargo_items(ctx.message)
+    if len(cargo_items) > 1:
+        # В сессии (cookie /chat) - только компактные позиции, полный разбор нужен только в этом ответе
+        ctx.session['cargo_items'] = pack_items(cargo_items)
+        return handle_cargo(ctx, cargo_items, city)
+    if ctx.session.get('cargo_items'):
+        return handle_cargo(ctx, unpack_items(ctx.session['cargo_items']), city)
+
+    delivery_data = get_delivery_data(ctx.session)
+    confirmation_parts = update_delivery_data(ctx.message, delivery_data)
+    ctx.session['delivery_data'] = delivery_data
+
+    # Если данные обновлены, показываем подтверждение
+    if confirmation_parts:
+        response_message = "✅ **Данные обновлены:**\n" + "\n".join(confirmation_parts) + "\n\n"
+
+        if has_all_delivery_data(delivery_data):
+            response_message += "📋 **Все данные собраны!** Готовы к расчету стоимости доставки."
+        else:
+            missing_data = []
+            if not delivery_data['weight']:
+                missing_data.append("вес груза")
+            if not delivery_data['product_type']:
+                missing_data.append("тип товара")
+            if not delivery_data.get('volume'):
+                missing_data.append("габариты или объем")
+            if not delivery_data['city']:
+                missing_data.append("город доставки")
+
+            response_message += f"📝 **Осталось указать:** {', '.join(missing_data)}"
+
+        return response_message
+
+    # ТРИГГЕР РАСЧЕТА - когда все данные собраны
+    if has_all_delivery_data(delivery_data):
+        quick_cost = calculate_quick_cost(
+            delivery_data['weight'],
+            delivery_data['product_type'],
+            delivery_data['city'],
+            delivery_data.get('volume'),
+            delivery_data.get('length'),
+            delivery_data.get('width'),
+            delivery_data.get('height')
+        )
+        if not quick_cost:
+            return "❌ Не удалось рассчитать стоимость. Проверьте правильность введенных данных."
+
+        # Сразу показываем детальный расчет и переходим к сбору контактов
+        ctx.session['quick_cost'] = quick_cost
+        ctx.transition(AWAITING_CONTACTS)
+        return calculate_detailed_cost(
+            quick_cost,
+            delivery_data['weight'],
+            delivery_data['product_type'],
+            delivery_data['city']
+        )
+
+    return handle_fallback(ctx)
+
+def handle_detail(ctx):
+    """Запрос детального расчета после показа расчета"""
+    delivery_data = get_delivery_data(ctx.session)
+    ctx.transition(AWAITING_CONTACTS)
+    return calculate_detailed_cost(
+        ctx.session.get('quick_cost'),
+        delivery_data['weight'],
+        delivery_data['product_type'],
+        delivery_data['city']
+    )
+
+def handle_proceed(ctx):
+    """Запрос на оформление заявки после показа расчета"""
+    ctx.transition(AWAITING_CONTACTS)
+    return "Отлично! Для связи укажите:\n• Ваше имя\n• Номер телефона\n\nНапример: 'Аслан, 87001234567'"
+
+def handle_quoted(ctx):
+    """После расчета новые данные запоминаются без пересчета, ответ - через FAQ или Gemini"""
+    delivery_data = get_delivery_data(ctx.session)
+    update_delivery_data(ctx.message, delivery_data)
+    ctx.session['delivery_data'] = delivery_data
+    return handle_fallback(ctx)
+
+def handle_fallback(ctx):
+    """Частые вопросы отвечаем локально, все остальное - Gemini с контекстом диалога"""
+    faq_response = faq_engine.answer(ctx.message)
+    if faq_response:
+        return reply_with_history(ctx, faq_response)
+
+    delivery_data = get_delivery_data(ctx.session)
+    chat_history = ctx.session.get('chat_history', [])
+    context_lines = []
+
+    # Добавляем историю диалога
+    if len(chat_history) > 0:
+        context_lines.append("История диалога:")
+        for msg in chat_history[-6:]:  # Берем последние 6 сообщений
+            context_lines.append(msg)
+
+    # Добавляем текущие данные о доставке
+    context_lines.append("\nТекущие данные для доставки:")
+    if delivery_data['weight']:
+        context_lines.append(f"- Вес: {delivery_data['weight']} кг")
+    else:
+        context_lines.append(f"- Вес: не указан")
+    if delivery_data['product_type']:
+        context_lines.append(f"- Товар: {delivery_data['product_type']}")
+    else:
+        context_lines.append(f"- Товар: не указан")
+    if delivery_data['city']:
+        context_lines.append(f"- Город: {delivery_data['city']}")
+    else:
+        context_lines.append(f"- Город: не указан")
+    if delivery_data.get('volume'):
+        context_lines.append(f"- Объем: {delivery_data['volume']:.3f} м³")
+    else:
+        context_lines.append(f"- Объем: не указан")
+
+    context = "\n".join(context_lines)
+
+    # Создаем промпт для Gemini
+    gemini_prompt = f"""
+        {PERSONALITY_PROMPT}
+        
+        Ты - умный и дружелюбный ассистент компании Post Pro. Твоя главная цель - помочь клиенту рассчитать стоимость доставки из Китая в Казахстан.
+        
+        Контекст диалога:
+        {context}
+        
+        Важные правила:
+        1. **СКЛАДЫ В КИТАЕ:** У нас только 2 склада - ИУ и Гуанчжоу. 
+        2. Если клиент спрашивает про ЛЮБОЙ другой город Китая (Шанхай, Пекин, Гонконг, Шэньчжэнь и т.д.) - отвечай:
+           "У нас склады только в ИУ и Гуанчжоу. Уточните у вашего поставщика, какой склад ему ближе - ИУ или Гуанчжоу. Или посмотрите сами адрес складов - я вам отправлю."
+        3. Не предлагай и не упоминай другие города Китая кроме ИУ и Гуанчжоу.
+        4. Общайся естественно, с юмором и эмодзи
+        5. Если данных для расчета не хватает - вежливо напомни какие параметры нужны
+        6. Не заставляй клиента строго следовать формату - принимай данные в любом виде
+        7. Поддержи любой разговор, но мягко возвращай к теме доставки
+        8. Используй информацию из истории диалога
+        
+        Вопрос клиента: {ctx.message}
+        """
+    log_payload(logger, "=== ВЫЗОВ GEMINI === Промпт", gemini_prompt)
+
+    def finish(bot_response):
+        log_payload(logger, "=== ОТВЕТ GEMINI ===", bot_response)
+        return reply_with_history(ctx, bot_response)
+
+    return LlmRequest(gemini_prompt, finish)
+
+# Таблица переходов: порядок проверки интентов в каждом состоянии
+dialogue_machine = DialogueStateMachine(message_classifier)
+dialogue_machine.on(STATES, 'greeting', handle_greeting)
+dialogue_machine.on(STATES, 'start', handle_start)
+dialogue_machine.on([COLLECTING, QUOTED], 'non_calc', handle_free_chat)
+dialogue_machine.on([COLLECTING], 'payment', handle_payment)
+dialogue_machine.on([COLLECTING], 'tariffs', handle_tariffs)
+dialogue_machine.on([COLLECTING], 'application', handle_application_too_early)
+dialogue_machine.on([COLLECTING], 'procedure', handle_procedure)
+dialogue_machine.on([COLLECTING, QUOTED], 'technology', handle_technology)
+dialogue_machine.on([QUOTED], 'detail', handle_detail)
+dialogue_machine.on([QUOTED], 'proceed', handle_proceed)
+dialogue_machine.default(COLLECTING, handle_collecting)
+dialogue_machine.default(QUOTED, handle_quoted)
+dialogue_machine.default(AWAITING_CONTACTS, handle_contacts)
+
+# --- ХОД ДИАЛОГА ---
+CHAT_ERROR_RESPONSE = "Извините, произошла ошибка. Попробуйте еще раз."
+
+def rate_limited_payload(error):
+    """Тело ответа 429 и Retry-After в секундах"""
+    retry_after = max(1, math.ceil(error.retry_after))
+    return {
+        "response": f"⏳ Слишком много сообщений подряд. Пожалуйста, подождите {retry_after} сек. и попробуйте снова.",
+        "retry_after": retry_after
+    }, retry_after
+
+def start_turn(message, session, identities):
+    """
+    Детерминированная часть хода: лимит, история, обработчик состояния.
+    Возвращает текст ответа или LlmRequest, если ответ должна дать модель.
+    """
+    rate_limiter.check("deterministic", identities)
+    message = clip(message)
+    # Идентификатор сессии в конце строки - по нему loadtest.py собирает диалоги из лога
+    logger.info(f"=== НОВЫЙ ЗАПРОС: {message} === [{identities.get('session')}]")
+
+    if not message:
+        return "Пожалуйста, введите сообщение."
+
+    chat_history = session.get('chat_history', [])
+    chat_history.append(f"Клиент: {message}")
+    session['chat_history'] = chat_history[-10:]
+
+    return dialogue_machine.handle(message, session)
+
+def respond(message, session, identities):
+    """Ответ на сообщение клиента; вызов Gemini блокирует поток (WSGI)"""
+    result = start_turn(message, session, identities)
+    if isinstance(result, LlmRequest):
+        return result.finish(get_gemini_response(result.message, result.context, identities))
+    return result
+
+async def respond_async(message, session, identities):
+    """Ответ на сообщение клиента; пока Gemini думает, event loop обслуживает другие диалоги (ASGI)"""
+    result = start_turn(message, session, identities)
+    if isinstance(result, LlmRequest):
+        return result.finish(await get_gemini_response_async(result.message, result.context, identities))
+    return result
+
+def track_status(track_number):
+    """Проверка существования трек-номера и ETA, если груз в пути"""
+    track_number = track_number.strip().upper()
+    status = {"track_number": track_number, "found": track_number in track_numbers}
+    eta = eta_model.track(track_number)
+    if eta:
+        status["eta"] = eta
+    return status
+
+def health_status():
+    return {"status": "healthy", "timestamp": datetime.now().isoformat(), "jobs": job_queue.counts()}
@@ -0,0 +1,151 @@
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- СОСТОЯНИЯ ДИАЛОГА ---
+COLLECTING = "collecting"                # собираем вес, товар, габариты, город
+QUOTED = "quoted"                        # расчет показан
+AWAITING_CONTACTS = "awaiting_contacts"  # ждем имя и телефон
+
+STATES = (COLLECTING, QUOTED, AWAITING_CONTACTS)
+
+
+class KeywordClassifier:
+    """
+    Классификатор сообщения за один проход.
+    Все ключевые слова всех интентов собраны в одно регулярное выражение;
+    результат совпадает с проверками вида any(word in message_lower for word in keywords) для каждого интента.
+    Точные совпадения (приветствия, команды) проверяются поиском в множестве.
+    """
+
+    def __init__(self, substring_intents, exact_intents=None):
+        self.exact = {intent: set(phrases) for intent, phrases in (exact_intents or {}).items()}
+
+        keyword_intents = {}
+        for intent, keywords in substring_intents.items():
+            for keyword in keywords:
+                keyword_intents.setdefault(keyword.lower(), set()).add(intent)
+
+        # Длинное ключевое слово поглощает совпадение более короткого с той же позиции,
+        # поэтому оно наследует интенты всех своих префиксов
+        self.keyword_intents = {}
+        for keyword in keyword_intents:
+            intents = set()
+            for other, other_intents in keyword_intents.items():
+                if keyword.startswith(other):
+                    intents |= other_intents
+            self.keyword_intents[keyword] = frozenset(intents)
+
+        alternatives = sorted(self.keyword_intents, key=len, reverse=True)
+        self.pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in alternatives) + "))") if alternatives else None
+
+    def classify(self, message):
+        """Возвращает (текст в нижнем регистре, множество интентов)"""
+        message_lower = message.lower()
+        intents = set()
+        for intent, phrases in self.exact.items():
+            if message_lower in phrases:
+                intents.add(intent)
+        if self.pattern:
+            for match in self.pattern.finditer(message_lower):
+                intents |= self.keyword_intents[match.group(1)]
+        return message_lower, intents
+
+
+class DialogueContext:
+    """Данные одного сообщения, которые получает обработчик"""
+
+    def __init__(self, message, message_lower, intents, session, state):
+        self.message = message
+        self.message_lower = message_lower
+        self.intents = intents
+        self.session = session
+        self.state = state
+
+    def transition(self, state):
+        """Переводит диалог в новое состояние"""
+        self.session['dialog_state'] = state
+        self.state = state
+
+
+class LlmRequest:
+    """
+    Ответ обработчика, который должна дать модель.
+    Сам вызов делает точка входа (в WSGI - блокирующий, в ASGI - через await),
+    finish(ответ модели) завершает ход: сохраняет историю и возвращает текст клиенту.
+    """
+
+    def __init__(self, message, finish, context=""):
+        self.message = message
+        self.finish = finish
+        self.context = context
+
+
+class DialogueStateMachine:
+    """
+    Конечный автомат диалога: collecting → quoted → awaiting_contacts.
+    Для каждого состояния - таблица (интент, обработчик), проверяемая по порядку, и обработчик по умолчанию.
+    Сообщение классифицируется один раз, время каждого перехода собирается в статистику.
+    """
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.routes = {state: [] for state in STATES}
+        self.defaults = {}
+        self.stats = {}
+
+    def on(self, states, intent, handler):
+        """Регистрирует обработчик интента в указанных состояниях"""
+        for state in states:
+            self.routes[state].append((intent, handler))
+
+    def default(self, state, handler):
+        """Обработчик сообщений, для которых в состоянии не нашлось интента"""
+        self.defaults[state] = handler
+
+    @staticmethod
+    def current_state(session):
+        """Состояние из сессии; для старых сессий - из флагов waiting_for_contacts/calculation_shown"""
+        state = session.get('dialog_state')
+        if state in STATES:
+            return state
+        if session.get('waiting_for_contacts'):
+            return AWAITING_CONTACTS
+        if session.get('calculation_shown'):
+            return QUOTED
+        return COLLECTING
+
+    def route(self, state, intents):
+        for intent, handler in self.routes[state]:
+            if intent in intents:
+                return handler
+        return self.defaults[state]
+
+    def handle(self, message, session):
+        """Обрабатывает сообщение и возвращает текст ответа или LlmRequest"""
+        started = time.perf_counter()
+        message_lower, intents = self.classifier.classify(message)
+        state = self.current_state(session)
+        handler = self.route(state, intents)
+
+        context = DialogueContext(message, message_lower, intents, session, state)
+        response = handler(context)
+
+        elapsed = time.perf_counter() - started
+        key = (state, handler.__name__, context.state)
+        count, total = self.stats.get(key, (0, 0.0))
+        self.stats[key] = (count + 1, total + elapsed)
+        logger.info(f"=== ПЕРЕХОД {state} -> {context.state} ({handler.__name__}) {elapsed * 1000:.1f} мс ===")
+        return response
+
+    def get_stats(self):
+        """Статистика переходов: количество и средняя задержка в мс"""
+        return [
+            {
+                'from': from_state, 'handler': handler, 'to': to_state,
+                'count': count, 'avg_ms': round(total / count * 1000, 3)
+            }
+            for (from_state, handler, to_state), (count, total) in sorted(self.stats.items())
+        ]
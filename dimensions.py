@@ -0,0 +1,379 @@
+"""
+Разбор габаритов из текста за один линейный проход.
+
+Текст разбивается на токены (числа, единицы, разделители, подписи длина/ширина/высота, штуки),
+затем автомат собирает из них места груза: "3 коробки 60×40×40", "1.2 м x 80 см x 50 см",
+"длина 120 ширина 80 высота 50 см", "60x40x40 - 2 шт + 100x50x50".
+Регулярное выражение токенизатора не содержит вложенных повторений, поэтому время разбора
+растет линейно с длиной сообщения при любом вводе (см. python dimensions.py fuzz).
+"""
+import re
+import time
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Числа длиннее этого - не размеры (номера телефонов, трек-номера); float от них не считается
+MAX_NUMBER_CHARS = 12
+
+# Без явной единицы: если хотя бы одно число больше порога - сантиметры, иначе метры
+CM_THRESHOLD = 5
+
+# Больше мест в одной строке не бывает; большее число - не количество, а опечатка или другой смысл
+MAX_PIECES = 10_000
+
+TOKEN_PATTERN = re.compile(
+    r'(?P<volume>[мm][3³])'
+    r'|(?P<number>\d+(?:[.,]\d+)?)'
+    r'|(?P<word>[a-zа-яё]+)'
+    r'|(?P<symbol>\S)'
+)
+
+UNITS = {'мм': 0.001, 'mm': 0.001, 'см': 0.01, 'cm': 0.01, 'м': 1.0, 'm': 1.0}
+UNIT_PREFIXES = (('миллиметр', 0.001), ('сантиметр', 0.01), ('метр', 1.0))
+WEIGHT_WORDS = ('кг', 'kg', 'кило', 'килограмм')
+SEPARATORS = {'x', 'х', '*', '×', 'на', '-'}
+LABEL_PREFIXES = (('длин', 0), ('length', 0), ('ширин', 1), ('width', 1), ('высот', 2), ('height', 2))
+PIECE_PREFIXES = ('шт', 'штук', 'коробк', 'короб', 'мест', 'ящик', 'паллет', 'мешк', 'упаков', 'пачк', 'рулон', 'pcs', 'box')
+# Между подписью и числом: "длина: 120", "длина - 120", "длина = 120"
+LABEL_GLUE = {':', '-', '='}
+
+NUMBER, UNIT, SEPARATOR, LABEL, PIECES, BREAK = 'number', 'unit', 'separator', 'label', 'pieces', 'break'
+
+
+class Package:
+    """Место груза: размеры одного места в метрах и количество мест"""
+
+    def __init__(self, length, width, height, count=1):
+        self.length = length
+        self.width = width
+        self.height = height
+        self.count = count
+
+    @property
+    def volume(self):
+        """Объем всех мест, м³"""
+        return self.length * self.width * self.height * self.count
+
+    def dimensions(self):
+        return self.length, self.width, self.height
+
+    def __repr__(self):
+        return f"Package({self.length:.3f}x{self.width:.3f}x{self.height:.3f} м × {self.count})"
+
+
+def classify_word(word):
+    """Слово -> (вид токена, значение)"""
+    if word in UNITS:
+        return UNIT, UNITS[word]
+    if word in SEPARATORS:
+        return SEPARATOR, None
+    for prefix, scale in UNIT_PREFIXES:
+        if word.startswith(prefix):
+            return UNIT, scale
+    for prefix, axis in LABEL_PREFIXES:
+        if word.startswith(prefix):
+            return LABEL, axis
+    if word.startswith(PIECE_PREFIXES):
+        return PIECES, None
+    return BREAK, word
+
+
+def tokenize(text):
+    """Текст -> список (вид, значение). Каждый символ просматривается один раз."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'number':
+            if len(value) > MAX_NUMBER_CHARS:
+                tokens.append((BREAK, value))
+            else:
+                tokens.append((NUMBER, float(value.replace(',', '.'))))
+        elif kind == 'word':
+            if value in WEIGHT_WORDS or value.startswith('килограмм'):
+                tokens.append((BREAK, value))
+            else:
+                tokens.append(classify_word(value))
+        elif kind == 'symbol' and value in SEPARATORS:
+            tokens.append((SEPARATOR, None))
+        else:
+            # Объем (м3), знаки препинания и прочее разрывают последовательность размеров
+            tokens.append((BREAK, value))
+    return tokens
+
+
+def resolve_units(values, units):
+    """
+    Единицы трех размеров: у числа без единицы - единица следующего за ним числа с единицей ("60x40x40 см"),
+    иначе предыдущего ("1.2 м x 0.8 x 0.5"). Если единиц нет совсем - сантиметры при числе больше CM_THRESHOLD.
+    """
+    if not any(units):
+        scale = 0.01 if any(value > CM_THRESHOLD for value in values) else 1.0
+        return [value * scale for value in values]
+    resolved = list(units)
+    following = None
+    for i in range(len(resolved) - 1, -1, -1):
+        if resolved[i] is None:
+            resolved[i] = following
+        else:
+            following = resolved[i]
+    previous = None
+    for i in range(len(resolved)):
+        if resolved[i] is None:
+            resolved[i] = previous
+        else:
+            previous = resolved[i]
+    return [value * scale for value, scale in zip(values, resolved)]
+
+
+class DimensionParser:
+    """Автомат над списком токенов; позиция только растет, поэтому разбор линейный"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def measure(self, position):
+        """Число с необязательной единицей -> (значение, единица, следующая позиция) или None"""
+        if position >= len(self.tokens) or self.tokens[position][0] != NUMBER:
+            return None
+        value = self.tokens[position][1]
+        position += 1
+        if position < len(self.tokens) and self.tokens[position][0] == UNIT:
+            return value, self.tokens[position][1], position + 1
+        return value, None, position
+
+    def skip_separators(self, position):
+        while position < len(self.tokens) and self.tokens[position][0] == SEPARATOR:
+            position += 1
+        return position
+
+    def triple(self, position):
+        """60x40x40, 60 x 40 x 40 см, 1.2м*0.8м*0.5м, 60 40 40 -> (значения, единицы, позиция)"""
+        values, units = [], []
+        for i in range(3):
+            if i:
+                position = self.skip_separators(position)
+            measured = self.measure(position)
+            if measured is None:
+                return None
+            value, unit, position = measured
+            values.append(value)
+            units.append(unit)
+        return values, units, position
+
+    def labelled(self, position):
+        """длина 120 ширина 80 высота 50 (см) - подписи в любом порядке, каждая один раз"""
+        values, units = [None] * 3, [None] * 3
+        while position < len(self.tokens) and None in values:
+            # "длина 120, ширина 80, высота 50"
+            if values != [None] * 3 and self.tokens[position][1] == ',':
+                position += 1
+                if position >= len(self.tokens):
+                    return None
+            kind, axis = self.tokens[position]
+            if kind != LABEL or values[axis] is not None:
+                return None
+            position += 1
+            while position < len(self.tokens) and (
+                self.tokens[position][0] == SEPARATOR or self.tokens[position][1] in LABEL_GLUE
+            ):
+                position += 1
+            measured = self.measure(position)
+            if measured is None:
+                return None
+            values[axis], units[axis], position = measured
+        if None in values:
+            return None
+        # Единица после последнего числа относится ко всем: "... высота 50 см"
+        return values, units, position
+
+    def trailing_count(self, position):
+        """Количество после размеров: "- 3 шт", "x3", "3 коробки" -> (количество, позиция)"""
+        start = position
+        had_separator = position < len(self.tokens) and self.tokens[position][0] == SEPARATOR
+        position = self.skip_separators(position)
+        kind, value = self.tokens[position] if position < len(self.tokens) else (None, None)
+        if kind != NUMBER or value != int(value):
+            return None, start
+        next_kind = self.tokens[position + 1][0] if position + 1 < len(self.tokens) else None
+        if next_kind == PIECES:
+            return int(value), position + 2
+        if had_separator and next_kind != NUMBER and next_kind != UNIT:
+            return int(value), position + 1
+        return None, start
+
+    def parse(self):
+        packages = []
+        pending_count = None
+        tokens = self.tokens
+        while self.position < len(tokens):
+            kind, value = tokens[self.position]
+
+            # "3 коробки ...", "10 мест по ..." - количество для следующих размеров
+            if kind == NUMBER and self.peek(1)[0] == PIECES and value == int(value):
+                pending_count = int(value)
+                self.position += 2
+                continue
+
+            parsed = None
+            if kind == NUMBER:
+                parsed = self.triple(self.position)
+            elif kind == LABEL:
+                parsed = self.labelled(self.position)
+            if parsed is None:
+                self.position += 1
+                continue
+
+            values, units, self.position = parsed
+            count, self.position = self.trailing_count(self.position)
+            count = count or pending_count or 1
+            pending_count = None
+            if count > MAX_PIECES or not all(value > 0 for value in values):
+                continue
+            packages.append(Package(*resolve_units(values, units), count=count))
+        return packages
+
+
+def parse_packages(text):
+    """Все места груза из текста (пустой список, если габаритов нет)"""
+    if not text:
+        return []
+    return DimensionParser(tokenize(text)).parse()
+
+
+def total_volume(packages):
+    return sum(package.volume for package in packages)
+
+
+# --- ПРЕЖНИЙ РАЗБОР (для сравнения в fuzz) ---
+
+LEGACY_PATTERN = re.compile(
+    r'(?:габарит\w*|размер\w*|дшв|длш|разм)?\s*'
+    r'(\d+(?:[.,]\d+)?)\s*(?:см|cm|м|m|сантиметр\w*|метр\w*)?\s*'
+    r'[xх*×на\s\-]+\s*'
+    r'(\d+(?:[.,]\d+)?)\s*(?:см|cm|м|m|сантиметр\w*|метр\w*)?\s*'
+    r'[xх*×на\s\-]+\s*'
+    r'(\d+(?:[.,]\d+)?)\s*(?:см|cm|м|m|сантиметр\w*|метр\w*)?'
+)
+
+
+def legacy_scan(text):
+    """Первый шаблон прежнего extract_dimensions: именно он уходил в возвраты на длинных рядах чисел"""
+    return list(LEGACY_PATTERN.finditer(text.lower()))
+
+
+# --- ПРОВЕРКА ---
+
+EXAMPLES = [
+    ("60x40x40", [(0.6, 0.4, 0.4, 1)]),
+    ("1.2×0.8×0.5 м", [(1.2, 0.8, 0.5, 1)]),
+    ("3 коробки 60×40×40", [(0.6, 0.4, 0.4, 3)]),
+    ("10 коробок по 5 кг 40x30x30", [(0.4, 0.3, 0.3, 10)]),
+    ("1.2 м x 80 см x 50 см", [(1.2, 0.8, 0.5, 1)]),
+    ("60 на 40 на 40 см", [(0.6, 0.4, 0.4, 1)]),
+    ("длина 120 ширина 80 высота 50 см", [(1.2, 0.8, 0.5, 1)]),
+    ("ширина: 0.8 м длина: 1.2 м высота: 0.5 м", [(1.2, 0.8, 0.5, 1)]),
+    ("длина - 120, ширина - 80, высота - 50", [(1.2, 0.8, 0.5, 1)]),
+    ("длина - 120 ширина - 80 высота - 50", [(1.2, 0.8, 0.5, 1)]),
+    ("размер 60x40x40", [(0.6, 0.4, 0.4, 1)]),
+    ("60x40x40 - 2 шт + 100x50x50 3 места", [(0.6, 0.4, 0.4, 2), (1.0, 0.5, 0.5, 3)]),
+    ("600x400x400 мм x2", [(0.6, 0.4, 0.4, 2)]),
+    ("120 80 50", [(1.2, 0.8, 0.5, 1)]),
+    ("50 кг мебель в астану", []),
+    ("объем 2 м3", []),
+    ("50 кг 2 3", []),
+]
+
+
+def check_examples():
+    failures = 0
+    for text, expected in EXAMPLES:
+        actual = [(round(p.length, 6), round(p.width, 6), round(p.height, 6), p.count) for p in parse_packages(text)]
+        if actual != expected:
+            failures += 1
+            print(f"❌ {text!r}: {actual} != {expected}")
+    print(f"🔍 Примеров: {len(EXAMPLES)}, ошибок: {failures}")
+    return failures == 0
+
+
+def hostile_inputs(size, rng):
+    """Семейства входов, на которых шаблоны с перекрывающимися повторениями уходят в возвраты"""
+    alphabet = "0123456789 .,xх*×-нам см"
+    return {
+        'пробелы между числами': "1 " * (size // 2),
+        'разделители': "1 x " * (size // 4) + "кг",
+        'точки': "1." * (size // 2),
+        'цифры': "9" * size,
+        'пробелы': "1" + " " * size + "x",
+        'случайный': "".join(rng.choice(alphabet) for _ in range(size)),
+    }
+
+
+def fuzz(seconds, max_size):
+    """
+    Время разбора на враждебных входах растущей длины. Для линейного разбора время на символ
+    не растет с длиной; прежний шаблон для сравнения прогоняется только на коротких входах.
+    """
+    rng = random.Random(42)
+    deadline = time.monotonic() + seconds
+    worst = {}
+    size = 256
+    while size <= max_size and time.monotonic() < deadline:
+        for name, text in hostile_inputs(size, rng).items():
+            started = time.perf_counter()
+            parse_packages(text)
+            per_char = (time.perf_counter() - started) / len(text) * 1e9
+            worst.setdefault(name, []).append((size, per_char))
+        size *= 2
+
+    print("⏱ Разбор, нс на символ по длине входа:")
+    for name, points in worst.items():
+        print(f"  {name}: " + ", ".join(f"{size}: {per_char:.0f}" for size, per_char in points))
+
+    # "1", пробелы и "x": три перекрывающихся \s* / [...\s]+ в прежнем шаблоне дают кубическое время
+    print("⏱ Прежний шаблон, мс на вход:")
+    for size in (32, 64, 128, 256):
+        text = hostile_inputs(size, rng)['пробелы']
+        started = time.perf_counter()
+        legacy_scan(text)
+        legacy_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        parse_packages(text)
+        new_ms = (time.perf_counter() - started) * 1000
+        print(f"  {size} симв.: прежний {legacy_ms:.1f} мс, новый {new_ms:.2f} мс")
+
+    # Время на символ на самом длинном входе не должно заметно превышать время на коротком
+    ratios = [points[-1][1] / max(points[0][1], 1) for points in worst.values()]
+    print(f"📈 Рост времени на символ (самый длинный / самый короткий вход): до {max(ratios):.1f}x")
+    return max(ratios) < 5
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Разбор габаритов: проверка и fuzz по времени")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('check', help="разбор примеров")
+    fuzz_parser = commands.add_parser('fuzz', help="время разбора на враждебных входах")
+    fuzz_parser.add_argument('--seconds', type=float, default=20)
+    fuzz_parser.add_argument('--max-size', type=int, default=1 << 18)
+    parse_parser = commands.add_parser('parse', help="разобрать текст")
+    parse_parser.add_argument('text')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        sys.exit(0 if check_examples() else 1)
+    if args.command == 'fuzz':
+        sys.exit(0 if fuzz(args.seconds, args.max_size) else 1)
+    packages = parse_packages(args.text)
+    for package in packages:
+        print(package)
+    print(f"📏 Общий объем: {total_volume(packages):.3f} м³")
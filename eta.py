@@ -0,0 +1,362 @@
+"""
+Прогноз даты доставки (ETA) по истории статусов.
+
+По событиям shipment_status модель учит, сколько времени проходит от входа груза в этап
+("принят на складе", "в пути до границы", "на границе") до статуса "доставлен", отдельно по маршруту
+(orders.route_type) и по всем маршрутам вместе. Распределения хранятся гистограммами по часам,
+поэтому новое событие добавляется без пересчета истории: refresh() дочитывает только события
+с id больше последнего прочитанного. Медиана и 90-й перцентиль для каждой пары (маршрут, этап)
+лежат в памяти, ответ трекинга берет ETA оттуда за O(1), а refresh() дописывает ее в orders.estimated_delivery.
+
+    python eta.py refresh --db data/applications.db
+    python eta.py track GZ123456 --db data/applications.db
+    python eta.py backtest --shipments 20000
+"""
+import os
+import time
+import random
+import logging
+import threading
+from array import array
+from datetime import datetime, timezone
+
+from shipments_db import ShipmentsDatabase
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["принят на складе", "в пути до границы", "на границе", "доставлен"]
+STAGE_INDEX = {status: stage for stage, status in enumerate(STAGES)}
+DELIVERED = len(STAGES) - 1
+ALL_ROUTES = '*'
+DEFAULT_ROUTE = 'guangzhou_almaty'
+
+BUCKET_SECONDS = 3600
+# Дольше 120 дней - в последнюю корзину
+MAX_BUCKETS = 24 * 120
+# Меньше примеров по маршруту - берем распределение по всем маршрутам
+MIN_SAMPLES = 20
+DEFAULT_TTL_SECONDS = 300
+REFRESH_BATCH = 50000
+
+SELECT_EVENTS = """
+SELECT s.id, s.track_number, s.status, s.timestamp, o.route_type
+FROM shipment_status s LEFT JOIN orders o ON o.track_number = s.track_number
+WHERE s.id > ?
+ORDER BY s.id
+LIMIT ?
+"""
+UPDATE_ESTIMATE = "UPDATE orders SET estimated_delivery = ? WHERE track_number = ?"
+
+
+def parse_time(value):
+    """Время события (datetime или строка 'YYYY-MM-DD HH:MM:SS', без пояса - UTC) -> секунды epoch"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def format_time(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def quantile(histogram, samples, q):
+    """Квантиль по гистограмме часовых корзин, в секундах (середина корзины)"""
+    target, seen = q * samples, 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return (bucket + 0.5) * BUCKET_SECONDS
+    return (MAX_BUCKETS - 0.5) * BUCKET_SECONDS
+
+
+class EtaModel:
+    """
+    ETA грузов в пути. track() отвечает из памяти; когда модель старше TTL, refresh()
+    запускается в фоновом потоке, а ответы идут по последним таблицам.
+    """
+
+    def __init__(self, database=None, ttl=DEFAULT_TTL_SECONDS, write_back=True):
+        self.database = database
+        self.ttl = ttl
+        self.write_back = write_back
+        # lock - один refresh() за раз (чтение базы идет под ним); флаг refreshing - под своей
+        # короткой блокировкой, чтобы track() во время обновления не ждал базу
+        self.lock = threading.Lock()
+        self.refreshing_lock = threading.Lock()
+        self.refreshing = False
+        self.refreshed_at = float('-inf')
+        self.last_id = 0
+        # (маршрут, этап) -> гистограмма "от входа в этап до доставки" и число примеров
+        self.histograms = {}
+        self.samples = {}
+        # (маршрут, этап) -> (медиана, 90-й перцентиль, примеров), секунды
+        self.table = {}
+        # Грузы в пути: трек -> (маршрут, этап, время входа в этап) и время входа во все пройденные этапы
+        self.current = {}
+        self.entered = {}
+        # Время самого нового прочитанного события - по нему, а не по часам сервера, считается простой груза
+        self.latest_event = float('-inf')
+
+    # --- ОБУЧЕНИЕ ---
+    def observe(self, track, status, when, route):
+        """Одно событие статуса; возвращает ключи (маршрут, этап), распределение которых изменилось"""
+        stage = STAGE_INDEX.get(status)
+        if stage is None:
+            return ()
+        route = route or DEFAULT_ROUTE
+        self.latest_event = max(self.latest_event, when)
+        entered = self.entered.setdefault(track, {})
+        entered.setdefault(stage, when)
+        if stage != DELIVERED:
+            current = self.current.get(track)
+            if current is None or stage >= current[1]:
+                self.current[track] = (route, stage, entered[stage])
+            return ()
+
+        # Доставлен: каждый пройденный этап дает пример "сколько осталось до доставки"
+        del self.entered[track]
+        self.current.pop(track, None)
+        touched = []
+        for passed, entered_at in entered.items():
+            if passed == DELIVERED:
+                continue
+            bucket = min(int(max(when - entered_at, 0) // BUCKET_SECONDS), MAX_BUCKETS - 1)
+            for key in ((route, passed), (ALL_ROUTES, passed)):
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = array('I', bytes(4 * MAX_BUCKETS))
+                histogram[bucket] += 1
+                self.samples[key] = self.samples.get(key, 0) + 1
+                touched.append(key)
+        return touched
+
+    def rebuild_table(self, keys):
+        for key in set(keys):
+            histogram, samples = self.histograms[key], self.samples[key]
+            self.table[key] = (quantile(histogram, samples, 0.5), quantile(histogram, samples, 0.9), samples)
+
+    def refresh(self, batch_size=REFRESH_BATCH):
+        """Дочитывает события с id больше последнего прочитанного; возвращает их число"""
+        total = 0
+        try:
+            with self.lock:
+                while True:
+                    rows = self.database.execute(SELECT_EVENTS, (self.last_id, batch_size)).fetchall()
+                    if not rows:
+                        break
+                    touched, moved = [], set()
+                    for _, track, status, when, route in rows:
+                        touched.extend(self.observe(track, status, parse_time(when), route))
+                        moved.add(track)
+                    self.rebuild_table(touched)
+                    self.last_id = rows[-1][0]
+                    total += len(rows)
+                    if self.write_back:
+                        self.write_estimates(moved)
+                    if len(rows) < batch_size:
+                        break
+                self.evict_stale()
+            self.refreshed_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления ETA: {e}")
+            # Повторим не раньше чем через минуту, а пока отвечаем по старым таблицам
+            self.refreshed_at = time.monotonic() - self.ttl + min(60, self.ttl)
+        finally:
+            self.refreshing = False
+        return total
+
+    def evict_stale(self):
+        """
+        Убирает из памяти грузы без нового этапа дольше MAX_BUCKETS часов: потерянные, отмененные,
+        перемаркированные. Статуса "доставлен" у них не будет, и без чистки они копились бы в каждом воркере.
+        """
+        cutoff = self.latest_event - MAX_BUCKETS * BUCKET_SECONDS
+        stale = [track for track, entered in self.entered.items() if max(entered.values()) < cutoff]
+        for track in stale:
+            del self.entered[track]
+            self.current.pop(track, None)
+        if stale:
+            logger.info(f"🧹 ETA: убрано грузов без движения дольше {MAX_BUCKETS // 24} дней: {len(stale)}")
+        return len(stale)
+
+    def write_estimates(self, tracks):
+        rows = []
+        for track in tracks:
+            state = self.current.get(track)
+            estimate = self.estimate(*state) if state else None
+            if estimate:
+                rows.append((format_time(estimate[0]), track))
+        if rows:
+            self.database.execute_many(UPDATE_ESTIMATE, rows)
+        self.database.commit()
+
+    def _refresh_in_background(self):
+        with self.refreshing_lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    # --- ПРОГНОЗ ---
+    def estimate(self, route, stage, entered_at):
+        """(ETA, самый поздний срок) в секундах epoch для груза, вошедшего в этап в entered_at; None - нет данных"""
+        row = self.table.get((route, stage))
+        if row is None or row[2] < MIN_SAMPLES:
+            row = self.table.get((ALL_ROUTES, stage))
+        if row is None:
+            return None
+        return entered_at + row[0], entered_at + row[1]
+
+    def track(self, track_number):
+        """ETA груза в пути из памяти: {"stage", "eta", "latest"} или None"""
+        if self.database is None:
+            return None
+        if time.monotonic() - self.refreshed_at > self.ttl:
+            self._refresh_in_background()
+        state = self.current.get(track_number)
+        estimate = self.estimate(*state) if state else None
+        if estimate is None:
+            return None
+        return {"stage": STAGES[state[1]], "eta": format_time(estimate[0])[:10], "latest": format_time(estimate[1])[:10]}
+
+
+def create_eta_model():
+    """История статусов: ETA_DATABASE_URL (postgres://... или путь к SQLite), иначе data/applications.db из init_db.py"""
+    database = os.getenv('ETA_DATABASE_URL') or 'data/applications.db'
+    if not database.startswith(('postgres://', 'postgresql://')) and not os.path.exists(database):
+        logger.info("ℹ️ История статусов не найдена - ответы трекинга без ETA")
+        return EtaModel(None)
+    return EtaModel(ShipmentsDatabase(database))
+
+
+# --- ПРОВЕРКА НА СИНТЕТИЧЕСКОЙ ИСТОРИИ ---
+# Медианы этапов в часах: склад, дорога до границы, граница
+ROUTE_STAGE_HOURS = {
+    'guangzhou_almaty': (48, 120, 72),
+    'yiwu_almaty': (72, 144, 96),
+    'guangzhou_astana': (48, 168, 96),
+}
+
+BACKTEST_SCHEMA = """
+CREATE TABLE orders (track_number TEXT PRIMARY KEY, route_type TEXT, estimated_delivery TEXT);
+CREATE TABLE shipment_status (id INTEGER PRIMARY KEY AUTOINCREMENT, track_number TEXT NOT NULL, status TEXT NOT NULL, timestamp TEXT);
+"""
+
+
+def synthesize_history(shipments, seed=7):
+    """События (время, трек, статус, маршрут) за год в порядке времени; каждый десятый груз стоит на границе лишние 3 дня"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+    events = []
+    for number in range(shipments):
+        route = rng.choice(list(ROUTE_STAGE_HOURS))
+        track = f"GZ{number:07d}"
+        when = start + rng.uniform(0, 365 * 86400)
+        events.append((when, track, STAGES[0], route))
+        for stage, hours in enumerate(ROUTE_STAGE_HOURS[route], 1):
+            duration = hours * rng.lognormvariate(0, 0.3)
+            if stage == DELIVERED and rng.random() < 0.1:
+                duration += 72
+            when += duration * 3600
+            events.append((when, track, STAGES[stage], route))
+    events.sort()
+    return events
+
+
+def backtest(shipments, chunk, path):
+    """
+    События поступают пачками по времени; перед каждой пачкой модель прогнозирует доставку для
+    грузов, вошедших в этап, затем дочитывает пачку refresh(). Ошибка прогноза сравнивается
+    с прогнозом без учета маршрута (распределение по всем маршрутам).
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    events = synthesize_history(shipments)
+    database = ShipmentsDatabase(path)
+    database.connection().executescript(BACKTEST_SCHEMA)
+    database.execute_many("INSERT INTO orders (track_number, route_type) VALUES (?, ?)", sorted({(e[1], e[3]) for e in events}))
+    database.commit()
+
+    model = EtaModel(database, ttl=float('inf'))
+    delivered_at = {track: when for when, track, status, _ in events if status == STAGES[DELIVERED]}
+    warmup = len(events) // 5
+    errors, baseline_errors, covered, predicted = [0.0] * DELIVERED, [0.0] * DELIVERED, [0] * DELIVERED, [0] * DELIVERED
+    refresh_seconds, lookup_seconds = [], None
+
+    for offset in range(0, len(events), chunk):
+        batch = events[offset:offset + chunk]
+        if offset >= warmup:
+            for when, track, status, route in batch:
+                stage = STAGE_INDEX[status]
+                estimate = model.estimate(route, stage, when) if stage != DELIVERED else None
+                baseline = model.estimate(ALL_ROUTES, stage, when) if estimate else None
+                if estimate and baseline:
+                    actual = delivered_at[track]
+                    errors[stage] += abs(estimate[0] - actual)
+                    baseline_errors[stage] += abs(baseline[0] - actual)
+                    covered[stage] += actual <= estimate[1]
+                    predicted[stage] += 1
+        database.execute_many(
+            "INSERT INTO shipment_status (track_number, status, timestamp) VALUES (?, ?, ?)",
+            [(track, status, format_time(when)) for when, track, status, _ in batch]
+        )
+        database.commit()
+        started = time.perf_counter()
+        model.refresh()
+        refresh_seconds.append(time.perf_counter() - started)
+
+        if lookup_seconds is None and offset >= len(events) // 2 and model.current:
+            probes = random.Random(1).choices(list(model.current), k=20000)
+            started = time.perf_counter()
+            for track in probes:
+                model.track(track)
+            lookup_seconds = (time.perf_counter() - started) / len(probes)
+
+    started = time.perf_counter()
+    EtaModel(database, write_back=False).refresh()
+    rebuild = time.perf_counter() - started
+
+    print(f"📦 {shipments} грузов, {len(events)} событий, пачки по {chunk}; прогнозы после первых {warmup} событий")
+    for stage in range(DELIVERED):
+        if predicted[stage]:
+            print(f"🎯 {STAGES[stage]}: ошибка ETA {errors[stage] / predicted[stage] / 3600:.1f} ч "
+                  f"(без маршрута {baseline_errors[stage] / predicted[stage] / 3600:.1f} ч), "
+                  f"доставлено не позже срока p90: {covered[stage] / predicted[stage]:.0%}")
+    print(f"⏱ Обновление: {sum(refresh_seconds) / len(events) * 1e6:.1f} мкс на событие, "
+          f"пачка {sum(refresh_seconds) / len(refresh_seconds) * 1000:.1f} мс; полный пересчет истории {rebuild:.2f} с")
+    if lookup_seconds is not None:
+        print(f"⏱ ETA в ответе трекинга: {lookup_seconds * 1e6:.2f} мкс")
+    written = database.execute("SELECT COUNT(*) FROM orders WHERE estimated_delivery IS NOT NULL").fetchone()[0]
+    print(f"💾 orders.estimated_delivery заполнено у {written} грузов")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ETA доставки по истории статусов")
+    parser.add_argument('--db', default=os.getenv('ETA_DATABASE_URL') or 'data/applications.db', help="postgres://... или путь к SQLite")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('refresh', help="прочитать историю и заполнить orders.estimated_delivery")
+    track_parser = commands.add_parser('track', help="ETA груза")
+    track_parser.add_argument('track')
+    backtest_parser = commands.add_parser('backtest', help="точность и стоимость обновления на синтетической истории")
+    backtest_parser.add_argument('--shipments', type=int, default=20000)
+    backtest_parser.add_argument('--chunk', type=int, default=1000)
+    backtest_parser.add_argument('--path', default='data/eta_backtest.db')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'backtest':
+        backtest(args.shipments, args.chunk, args.path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    else:
+        model = EtaModel(ShipmentsDatabase(args.db))
+        events = model.refresh()
+        print(f"✅ Прочитано событий: {events}, грузов в пути: {len(model.current)}")
+        if args.command == 'track':
+            print(model.track(args.track.strip().upper()) or "❌ Нет прогноза для этого груза")
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: история пишется без межпроцессной блокировки
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 550
+DEFAULT_TTL_SECONDS = 3600
+HISTORY_PATH = 'data/exchange_rates.jsonl'
+# Сколько байт с конца файла истории читать, чтобы найти последнюю запись
+HISTORY_TAIL_BYTES = 4096
+
+
+def parse_timestamp(value):
+    """
+    Момент из datetime или ISO-строки ('2025-10-01', '2025-10-01 12:00:00', '2025-10-01T12:00:00+06:00')
+    в наивное местное время - в нем пишутся отметки FileRateSource. ValueError, если строка не ISO.
+    """
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if value.tzinfo:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class RateSnapshot(dict):
+    """Курс и момент, на который он действует: {'rate': 550, 'timestamp': '2025-10-10T12:00:00', 'source': 'file'}"""
+
+    @property
+    def rate(self):
+        return self['rate']
+
+    @property
+    def timestamp(self):
+        return self['timestamp']
+
+    @property
+    def source(self):
+        return self.get('source')
+
+
+class FileRateSource:
+    """Курс из config.json (EXCHANGE_RATE.rate); время курса - время изменения файла"""
+    name = "file"
+
+    def __init__(self, path='config.json'):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            rate = json.load(f)["EXCHANGE_RATE"]["rate"]
+        timestamp = datetime.fromtimestamp(os.path.getmtime(self.path)).isoformat(timespec='seconds')
+        return RateSnapshot(rate=rate, timestamp=timestamp, source=self.name)
+
+
+class HttpRateSource:
+    """Курс по HTTP: сервис отвечает JSON {"rate": 550, "timestamp": "..."}"""
+    name = "http"
+
+    def __init__(self, url, timeout=3):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        import requests
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        timestamp = data.get("timestamp") or datetime.now().isoformat(timespec='seconds')
+        return RateSnapshot(rate=float(data["rate"]), timestamp=timestamp, source=self.name)
+
+
+class ExchangeRateProvider:
+    """
+    Поставщик курса USD/KZT.
+    current() всегда отвечает из памяти за O(1); когда курс старше TTL, обновление запускается
+    в фоновом потоке, а расчеты продолжают идти по последнему известному курсу.
+    Каждое изменение курса дописывается в историю, по которой rate_at() находит курс на любой момент.
+    Историю в файл пишут все воркеры gunicorn, поэтому запись идет под flock и пропускается,
+    если другой воркер уже записал этот курс.
+    """
+
+    def __init__(self, source, fallback_rate=DEFAULT_RATE, ttl=DEFAULT_TTL_SECONDS, history_path=HISTORY_PATH):
+        self.source = source
+        self.ttl = ttl
+        self.history_path = history_path
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.history = self._load_history()
+
+        if self.history:
+            self.snapshot = self.history[-1]
+        else:
+            self.snapshot = RateSnapshot(rate=fallback_rate, timestamp=datetime.now().isoformat(timespec='seconds'), source="default")
+        # Курс из истории или по умолчанию считается устаревшим, чтобы первое обращение запустило обновление
+        self.fetched_at = float('-inf')
+
+    def _load_history(self):
+        history = []
+        self.timestamps = []
+        if not self.history_path or not os.path.exists(self.history_path):
+            return history
+        dated = []
+        with open(self.history_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                snapshot = RateSnapshot(json.loads(line))
+                try:
+                    dated.append((parse_timestamp(snapshot.timestamp), snapshot))
+                except ValueError:
+                    logger.warning(f"Пропущена запись истории курса с неверной датой: {line}")
+        dated.sort(key=lambda item: item[0])
+        self.timestamps = [moment for moment, _ in dated]
+        return [snapshot for _, snapshot in dated]
+
+    def _append_history(self, snapshot):
+        if self.history and self.history[-1].rate == snapshot.rate:
+            return
+        try:
+            moment = parse_timestamp(snapshot.timestamp)
+        except ValueError:
+            logger.warning(f"Курс без даты не попадет в историю: {snapshot}")
+            return
+        self.history.append(snapshot)
+        self.timestamps.append(moment)
+        if not self.history_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.history_path) or '.', exist_ok=True)
+            self._write_history(snapshot)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить историю курса: {e}")
+
+    def _write_history(self, snapshot):
+        """Дописывает снимок в файл, если последняя запись файла - другой курс (ее мог оставить другой воркер)"""
+        with open(self.history_path, 'a+b') as f:
+            if fcntl:
+                # Блокировка снимается при закрытии файла
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - HISTORY_TAIL_BYTES))
+            lines = f.read().splitlines()
+            if lines and lines[-1].strip():
+                try:
+                    if json.loads(lines[-1]).get('rate') == snapshot.rate:
+                        return
+                except ValueError:
+                    pass
+            f.write((json.dumps(snapshot, ensure_ascii=False) + "\n").encode('utf-8'))
+
+    def refresh(self):
+        """Синхронно получает курс из источника и возвращает актуальный снимок"""
+        try:
+            snapshot = self.source.fetch()
+            with self.lock:
+                if snapshot.rate != self.snapshot.rate:
+                    logger.info(f">>> Курс обновлен: {self.snapshot.rate} -> {snapshot.rate} ({snapshot.source})")
+                self.snapshot = snapshot
+                self.fetched_at = time.monotonic()
+                self._append_history(snapshot)
+        except Exception as e:
+            logger.error(f"!!! Ошибка получения курса ({self.source.name}): {e}")
+            # Повторим не раньше чем через минуту, а пока работаем по старому курсу
+            self.fetched_at = time.monotonic() - self.ttl + min(60, self.ttl)
+        finally:
+            self.refreshing = False
+        return self.snapshot
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def current(self):
+        """Текущий курс без ожидания сети"""
+        if time.monotonic() - self.fetched_at > self.ttl:
+            self._refresh_in_background()
+        return self.snapshot
+
+    def rate_at(self, when):
+        """
+        Курс, действовавший в момент when (datetime или ISO-строка; дата без времени - начало дня).
+        Сравниваются моменты, а не строки: '2025-10-01 12:00:00' и '2025-10-01T12:00:00' - одно и то же.
+        """
+        position = bisect_right(self.timestamps, parse_timestamp(when)) - 1
+        if position < 0:
+            return self.history[0] if self.history else self.snapshot
+        return self.history[position]
+
+
+def create_rate_provider(config):
+    """Источник: EXCHANGE_RATE_URL (HTTP), иначе config.json. TTL - EXCHANGE_RATE.ttl_seconds."""
+    rate_config = (config or {}).get("EXCHANGE_RATE", {})
+    url = os.getenv('EXCHANGE_RATE_URL')
+    source = HttpRateSource(url) if url else FileRateSource()
+    return ExchangeRateProvider(
+        source,
+        fallback_rate=rate_config.get("rate", DEFAULT_RATE),
+        ttl=rate_config.get("ttl_seconds", DEFAULT_TTL_SECONDS)
+    )
+
+
+def serve_rates(port, rate):
+    """Локальная замена сервиса курсов для проверки HttpRateSource"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class RateHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"rate": rate, "timestamp": datetime.now().isoformat(timespec='seconds')}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"🚀 Курс {rate} на http://127.0.0.1:{port}/ (EXCHANGE_RATE_URL=http://127.0.0.1:{port}/)")
+    HTTPServer(('127.0.0.1', port), RateHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный сервис курса USD/KZT")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE)
+    args = parser.parse_args()
+    serve_rates(args.port, args.rate)
@@ -0,0 +1,168 @@
+import re
+import logging
+
+from product_classifier import get_classifier
+from dimensions import parse_packages
+from parse_guard import guarded, scan_weight, scan_volume
+
+logger = logging.getLogger(__name__)
+
+# Максимальные размеры для доставки до двери (в метрах)
+MAX_DIMENSIONS = {
+    'length': 2.3,   # 230 см
+    'width': 1.8,    # 180 см 
+    'height': 1.1    # 110 см
+}
+
+def find_product_category(text, product_categories):
+    """
+    Находит категорию товара по тексту (по основам слов, см. product_classifier)
+    """
+    if not text:
+        return None
+
+    return get_classifier(product_categories).classify(text)
+
+@guarded(parse_packages)
+def extract_packages(text):
+    """Места груза с размерами и количеством (см. dimensions): "3 коробки 60×40×40" -> [Package(0.6x0.4x0.4 × 3)]"""
+    packages = parse_packages(text)
+    for package in packages:
+        logger.info(f"Извлечены габариты: {package.length:.3f}x{package.width:.3f}x{package.height:.3f} м × {package.count}")
+    return packages
+
+def extract_dimensions(text):
+    """Извлекает габариты одного места (длина, ширина, высота в метрах) - первые найденные в тексте."""
+    packages = extract_packages(text)
+    if not packages:
+        return None, None, None
+    return packages[0].dimensions()
+
+@guarded(scan_volume)
+def extract_volume(text):
+    """Извлекает готовый объем из текста в любом формате."""
+    patterns = [
+        r'(?<!\d)(\d+(?:[.,]\d+)?)\s*(?:куб\.?\s*м|м³|м3|куб\.?|кубическ\w+\s*метр\w*|кубометр\w*)',
+        r'(?:объем|volume)\w*\s*(\d+(?:[.,]\d+)?)\s*(?:куб\.?\s*м|м³|м3|куб\.?)?',
+        r'(?<!\d)(\d+(?:[.,]\d+)?)\s*(?:cubic|cub)',
+        r'(?<!\d)(\d+(?:[.,]\d+)?)\s*(?=куб|м³|м3|объем)'
+    ]
+    
+    text_lower = text.lower()
+    
+    for pattern in patterns:
+        match = re.search(pattern, text_lower)
+        if match:
+            try:
+                volume = float(match.group(1).replace(',', '.'))
+                logger.info(f"Извлечен объем: {volume} м³")
+                return volume
+            except (ValueError, IndexError) as e:
+                logger.warning(f"Ошибка преобразования объема: {e}")
+                continue
+    
+    return None
+
+def check_dimensions_exceeded(length, width, height):
+    """Проверяет, превышает ли груз максимальные размеры для доставки до двери"""
+    if not length or not width or not height:
+        return False
+    
+    return (length > MAX_DIMENSIONS['length'] or 
+            width > MAX_DIMENSIONS['width'] or 
+            height > MAX_DIMENSIONS['height'])
+
+def scan_delivery_info(text, destination_zones, product_categories):
+    """Длинное сообщение: вес - сканированием токенов, город и категория - теми же линейными проверками"""
+    text_lower = text.lower()
+    city = next((city_name for city_name in destination_zones if city_name in text_lower), None)
+    return scan_weight(text), find_product_category(text, product_categories), city
+
+@guarded(scan_delivery_info)
+def extract_delivery_info(text, destination_zones, product_categories):
+    """
+    Извлечение данных о доставки: вес, категория товара и город.
+    destination_zones - названия городов в порядке config.json (например, TariffTables.city_names()),
+    product_categories - PRODUCT_CATEGORIES из config.json
+    """
+    weight = None
+    product_type = None
+    city = None
+    
+    try:
+        weight_patterns = [
+            r'(?<!\d)(\d+(?:\.\d+)?)\s*(?:кг|kg|килограмм|кило)',
+            r'вес\s*(?:[:\-]\s*)?(\d+(?:\.\d+)?)',
+        ]
+        
+        for pattern in weight_patterns:
+            match = re.search(pattern, text.lower())
+            if match:
+                weight = float(match.group(1))
+                break
+        
+        # Используем новую функцию определения города
+        text_lower = text.lower()
+        for city_name in destination_zones:
+            if city_name in text_lower:
+                city = city_name
+                break
+        
+        # Используем новую функцию определения категории товара
+        product_type = find_product_category(text, product_categories)
+        
+        return weight, product_type, city
+    except Exception as e:
+        logger.error(f"Ошибка извлечения данных: {e}")
+        return None, None, None
+
+def scan_contact_info(text):
+    """Контакты - короткое сообщение; в длинном их не ищем"""
+    return None, None
+
+@guarded(scan_contact_info)
+def extract_contact_info(text):
+    """Умное извлечение контактных данных"""
+    name = None
+    phone = None
+    
+    clean_text = re.sub(r'\s+', ' ', text.strip()).lower()
+    
+    # Улучшенный поиск имени - ищем в любом месте текста
+    name_patterns = [
+        r'(?:имя|меня зовут|зовут)\s*(?:[:\-]\s*)?([а-яa-z]{2,})',
+        r'^([а-яa-z]{2,})(?:\s|,|$)',
+        r'(?<![а-яa-z])([а-яa-z]{2,})\s*(?:\d|,|$)'
+    ]
+    
+    for pattern in name_patterns:
+        name_match = re.search(pattern, clean_text)
+        if name_match:
+            name = name_match.group(1).capitalize()
+            break
+    
+    phone_patterns = [
+        r'(\d{10,11})',
+        r'(\d{3}[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2})',
+        r'(\d{3}[\s\-]?\d{2}[\s\-]?\d{2}[\s\-]?\d{3})',
+    ]
+    
+    for pattern in phone_patterns:
+        phone_match = re.search(pattern, clean_text)
+        if phone_match:
+            phone = re.sub(r'\D', '', phone_match.group(1))
+            if phone.startswith('8'):
+                phone = '7' + phone[1:]
+            elif len(phone) == 10:
+                phone = '7' + phone
+            break
+    
+    if name and phone and len(phone) >= 10:
+        return name, phone
+    
+    if phone and not name:
+        name_before_comma = re.search(r'^([а-яa-z]+)\s*[,]', clean_text)
+        if name_before_comma:
+            name = name_before_comma.group(1).capitalize()
+    
+    return name, phone
@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import logging
+import argparse
+from logging_setup import plain_log_line
+
+logger = logging.getLogger(__name__)
+
+# Слова, которые не несут смысла для определения интента и не снижают уверенность
+STOP_WORDS = {
+    'а', 'и', 'ну', 'же', 'ли', 'вот', 'так', 'да', 'ой', 'эй', 'ок', 'ладно',
+    'мне', 'меня', 'тебе', 'тебя', 'вам', 'вас', 'пожалуйста', 'бот', 'ассистент',
+    'очень', 'большое', 'огромное'
+}
+
+# Длина префикса слова для поиска в индексе
+MIN_STEM_LENGTH = 4
+
+TOKEN_PATTERN = re.compile(r'[a-zа-яёәғқңөұүһі0-9]+')
+LOG_REQUEST_PATTERN = re.compile(r'=== НОВЫЙ ЗАПРОС: (.*) ===')
+
+
+def tokenize(text):
+    """Разбивает текст на токены в нижнем регистре"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class FaqEngine:
+    """
+    Локальный движок ответов на частые вопросы.
+    Ключевые слова из intent_config.json["free_chat_priority"] собираются в инвертированный индекс,
+    ответы берутся из intent_config.json["faq_answers"], а правило возврата к теме - из response_rules.txt.
+    Слова ключей сравниваются с токенами целиком ("пока" не совпадает с "покажи"); с любым окончанием -
+    только основы из intent_config.json["faq_stems"] ("здравств" -> "здравствуйте").
+    """
+
+    def __init__(self, intent_config_path='intent_config.json', rules_path='response_rules.txt'):
+        with open(intent_config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        self.intents = config.get("free_chat_priority", {})
+        self.answers = config.get("faq_answers", {})
+        self.threshold = config.get("faq_threshold", 0.6)
+        self.stems = set(config.get("faq_stems", []))
+        self.back_to_topic = self._load_back_to_topic(rules_path)
+        self.index = self._build_index()
+
+    def _load_back_to_topic(self, rules_path):
+        """Достает фразу из раздела '## ВОЗВРАТ К ТЕМЕ' в response_rules.txt"""
+        try:
+            with open(rules_path, 'r', encoding='utf-8') as f:
+                rules_text = f.read()
+        except FileNotFoundError:
+            logger.warning("!!! Файл response_rules.txt не найден, ответы без возврата к теме")
+            return ""
+
+        section = re.search(r'## ВОЗВРАТ К ТЕМЕ:?\s*\n(.*?)(?:\n## |\Z)', rules_text, re.S)
+        if not section:
+            return ""
+        phrase = re.search(r'"([^"]+)"', section.group(1))
+        return phrase.group(1) if phrase else ""
+
+    def _build_index(self):
+        """
+        Строит инвертированный индекс: префикс первого слова ключа -> [(слова ключа, интент, приоритет)]
+        """
+        index = {}
+        for priority, (intent, keywords) in enumerate(self.intents.items()):
+            for keyword in keywords:
+                words = tokenize(keyword)
+                if not words:
+                    continue
+                key = words[0][:MIN_STEM_LENGTH]
+                index.setdefault(key, []).append((words, intent, priority))
+        return index
+
+    def _word_matches(self, token, word):
+        if word in self.stems:
+            return token.startswith(word)
+        return token == word
+
+    def classify(self, message):
+        """
+        Определяет интент сообщения.
+        Возвращает (интент, уверенность 0..1). Уверенность - доля значимых слов, покрытых ключами интента.
+        """
+        tokens = tokenize(message)
+        content_positions = [i for i, token in enumerate(tokens) if token not in STOP_WORDS]
+        if not content_positions:
+            return None, 0.0
+
+        covered = {}  # интент -> множество покрытых позиций
+        priorities = {}
+        for i, token in enumerate(tokens):
+            for words, intent, priority in self.index.get(token[:MIN_STEM_LENGTH], ()):
+                if i + len(words) > len(tokens):
+                    continue
+                if all(self._word_matches(tokens[i + j], word) for j, word in enumerate(words)):
+                    covered.setdefault(intent, set()).update(range(i, i + len(words)))
+                    priorities[intent] = priority
+
+        if not covered:
+            return None, 0.0
+
+        content = set(content_positions)
+        best_intent = min(covered, key=lambda intent: (-len(covered[intent] & content), priorities[intent]))
+        confidence = len(covered[best_intent] & content) / len(content)
+        return best_intent, confidence
+
+    def answer(self, message):
+        """
+        Возвращает готовый ответ, если уверенность выше порога и для интента есть шаблон.
+        Иначе None - сообщение нужно передать Gemini.
+        """
+        intent, confidence = self.classify(message)
+        template = self.answers.get(intent)
+        if not template or confidence < self.threshold:
+            return None
+
+        logger.info(f"=== ЛОКАЛЬНЫЙ ОТВЕТ FAQ: {intent} ({confidence:.2f}) ===")
+        if self.back_to_topic and intent not in ("greetings", "goodbye"):
+            return f"{template}\n\n{self.back_to_topic}"
+        return template
+
+
+def load_corpus(path):
+    """
+    Загружает сообщения для прогона: строки '=== НОВЫЙ ЗАПРОС: ... ===' из лога
+    или просто по одному сообщению на строку из текстового файла
+    """
+    is_log = path.endswith('.log')
+    messages = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if is_log:
+                match = LOG_REQUEST_PATTERN.search(plain_log_line(line))
+                if match:
+                    messages.append(match.group(1).strip())
+            else:
+                messages.append(line.strip())
+    return [message for message in messages if message]
+
+
+def replay_report(engine, messages, llm_latency_ms):
+    """Прогоняет корпус через движок и печатает долю локальных ответов и выигрыш по времени"""
+    served_locally = 0
+    intents = {}
+    local_time = 0.0
+
+    for message in messages:
+        started = time.perf_counter()
+        answer = engine.answer(message)
+        local_time += time.perf_counter() - started
+        if answer:
+            served_locally += 1
+            intent, _ = engine.classify(message)
+            intents[intent] = intents.get(intent, 0) + 1
+
+    total = len(messages)
+    if not total:
+        print("❌ Корпус пуст")
+        return
+
+    avg_local_us = local_time / total * 1_000_000
+    before_ms = total * llm_latency_ms
+    after_ms = local_time * 1000 + (total - served_locally) * llm_latency_ms
+
+    print(f"📊 Сообщений в корпусе: {total}")
+    print(f"✅ Отвечено локально: {served_locally} ({served_locally / total:.1%})")
+    for intent, count in sorted(intents.items(), key=lambda item: -item[1]):
+        print(f"   - {intent}: {count}")
+    print(f"⏱ Средняя задержка локального движка: {avg_local_us:.1f} мкс")
+    print(f"⏱ Средняя задержка без FAQ (Gemini ~{llm_latency_ms:.0f} мс): {before_ms / total:.1f} мс")
+    print(f"⏱ Средняя задержка с FAQ: {after_ms / total:.1f} мс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Отчет о доле сообщений, которые FAQ отвечает без Gemini")
+    parser.add_argument('corpus', nargs='?', default='app.log', help="app.log или файл с сообщением на строку")
+    parser.add_argument('--llm-ms', type=float, default=1500, help="средняя задержка ответа Gemini, мс")
+    args = parser.parse_args()
+
+    messages = load_corpus(args.corpus)
+    replay_report(FaqEngine(), messages, args.llm_ms)
@@ -0,0 +1,19 @@
+"""
+Настройки gunicorn: файл подхватывается автоматически при запуске из корня проекта (gunicorn app:app).
+"""
+import os
+import json
+
+
+def on_starting(server):
+    """Мастер один раз собирает таблицы тарифов; воркеры отображают готовый файл через mmap"""
+    from tariff_tables import build_tariff_tables
+    try:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        path = os.getenv('TARIFF_TABLES_PATH', 'data/tariffs.bin')
+        build_tariff_tables(config, path)
+        server.log.info(f"✅ Таблицы тарифов собраны: {path}")
+    except (OSError, ValueError) as e:
+        # Воркеры соберут таблицы сами
+        server.log.error(f"!!! Таблицы тарифов не собраны: {e}")
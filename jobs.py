@@ -0,0 +1,322 @@
+"""
+Фоновые задания с хранением в SQLite: запись заявок, договоры, уведомления.
+
+Точка входа кладет задание в очередь и сразу отвечает клиенту; задания выполняют фоновые потоки.
+Неудачное задание повторяется с растущей паузой, после max_attempts попыток помечается failed.
+Файл базы общий для всех процессов: задание забирается транзакцией BEGIN IMMEDIATE, поэтому
+два воркера gunicorn не возьмут одно задание. Если процесс упал посреди задания,
+после lease_seconds его заберет другой поток.
+
+    python jobs.py list --status failed
+    python jobs.py status 42
+    python jobs.py retry 42
+    python jobs.py bench --downstream-ms 800
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.getenv('JOBS_DB_PATH', 'data/jobs.db')
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+# Пауза перед повтором: 2, 4, 8... секунд, не больше BACKOFF_MAX
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+# Сколько задание может выполняться, прежде чем его заберет другой поток
+LEASE_SECONDS = 300
+POLL_SECONDS = 1.0
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_after);
+"""
+
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+class JobQueue:
+    """
+    Очередь заданий процесса. Обработчики регистрируются по виду задания (register);
+    поток забирает только задания тех видов, для которых в этом процессе есть обработчик.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, workers=DEFAULT_WORKERS, lease_seconds=LEASE_SECONDS):
+        self.db_path = db_path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.handlers = {}
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        self.start_lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+        self.stopping = False
+
+    def connection(self):
+        """
+        Свое соединение у каждого потока (и у процесса после fork). Файл базы создается при первом
+        обращении, а не при создании очереди: модуль с очередью можно импортировать без data/jobs.db.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    # --- РЕГИСТРАЦИЯ И ПОСТАНОВКА ---
+    def register(self, kind, handler, on_failure=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        handler(payload) выполняет задание (исключение - неудачная попытка), возвращает результат для status().
+        on_failure(payload, error) вызывается один раз, когда попытки кончились.
+        """
+        self.handlers[kind] = (handler, on_failure, max_attempts)
+
+    def enqueue(self, kind, payload, delay=0):
+        """Кладет задание в очередь и возвращает его id; выполнение - в фоне"""
+        _, _, max_attempts = self.handlers.get(kind, (None, None, DEFAULT_MAX_ATTEMPTS))
+        now = time.time()
+        cursor = self.connection().execute(
+            "INSERT INTO jobs (kind, payload, max_attempts, run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), max_attempts, now + delay, now, now)
+        )
+        self.start()
+        self.wakeup.set()
+        return cursor.lastrowid
+
+    # --- ВЫПОЛНЕНИЕ ---
+    def claim(self):
+        """Забирает одно готовое к выполнению задание (или задание с истекшей арендой) или возвращает None"""
+        if not self.handlers:
+            return None
+        kinds = list(self.handlers)
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                f"""
+                SELECT * FROM jobs
+                WHERE kind IN ({', '.join('?' * len(kinds))})
+                  AND ((status = ? AND run_after <= ?) OR (status = ? AND locked_until < ?))
+                ORDER BY run_after, id LIMIT 1
+                """,
+                (*kinds, QUEUED, now, RUNNING, now)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                    (RUNNING, now + self.lease_seconds, now, row['id'])
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def run_once(self):
+        """Выполняет одно задание; False, если выполнять нечего"""
+        row = self.claim()
+        if row is None:
+            return False
+
+        handler, on_failure, _ = self.handlers[row['kind']]
+        payload = json.loads(row['payload'])
+        attempts = row['attempts'] + 1
+        connection = self.connection()
+        try:
+            result = handler(payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            now = time.time()
+            if attempts < row['max_attempts']:
+                delay = backoff_seconds(attempts)
+                connection.execute(
+                    "UPDATE jobs SET status = ?, run_after = ?, locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                    (QUEUED, now + delay, error, now, row['id'])
+                )
+                logger.warning(f"⚠️ Задание #{row['id']} ({row['kind']}) не выполнено, попытка {attempts}, повтор через {delay} с: {error}")
+            else:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, traceback.format_exc(limit=5), now, row['id'])
+                )
+                logger.error(f"❌ Задание #{row['id']} ({row['kind']}) не выполнено после {attempts} попыток: {error}")
+                if on_failure:
+                    try:
+                        on_failure(payload, error)
+                    except Exception as failure_error:
+                        logger.error(f"❌ Ошибка обработки сбоя задания #{row['id']}: {failure_error}")
+            return True
+
+        connection.execute(
+            "UPDATE jobs SET status = ?, locked_until = NULL, result = ?, updated_at = ? WHERE id = ?",
+            (DONE, json.dumps(result, ensure_ascii=False, default=str), time.time(), row['id'])
+        )
+        return True
+
+    def work(self):
+        while not self.stopping:
+            try:
+                if self.run_once():
+                    continue
+            except sqlite3.Error as e:
+                logger.error(f"❌ Ошибка очереди заданий: {e}")
+            self.wakeup.wait(POLL_SECONDS)
+            self.wakeup.clear()
+
+    def start(self):
+        """Запускает фоновые потоки (один раз на процесс; после fork - заново)"""
+        if self.pid == os.getpid() or not self.handlers:
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.stopping = False
+            self.threads = [
+                threading.Thread(target=self.work, name=f"jobs-{i}", daemon=True) for i in range(self.workers)
+            ]
+            for thread in self.threads:
+                thread.start()
+            self.pid = os.getpid()
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.pid = None
+
+    def drain(self, timeout=30):
+        """Ждет, пока не останется заданий в очереди и в работе (для CLI и проверок)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            counts = self.counts()
+            if not counts.get(QUEUED) and not counts.get(RUNNING):
+                return True
+            self.wakeup.set()
+            time.sleep(0.05)
+        return False
+
+    # --- СТАТУС ---
+    def status(self, job_id):
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def counts(self):
+        """Число заданий по статусам"""
+        rows = self.connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def list(self, status=None, limit=50):
+        query = "SELECT id, kind, status, attempts, last_error, updated_at FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        return [dict(row) for row in self.connection().execute(query + " ORDER BY id DESC LIMIT ?", (*params, limit))]
+
+    def retry(self, job_id):
+        """Возвращает задание в очередь с новым запасом попыток"""
+        cursor = self.connection().execute(
+            "UPDATE jobs SET status = ?, attempts = 0, run_after = ?, locked_until = NULL, updated_at = ? WHERE id = ? AND status != ?",
+            (QUEUED, time.time(), time.time(), job_id, RUNNING)
+        )
+        self.wakeup.set()
+        return cursor.rowcount > 0
+
+
+def run_benchmark(downstream_ms, count):
+    """Задержка ответа: запись заявки прямо в обработчике против постановки в очередь при медленной записи"""
+    import tempfile
+
+    def slow_write(payload):
+        time.sleep(downstream_ms / 1000)
+
+    with tempfile.TemporaryDirectory() as directory:
+        queue = JobQueue(os.path.join(directory, 'jobs.db'), workers=4)
+        queue.register('application', slow_write)
+
+        started = time.perf_counter()
+        for i in range(count):
+            slow_write({'details': i})
+        sync_ms = (time.perf_counter() - started) / count * 1000
+
+        started = time.perf_counter()
+        for i in range(count):
+            queue.enqueue('application', {'details': i})
+        queued_ms = (time.perf_counter() - started) / count * 1000
+
+        drained = queue.drain(timeout=count * downstream_ms / 1000 + 10)
+        queue.stop()
+        print(f"⏱ Запись в обработчике: {sync_ms:.1f} мс на ответ")
+        print(f"⏱ Постановка в очередь: {queued_ms:.2f} мс на ответ")
+        print(f"✅ Выполнено в фоне: {queue.counts().get(DONE, 0)}/{count}" + ("" if drained else " (не дождались)"))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Фоновые задания")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help="последние задания")
+    list_parser.add_argument('--status', choices=[QUEUED, RUNNING, DONE, FAILED])
+    list_parser.add_argument('--limit', type=int, default=50)
+    status_parser = commands.add_parser('status', help="задание целиком")
+    status_parser.add_argument('job_id', type=int)
+    retry_parser = commands.add_parser('retry', help="вернуть задание в очередь")
+    retry_parser.add_argument('job_id', type=int)
+    bench_parser = commands.add_parser('bench', help="задержка ответа с очередью и без")
+    bench_parser.add_argument('--downstream-ms', type=float, default=800)
+    bench_parser.add_argument('--count', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'bench':
+        run_benchmark(args.downstream_ms, args.count)
+    else:
+        job_queue = JobQueue(args.db)
+        if args.command == 'list':
+            print(f"📊 {job_queue.counts()}")
+            for job in job_queue.list(args.status, args.limit):
+                print(f"#{job['id']} {job['kind']} {job['status']} попыток: {job['attempts']} {job['last_error'] or ''}")
+        elif args.command == 'status':
+            print(json.dumps(job_queue.status(args.job_id), ensure_ascii=False, indent=2, default=str))
+        elif job_queue.retry(args.job_id):
+            print(f"✅ Задание #{args.job_id} возвращено в очередь")
+        else:
+            print(f"❌ Задание #{args.job_id} не найдено или выполняется")
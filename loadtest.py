@@ -0,0 +1,439 @@
+"""
+Прогон записанных диалогов против /chat: корпус из логов и нагрузка с заглушкой Gemini.
+
+    python loadtest.py extract app.log -o corpus.jsonl
+    python loadtest.py run corpus.jsonl --users 50 --workers 4 --llm-latency-ms 800 --llm-p95-ms 2500
+    python loadtest.py serve --port 5001 --workers 4 --llm-latency-ms 800     # gunicorn с заглушкой
+    python loadtest.py run corpus.jsonl --users 50 --url http://127.0.0.1:5001
+    python loadtest.py run corpus.jsonl --users 2000 --asgi --duration 30
+
+В режиме run без --url запросы идут в процессе через тестовый клиент Flask, а --workers ограничивает
+число одновременно обрабатываемых запросов, как sync-воркеры gunicorn.
+С --asgi запросы идут в процессе в asgi.py: все пользователи - корутины одного event loop.
+"""
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import datetime
+from logging_setup import plain_log_line
+
+logger = logging.getLogger(__name__)
+
+# '2025-10-10 12:39:00,648 - INFO - === НОВЫЙ ЗАПРОС: 50 кг мебель === [5f2c...]' (время и сессия - если есть);
+# JSON-записи лога приводятся к этому виду через plain_log_line
+LOG_LINE_PATTERN = re.compile(
+    r'(?:(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})[^=]*)?'
+    r'=== НОВЫЙ ЗАПРОС: (?P<message>.*) ===(?: \[(?P<session>[0-9a-f]+)\])?'
+)
+
+# Без идентификатора сессии диалог считается законченным после паузы или команды "старт"
+DEFAULT_GAP_MINUTES = 30
+START_COMMANDS = ('старт', 'start', 'новый расчет', 'сначала', 'новая заявка')
+
+# Ответы /chat, которые означают ошибку, хотя статус 200
+ERROR_RESPONSES = ("Извините, произошла ошибка",)
+LLM_FALLBACK_RESPONSES = ("Ой, кажется, у меня что-то пошло не так",)
+
+
+# --- КОРПУС ---
+
+def extract_conversations(lines, gap_minutes=DEFAULT_GAP_MINUTES):
+    """Строки лога -> список диалогов (списков сообщений) в порядке появления"""
+    by_session = {}
+    conversations = []
+    current = None
+    last_time = None
+
+    for line in lines:
+        match = LOG_LINE_PATTERN.search(plain_log_line(line))
+        if not match:
+            continue
+        message = match.group('message').strip()
+        if not message:
+            continue
+
+        session_id = match.group('session')
+        if session_id:
+            if session_id not in by_session:
+                by_session[session_id] = []
+                conversations.append(by_session[session_id])
+            by_session[session_id].append(message)
+            continue
+
+        when = datetime.strptime(match.group('time'), '%Y-%m-%d %H:%M:%S') if match.group('time') else None
+        gap = when and last_time and (when - last_time).total_seconds() > gap_minutes * 60
+        if current is None or gap or message.lower() in START_COMMANDS:
+            current = []
+            conversations.append(current)
+        current.append(message)
+        last_time = when or last_time
+
+    return [conversation for conversation in conversations if conversation]
+
+
+def load_corpus(path):
+    """Корпус: JSONL {"messages": [...]} или текст - по сообщению на строку, диалоги через пустую строку"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    if path.endswith('.log'):
+        return extract_conversations(text.splitlines())
+    if path.endswith('.jsonl'):
+        return [json.loads(line)["messages"] for line in text.splitlines() if line.strip()]
+    blocks = re.split(r'\n\s*\n', text)
+    return [[line.strip() for line in block.splitlines() if line.strip()] for block in blocks if block.strip()]
+
+
+# --- ЗАГЛУШКА GEMINI ---
+
+class StubGemini:
+    """
+    Заглушка модели с логнормальной задержкой: медиана latency_ms, 95-й перцентиль p95_ms.
+    error_rate - доля вызовов, которые падают (как таймауты API).
+    """
+
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, latency_ms, p95_ms=None, error_rate=0.0, seed=None):
+        self.mu = math.log(max(latency_ms, 0.001) / 1000)
+        p95_ms = p95_ms or latency_ms
+        # для логнормального распределения p95 = медиана * exp(1.645 * sigma)
+        self.sigma = max(0.0, math.log(p95_ms / max(latency_ms, 0.001)) / 1.645)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _draw(self):
+        with self.lock:
+            return self.random.lognormvariate(self.mu, self.sigma), self.random.random() < self.error_rate
+
+    def generate_content(self, contents=None, generation_config=None):
+        delay, failed = self._draw()
+        time.sleep(delay)
+        if failed:
+            raise TimeoutError("заглушка: таймаут Gemini")
+        return self.Response("Ответ заглушки Gemini")
+
+    async def generate_content_async(self, contents=None, generation_config=None):
+        delay, failed = self._draw()
+        await asyncio.sleep(delay)
+        if failed:
+            raise TimeoutError("заглушка: таймаут Gemini")
+        return self.Response("Ответ заглушки Gemini")
+
+
+def install_stub(stub, keep_limits=False):
+    """
+    Подменяет модель в chat_service и отключает запись заявок в applications.txt.
+    Лимиты отключаются, чтобы нагрузка с одного адреса не упиралась в 429.
+    """
+    import chat_service
+    chat_service.model = stub
+    chat_service.save_application = lambda details: None
+    chat_service.rate_limiter.enabled = keep_limits
+
+
+# --- КЛИЕНТЫ ---
+
+class InProcessClient:
+    """Тестовый клиент Flask; семафор воркеров моделирует ограниченное число воркеров gunicorn"""
+
+    def __init__(self, chat_app, worker_slots, ip):
+        self.client = chat_app.app.test_client()
+        self.worker_slots = worker_slots
+        self.ip = ip
+
+    def post(self, message):
+        with self.worker_slots:
+            response = self.client.post('/chat', json={'message': message}, environ_base={'REMOTE_ADDR': self.ip})
+        return response.status_code, (response.get_json(silent=True) or {}).get('response', '')
+
+
+class HttpClient:
+    """Запросы к запущенному серверу; у каждого пользователя своя cookie-сессия и свой X-Forwarded-For"""
+
+    def __init__(self, url, ip, timeout):
+        import requests
+        self.session = requests.Session()
+        self.url = url.rstrip('/') + '/chat'
+        self.headers = {'X-Forwarded-For': ip}
+        self.timeout = timeout
+
+    def post(self, message):
+        response = self.session.post(self.url, json={'message': message}, headers=self.headers, timeout=self.timeout)
+        try:
+            text = response.json().get('response', '')
+        except ValueError:
+            text = ''
+        return response.status_code, text
+
+
+# --- НАГРУЗКА ---
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.llm_fallbacks = 0
+        self.conversations = 0
+
+    def record(self, status, text, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status >= 500 or status == 0 or text.startswith(ERROR_RESPONSES):
+                self.errors += 1
+            if text.startswith(LLM_FALLBACK_RESPONSES):
+                self.llm_fallbacks += 1
+
+    def conversation_done(self):
+        with self.lock:
+            self.conversations += 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class ConversationFeed:
+    """Диалоги корпуса в случайном порядке: по кругу до дедлайна или один проход, если дедлайна нет"""
+
+    def __init__(self, conversations, duration, seed):
+        self.conversations = conversations
+        self.deadline = time.monotonic() + duration if duration else None
+        self.order = list(range(len(conversations)))
+        random.Random(seed).shuffle(self.order)
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def take(self):
+        with self.lock:
+            if self.expired() or (self.deadline is None and self.position >= len(self.order)):
+                return None
+            position = self.position
+            self.position += 1
+            return self.conversations[self.order[position % len(self.order)]]
+
+
+def user_ip(user_id):
+    return f"10.{user_id // 65536 % 256}.{user_id // 256 % 256}.{user_id % 256}"
+
+
+def run_load(conversations, users, make_client, duration, think_ms, seed):
+    """
+    users потоков-пользователей берут диалоги из корпуса и отправляют сообщения по очереди,
+    каждый диалог - в новой сессии. Останов - по времени duration или когда корпус пройден один раз.
+    """
+    stats = LoadStats()
+    feed = ConversationFeed(conversations, duration, seed)
+
+    def user(user_id):
+        while True:
+            conversation = feed.take()
+            if conversation is None:
+                return
+            client = make_client(user_ip(user_id))
+            for message in conversation:
+                if feed.expired():
+                    return
+                started = time.perf_counter()
+                try:
+                    status, text = client.post(message)
+                except Exception as e:
+                    logger.warning(f"Ошибка запроса: {e}")
+                    status, text = 0, ''
+                stats.record(status, text, time.perf_counter() - started)
+                if think_ms:
+                    time.sleep(think_ms / 1000)
+            stats.conversation_done()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i + 1,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, time.perf_counter() - started
+
+
+def run_load_asgi(conversations, users, asgi_app, duration, think_ms, seed):
+    """То же для asgi.py в процессе: пользователи - корутины в одном event loop, без потоков"""
+    import httpx
+
+    stats = LoadStats()
+    feed = ConversationFeed(conversations, duration, seed)
+    transport = httpx.ASGITransport(app=asgi_app)
+
+    async def user(user_id):
+        while True:
+            conversation = feed.take()
+            if conversation is None:
+                return
+            headers = {'X-Forwarded-For': user_ip(user_id)}
+            async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', headers=headers) as client:
+                for message in conversation:
+                    if feed.expired():
+                        return
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post('/chat', json={'message': message})
+                        status, text = response.status_code, response.json().get('response', '')
+                    except Exception as e:
+                        logger.warning(f"Ошибка запроса: {e}")
+                        status, text = 0, ''
+                    stats.record(status, text, time.perf_counter() - started)
+                    if think_ms:
+                        await asyncio.sleep(think_ms / 1000)
+            stats.conversation_done()
+
+    async def run_all():
+        await asyncio.gather(*(user(i + 1) for i in range(users)))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+    return stats, time.perf_counter() - started
+
+
+def print_report(stats, elapsed, users):
+    total = len(stats.latencies)
+    if not total:
+        print("❌ Не отправлено ни одного запроса")
+        return
+    statuses = ", ".join(f"{status}: {count}" for status, count in sorted(stats.statuses.items()))
+    print(f"📊 Пользователей: {users}, диалогов: {stats.conversations}, запросов: {total} за {elapsed:.1f} с")
+    print(f"🚀 Пропускная способность: {total / elapsed:.1f} запр/с")
+    print(f"⏱ Задержка: p50 {percentile(stats.latencies, 0.50) * 1000:.0f} мс, "
+          f"p95 {percentile(stats.latencies, 0.95) * 1000:.0f} мс, "
+          f"p99 {percentile(stats.latencies, 0.99) * 1000:.0f} мс, "
+          f"max {max(stats.latencies) * 1000:.0f} мс")
+    print(f"❌ Ошибки: {stats.errors / total:.2%} ({stats.errors}), 429: {stats.statuses.get(429, 0)}, "
+          f"отказы Gemini: {stats.llm_fallbacks}")
+    print(f"📋 Статусы: {statuses}")
+
+
+# --- СЕРВЕР С ЗАГЛУШКОЙ ---
+
+def serve(port, workers, stub_options, keep_limits):
+    """gunicorn с заглушкой Gemini в каждом воркере (или dev-сервер Flask, если gunicorn не установлен)"""
+    def load_app():
+        import app as chat_app
+        install_stub(StubGemini(**stub_options), keep_limits)
+        return chat_app.app
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("⚠️ gunicorn не установлен - dev-сервер Flask с потоками вместо воркеров")
+        load_app().run(host='127.0.0.1', port=port, threaded=True)
+        return
+
+    class StubbedApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"127.0.0.1:{port}")
+            self.cfg.set('workers', workers)
+
+        def load(self):
+            return load_app()
+
+    StubbedApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон записанных диалогов и нагрузка на /chat")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract_parser = commands.add_parser('extract', help="лог -> корпус диалогов (JSONL)")
+    extract_parser.add_argument('log')
+    extract_parser.add_argument('-o', '--output', default='-')
+    extract_parser.add_argument('--gap-minutes', type=float, default=DEFAULT_GAP_MINUTES,
+                                help="пауза, после которой начинается новый диалог (если в логе нет сессий)")
+
+    run_parser = commands.add_parser('run', help="нагрузка: одновременные диалоги из корпуса")
+    run_parser.add_argument('corpus', help="JSONL из extract, лог (.log) или текст")
+    run_parser.add_argument('--users', type=int, default=10, help="одновременных пользователей")
+    run_parser.add_argument('--duration', type=float, help="секунд нагрузки (по умолчанию - один проход корпуса)")
+    run_parser.add_argument('--think-ms', type=float, default=0, help="пауза пользователя между сообщениями")
+    run_parser.add_argument('--url', help="адрес сервера; без него - в процессе через тестовый клиент")
+    run_parser.add_argument('--workers', type=int, default=4, help="воркеров в режиме без --url")
+    run_parser.add_argument('--asgi', action='store_true', help="в процессе через asgi.py (нужен httpx)")
+    run_parser.add_argument('--timeout', type=float, default=30, help="таймаут HTTP-запроса, сек")
+    run_parser.add_argument('--seed', type=int, default=42)
+
+    serve_parser = commands.add_parser('serve', help="сервер с заглушкой Gemini для прогона через --url")
+    serve_parser.add_argument('--port', type=int, default=5001)
+    serve_parser.add_argument('--workers', type=int, default=4)
+
+    for command_parser in (run_parser, serve_parser):
+        command_parser.add_argument('--llm-latency-ms', type=float, default=800, help="медиана задержки заглушки")
+        command_parser.add_argument('--llm-p95-ms', type=float, help="95-й перцентиль задержки заглушки")
+        command_parser.add_argument('--llm-error-rate', type=float, default=0.0, help="доля падений заглушки")
+        command_parser.add_argument('--keep-limits', action='store_true', help="не отключать лимиты запросов")
+
+    args = parser.parse_args()
+
+    if args.command == 'extract':
+        with open(args.log, 'r', encoding='utf-8', errors='replace') as f:
+            conversations = extract_conversations(f, args.gap_minutes)
+        output = open(args.output, 'w', encoding='utf-8') if args.output != '-' else sys.stdout
+        with output:
+            for conversation in conversations:
+                output.write(json.dumps({"messages": conversation}, ensure_ascii=False) + "\n")
+        print(f"✅ Диалогов: {len(conversations)}, сообщений: {sum(map(len, conversations))}", file=sys.stderr)
+        return
+
+    stub_options = {'latency_ms': args.llm_latency_ms, 'p95_ms': args.llm_p95_ms, 'error_rate': args.llm_error_rate}
+
+    if args.command == 'serve':
+        serve(args.port, args.workers, stub_options, args.keep_limits)
+        return
+
+    conversations = load_corpus(args.corpus)
+    if not conversations:
+        print("❌ Корпус пуст")
+        sys.exit(1)
+
+    logging.disable(logging.ERROR)
+    if args.asgi:
+        import asgi
+        install_stub(StubGemini(seed=args.seed, **stub_options), args.keep_limits)
+        print(f"🔄 Корпус: {len(conversations)} диалогов, режим: asgi.py в процессе")
+        stats, elapsed = run_load_asgi(conversations, args.users, asgi.app, args.duration, args.think_ms, args.seed)
+        print_report(stats, elapsed, args.users)
+        return
+
+    if args.url:
+        def make_client(ip):
+            return HttpClient(args.url, ip, args.timeout)
+        mode = args.url
+    else:
+        import app as chat_app
+        install_stub(StubGemini(seed=args.seed, **stub_options), args.keep_limits)
+        worker_slots = threading.Semaphore(args.workers)
+
+        def make_client(ip):
+            return InProcessClient(chat_app, worker_slots, ip)
+        mode = f"в процессе, воркеров: {args.workers}"
+
+    print(f"🔄 Корпус: {len(conversations)} диалогов, режим: {mode}")
+    stats, elapsed = run_load(conversations, args.users, make_client, args.duration, args.think_ms, args.seed)
+    print_report(stats, elapsed, args.users)
+
+
+if __name__ == '__main__':
+    main()
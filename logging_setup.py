@@ -0,0 +1,205 @@
+"""
+Логирование без ввода-вывода на пути запроса.
+Обработчик на корневом логгере только кладет запись в очередь; форматирование в JSON и вывод в stderr
+(и в файл, если задан LOG_FILE) делает фоновый поток QueueListener.
+
+Настройки - переменные окружения:
+    LOG_LEVEL=INFO, LOG_FORMAT=json|text, LOG_FILE (по умолчанию не задан - только stderr),
+    LOG_MAX_BYTES=0, LOG_BACKUP_COUNT=5, LOG_MAX_MESSAGE_CHARS=2000,
+    LOG_PAYLOAD_SAMPLE_RATE=0.05, LOG_PAYLOAD_MAX_CHARS=500
+
+Файл по умолчанию открывается WatchedFileHandler: несколько воркеров gunicorn дописывают в него
+параллельно, ротацию делает внешний logrotate. Ротация самим процессом (LOG_MAX_BYTES > 0,
+RotatingFileHandler) годится только для одного процесса: воркеры переименовывали бы файл друг у друга.
+"""
+import os
+import json
+import uuid
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_listener = None
+
+
+def setting(name, default, cast=str):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+
+def truncate(text, limit):
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… (+{len(text) - limit} симв.)"
+
+
+# --- ИДЕНТИФИКАТОР ЗАПРОСА ---
+
+def set_request_id(request_id=None):
+    """Задает ID текущего запроса (из X-Request-ID или новый); возвращает токен для reset_request_id"""
+    request_id = (request_id or '').strip()[:64] or uuid.uuid4().hex[:16]
+    return request_id_var.set(request_id)
+
+
+def reset_request_id(token):
+    request_id_var.reset(token)
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет ID запроса в запись в потоке запроса - до того как запись уйдет в очередь"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+# --- ФОРМАТЫ ---
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение, request_id и поля из extra"""
+
+    def __init__(self, max_message_chars):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': truncate(record.getMessage(), self.max_message_chars),
+        }
+        if getattr(record, 'request_id', None):
+            data['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат лога с ограничением длины сообщения"""
+
+    def __init__(self, max_message_chars):
+        super().__init__(TEXT_FORMAT)
+        self.max_message_chars = max_message_chars
+
+    def formatMessage(self, record):
+        record.message = truncate(record.message, self.max_message_chars)
+        if getattr(record, 'request_id', None):
+            record.message = f"[{record.request_id}] {record.message}"
+        return super().formatMessage(record)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь без форматирования: в потоке запроса только подставляются аргументы сообщения
+    и трассировка исключения превращается в текст (объекты исключений не должны жить в очереди)
+    """
+
+    def prepare(self, record):
+        # Запись создана под этот вызов и дальше корневого логгера не идет - копия не нужна
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Лог не должен тормозить ответ: при переполнении запись теряется
+            pass
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз на процесс (повторные вызовы ничего не делают)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = setting('LOG_LEVEL', 'INFO').upper()
+    max_message_chars = setting('LOG_MAX_MESSAGE_CHARS', 2000, int)
+    if setting('LOG_FORMAT', 'json').lower() == 'text':
+        formatter = TextFormatter(max_message_chars)
+    else:
+        formatter = JsonFormatter(max_message_chars)
+
+    handlers = [logging.StreamHandler()]
+    log_file = setting('LOG_FILE', '')
+    max_bytes = setting('LOG_MAX_BYTES', 0, int)
+    if log_file and max_bytes > 0:
+        handlers.append(RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=setting('LOG_BACKUP_COUNT', 5, int), encoding='utf-8'
+        ))
+    elif log_file:
+        handlers.append(WatchedFileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=setting('LOG_QUEUE_SIZE', 10000, int))
+    queue_handler = BackgroundQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при завершении процесса
+    atexit.register(_listener.stop)
+
+
+def log_payload(log, label, text, level=logging.INFO):
+    """
+    Крупные тексты (промпты, ответы модели): целиком, но не длиннее LOG_PAYLOAD_MAX_CHARS,
+    пишется только доля LOG_PAYLOAD_SAMPLE_RATE; для остальных - только длина
+    """
+    if not log.isEnabledFor(level):
+        return
+    text = str(text)
+    if random.random() < setting('LOG_PAYLOAD_SAMPLE_RATE', 0.05, float):
+        log.log(level, f"{label}: {truncate(text, setting('LOG_PAYLOAD_MAX_CHARS', 500, int))}",
+                extra={'payload_chars': len(text), 'sampled': True})
+    else:
+        log.log(level, f"{label}: {len(text)} симв.", extra={'payload_chars': len(text), 'sampled': False})
+
+
+def plain_log_line(line):
+    """JSON-запись лога -> строка в текстовом формате ('время - уровень - сообщение'); прочие строки без изменений"""
+    if not line.startswith('{'):
+        return line
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return line
+    when = str(data.get('ts', '')).replace('T', ' ').replace('.', ',')
+    return f"{when} - {data.get('level', '')} - {data.get('msg', '')}"
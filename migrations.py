@@ -0,0 +1,257 @@
+"""
+Версионные миграции базы грузов.
+
+Каждая миграция выполняется один раз: номер примененной версии записывается в schema_migrations.
+Два одновременных деплоя не применят миграцию дважды (advisory lock в PostgreSQL,
+BEGIN IMMEDIATE в SQLite). Новая миграция - новая запись в конце MIGRATIONS, старые не меняются.
+
+    python migrations.py migrate --db postgres://...
+    python migrations.py status --db ...
+    python migrations.py explain --db ...     # горячие запросы warehouse_bot идут по индексам
+"""
+import os
+import sys
+import logging
+
+from analytics import ShipmentAnalytics
+from shipments_db import (
+    ShipmentsDatabase, FIND_SHIPMENT, RECEIVE_SHIPMENT, SET_SHIPMENT_STATUS, COUNT_SHIPMENT_PHOTOS,
+    expected_page_query, expected_count_query
+)
+
+logger = logging.getLogger(__name__)
+
+# Произвольный ключ pg_advisory_lock для миграций
+MIGRATION_LOCK_KEY = 7420441
+
+SPLIT_WEIGHT_VOLUME = """
+-- 1. Разделяем вес
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS declared_weight REAL DEFAULT 0;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS actual_weight REAL DEFAULT 0;
+
+-- 2. Разделяем объем
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS declared_volume REAL DEFAULT 0;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS actual_volume REAL DEFAULT 0;
+
+-- 3. Финансы
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS agreed_rate REAL DEFAULT 0;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS additional_cost REAL DEFAULT 0;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS total_price_final REAL DEFAULT 0;
+
+-- 4. Документы и аналитика
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS contract_num TEXT;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS client_city TEXT;
+
+-- 5. Миграция старых данных (если есть)
+UPDATE shipments SET actual_weight = weight WHERE actual_weight = 0 AND weight > 0;
+UPDATE shipments SET actual_volume = volume WHERE actual_volume = 0 AND volume > 0;
+"""
+
+RECONCILIATION_COLUMNS = """
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS declared_tier TEXT;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS actual_tier TEXT;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS tier_changed BOOLEAN DEFAULT FALSE;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS actual_price REAL;
+ALTER TABLE shipments ADD COLUMN IF NOT EXISTS reconciled_at TIMESTAMP;
+"""
+
+HOT_QUERY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS shipments_contract_num ON shipments (contract_num)",
+    "CREATE INDEX IF NOT EXISTS shipments_status_created ON shipments (status, created_at DESC)",
+]
+
+# ON CONFLICT (track_number) в admin_bot уже требует уникальности; индекс создается, только если
+# уникального индекса на одной колонке track_number еще нет (под любым именем)
+TRACK_NUMBER_UNIQUE_POSTGRES = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'shipments'::regclass AND i.indisunique AND i.indnatts = 1 AND a.attname = 'track_number'
+    ) THEN
+        CREATE UNIQUE INDEX shipments_track_number ON shipments (track_number);
+    END IF;
+END
+$$
+"""
+
+# Постраничный список ожидаемых: ключ (created_at, id) внутри статуса, с фильтром по складу и без
+EXPECTED_PAGE_INDEXES = [
+    "DROP INDEX IF EXISTS shipments_status_created",
+    "CREATE INDEX IF NOT EXISTS shipments_status_created_id ON shipments (status, created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS shipments_status_warehouse_created_id ON shipments (status, warehouse_code, created_at DESC, id DESC)",
+]
+
+SHIPMENT_PHOTOS = """
+CREATE TABLE IF NOT EXISTS shipment_photos (
+    id {id_column},
+    track_number TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    content_type TEXT,
+    size_bytes BIGINT,
+    file_name TEXT,
+    warehouse_code TEXT,
+    uploaded_by TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (track_number, sha256)
+)
+"""
+
+
+def install_rollups(database):
+    analytics = ShipmentAnalytics(database.database)
+    # То же соединение, что у миграций: в PostgreSQL на нем держится advisory lock
+    analytics.local = database.local
+    analytics.install()
+
+
+# admin_bot не записывал склад договора: город отправки в Китае и есть склад приемки (warehouse_name)
+CONTRACT_WAREHOUSE = "UPDATE shipments SET warehouse_code = client_city WHERE status = 'Оформлен' AND warehouse_code IS NULL"
+
+
+# (версия, описание, {диалект: список команд} или функция(database)).
+# Для стенда SQLite колонки и UNIQUE на track_number уже есть в STANDIN_SCHEMA - там такие шаги только записываются.
+MIGRATIONS = [
+    (1, "раздельные заявленные и фактические вес и объем", {'postgres': [SPLIT_WEIGHT_VOLUME], 'sqlite': []}),
+    (2, "колонки сверки веса", {'postgres': [RECONCILIATION_COLUMNS], 'sqlite': []}),
+    (3, "итоги для /reports", install_rollups),
+    (4, "индексы горячих запросов склада", {
+        'postgres': HOT_QUERY_INDEXES + [TRACK_NUMBER_UNIQUE_POSTGRES],
+        'sqlite': HOT_QUERY_INDEXES,
+    }),
+    (5, "ключ (created_at, id) для списка ожидаемых", {'postgres': EXPECTED_PAGE_INDEXES, 'sqlite': EXPECTED_PAGE_INDEXES}),
+    (6, "фото и документы приемки", {
+        'postgres': [SHIPMENT_PHOTOS.format(id_column='SERIAL PRIMARY KEY')],
+        'sqlite': [SHIPMENT_PHOTOS.format(id_column='INTEGER PRIMARY KEY')],
+    }),
+    (7, "склад у оформленных договоров", {'postgres': [CONTRACT_WAREHOUSE], 'sqlite': [CONTRACT_WAREHOUSE]}),
+]
+
+
+class MigrationRunner:
+    def __init__(self, database, migrations=MIGRATIONS):
+        self.database = database
+        self.migrations = migrations
+
+    def applied(self):
+        self.database.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.database.commit()
+        return {row[0] for row in self.database.execute("SELECT version FROM schema_migrations").fetchall()}
+
+    def pending(self):
+        applied = self.applied()
+        return [migration for migration in self.migrations if migration[0] not in applied]
+
+    def migrate(self):
+        """Применяет недостающие миграции по порядку, каждую в своей транзакции; возвращает их версии"""
+        database = self.database
+        applied_now = []
+        if database.dialect == 'postgres':
+            database.execute("SELECT pg_advisory_lock(?)", (MIGRATION_LOCK_KEY,))
+        try:
+            for version, name, step in self.pending():
+                if database.dialect == 'sqlite':
+                    database.execute("BEGIN IMMEDIATE")
+                    # Пока ждали блокировку, миграцию мог применить другой процесс
+                    if database.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                        database.commit()
+                        continue
+                logger.info(f"⏳ Миграция {version}: {name}")
+                if callable(step):
+                    step(database)
+                else:
+                    for statement in step[database.dialect]:
+                        database.execute(statement)
+                database.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                database.commit()
+                applied_now.append(version)
+        finally:
+            if database.dialect == 'postgres':
+                database.execute("SELECT pg_advisory_unlock(?)", (MIGRATION_LOCK_KEY,))
+                database.commit()
+        logger.info(f"✅ Схема на версии {max([m[0] for m in self.migrations] or [0])}, применено сейчас: {applied_now or 'ничего'}")
+        return applied_now
+
+
+# --- ПРОВЕРКА ИНДЕКСОВ ---
+
+CURSOR = ('2025-10-01 12:00:00', 1000)
+
+HOT_QUERIES = {
+    'ожидаемые: первая страница': expected_page_query(11),
+    'ожидаемые: следующая, склад': expected_page_query(11, warehouse='Гуанчжоу', after=CURSOR),
+    'ожидаемые: предыдущая, даты': expected_page_query(11, date_from='2025-09-01', date_to='2025-10-02', before=CURSOR),
+    'ожидаемые: количество': expected_count_query(warehouse='Гуанчжоу'),
+    'поиск по номеру': (FIND_SHIPMENT, ('CN-010112', 'CN-010112', 'CN-010112')),
+    'приемка': (RECEIVE_SHIPMENT, (10.0, 'GZ123456')),
+    'смена статуса': (SET_SHIPMENT_STATUS, ('доставлен', 'GZ123456')),
+    'фото груза': (COUNT_SHIPMENT_PHOTOS, ('GZ123456',)),
+}
+
+
+def query_plan(database, sql, params):
+    sql = sql.replace('%s', '?')
+    if database.dialect == 'postgres':
+        # На маленькой таблице планировщик и так выберет полный проход; запрещаем его, чтобы проверить,
+        # что индекс вообще подходит запросу. EXPLAIN без ANALYZE ничего не меняет.
+        database.execute("SET LOCAL enable_seqscan = off")
+        plan = [row[0] for row in database.execute("EXPLAIN " + sql, tuple(params)).fetchall()]
+        database.connection().rollback()
+    else:
+        plan = [row[-1] for row in database.execute("EXPLAIN QUERY PLAN " + sql, tuple(params)).fetchall()]
+    return plan
+
+
+def full_scans(dialect, plan):
+    """Строки плана с полным проходом по shipments или сортировкой (индекс не покрывает ORDER BY)"""
+    if dialect == 'postgres':
+        return [line for line in plan if 'Seq Scan on shipments' in line or line.strip().startswith('Sort')]
+    return [
+        line for line in plan
+        if (line.startswith('SCAN') and 'shipments' in line and 'USING' not in line) or 'TEMP B-TREE' in line
+    ]
+
+
+def explain(database):
+    """EXPLAIN горячих запросов: True, если все идут по индексам"""
+    ok = True
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = query_plan(database, sql, params)
+        problems = full_scans(database.dialect, plan)
+        ok = ok and not problems
+        print(f"{'❌' if problems else '✅'} {name}")
+        for line in plan:
+            print(f"    {line}")
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Миграции базы грузов")
+    parser.add_argument('--db', default=os.getenv('DATABASE_URL') or 'data/shipments.db', help="postgres://... или путь к SQLite")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="применить недостающие миграции")
+    commands.add_parser('status', help="примененные и ожидающие миграции")
+    commands.add_parser('explain', help="проверить индексы горячих запросов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    database = ShipmentsDatabase(args.db)
+    runner = MigrationRunner(database)
+    if args.command == 'migrate':
+        runner.migrate()
+    elif args.command == 'status':
+        pending = {migration[0] for migration in runner.pending()}
+        for version, name, _ in MIGRATIONS:
+            print(f"{'⏳' if version in pending else '✅'} {version}: {name}")
+    else:
+        sys.exit(0 if explain(database) else 1)
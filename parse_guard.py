@@ -0,0 +1,211 @@
+"""
+Защита разбора сообщений от враждебного ввода.
+
+Все извлечения (вес, объем, габариты, контакты, признаки доставки) идут через guarded():
+сообщение длиннее MAX_MESSAGE_CHARS обрезается, а длиннее FULL_PARSE_CHARS разбирается
+не регулярными выражениями, а дешевым линейным сканированием токенов (dimensions.tokenize).
+
+    python parse_guard.py fuzz     # поиск входов, на которых время извлечения растет быстрее длины
+"""
+import time
+import random
+import logging
+import functools
+
+from dimensions import tokenize, parse_packages, NUMBER, UNIT, BREAK
+
+logger = logging.getLogger(__name__)
+
+# Длиннее - обрезается на входе: ни один обработчик не видит больше
+MAX_MESSAGE_CHARS = 4000
+
+# Длиннее - извлечение только дешевым сканированием токенов
+FULL_PARSE_CHARS = 1000
+
+WEIGHT_WORDS = ('кг', 'kg', 'кило')
+VOLUME_WORDS = ('м3', 'м³', 'm3', 'm³', 'cubic', 'cub')
+
+
+def clip(text):
+    """Сообщение не длиннее MAX_MESSAGE_CHARS"""
+    if text and len(text) > MAX_MESSAGE_CHARS:
+        logger.warning(f"⚠️ Сообщение обрезано: {len(text)} > {MAX_MESSAGE_CHARS} симв.")
+        return text[:MAX_MESSAGE_CHARS]
+    return text
+
+
+def guarded(cheap=None):
+    """
+    Декоратор извлечения: текст обрезается до MAX_MESSAGE_CHARS, длинный текст разбирает cheap(text, ...)
+    с той же сигнатурой (без cheap - только обрезка). Исходная функция доступна как __wrapped__ (для fuzz).
+    """
+    def decorate(extract):
+        @functools.wraps(extract)
+        def wrapper(text, *args, **kwargs):
+            text = clip(text)
+            if cheap and text and len(text) > FULL_PARSE_CHARS:
+                return cheap(text, *args, **kwargs)
+            return extract(text, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- ДЕШЕВОЕ СКАНИРОВАНИЕ ---
+
+def is_weight_word(value):
+    return value in WEIGHT_WORDS or value.startswith('килограмм')
+
+
+def is_volume_word(value):
+    return value in VOLUME_WORDS or value.startswith('куб')
+
+
+def number_before(tokens, accept):
+    """Первое число, за которым идет слово, подходящее под accept"""
+    for (kind, value), (next_kind, next_value) in zip(tokens, tokens[1:]):
+        if kind == NUMBER and next_kind == BREAK and accept(next_value):
+            return value
+    return None
+
+
+def number_after(tokens, prefix):
+    """Первое число сразу после слова, начинающегося с prefix ("вес 50", "объем 2")"""
+    for (kind, value), (next_kind, next_value) in zip(tokens, tokens[1:]):
+        if kind == BREAK and value.startswith(prefix) and next_kind == NUMBER:
+            return next_value
+    return None
+
+
+def scan_weight(text):
+    tokens = tokenize(text)
+    return number_before(tokens, is_weight_word) or number_after(tokens, 'вес')
+
+
+def scan_volume(text):
+    tokens = tokenize(text)
+    return number_before(tokens, is_volume_word) or number_after(tokens, 'объем')
+
+
+def scan_has_parameters(text):
+    """Число с весом или единицей длины либо габариты"""
+    tokens = tokenize(text)
+    for (kind, value), (next_kind, next_value) in zip(tokens, tokens[1:]):
+        if kind == NUMBER and (next_kind == UNIT or (next_kind == BREAK and is_weight_word(next_value))):
+            return True
+    return bool(parse_packages(text))
+
+
+# --- FUZZ ---
+
+def hostile_inputs(size, rng):
+    """Семейства входов, на которых шаблоны с перекрывающимися повторениями уходят в возвраты"""
+    alphabet = "0123456789 .,:-xх*×абвгкмснш\n"
+    return {
+        'цифры': "1" * size,
+        'буквы': "а" * size,
+        'буквы и знак': "а" * size + "!",
+        'зовут и пробелы': "зовут" + " " * size + "!",
+        'цифры и знак': "1" * size + "!",
+        'буквы и пробелы': "аа " * (size // 3),
+        'пробелы': "1" + " " * size + "x",
+        'числа через пробел': "1 " * (size // 2),
+        'числа через точку': "1." * (size // 2),
+        'вес и пробелы': "вес" + " " * size + "!",
+        'буква-цифра': "а1" * (size // 2),
+        'разделители': "1 x " * (size // 4),
+        'случайный': "".join(rng.choice(alphabet) for _ in range(size)),
+    }
+
+
+def fuzz_targets():
+    """Извлечения, которые видят текст клиента целиком"""
+    import cargo
+    import extraction
+    import chat_service
+
+    def unguarded(function):
+        return getattr(function, '__wrapped__', function)
+
+    def cargo_items(text):
+        return cargo.parse_items_from_text(
+            text, lambda segment: None, unguarded(extraction.extract_dimensions), unguarded(extraction.extract_volume)
+        )
+
+    return {
+        'extract_dimensions': unguarded(extraction.extract_dimensions),
+        'extract_volume': unguarded(extraction.extract_volume),
+        'extract_contact_info': unguarded(extraction.extract_contact_info),
+        'extract_delivery_info': lambda text: unguarded(extraction.extract_delivery_info)(
+            text, chat_service.tariff_tables.city_names(), chat_service.PRODUCT_CATEGORIES
+        ),
+        'has_delivery_parameters': unguarded(chat_service.has_delivery_parameters),
+        'parse_items_from_text': cargo_items,
+        'classify': chat_service.message_classifier.classify,
+    }
+
+
+def timed(function, text):
+    started = time.perf_counter()
+    function(text)
+    return time.perf_counter() - started
+
+
+def fuzz(size, growth):
+    """
+    Для каждого извлечения и семейства входов: время на длине size и size * growth.
+    При линейном времени отношение близко к growth; отношение больше growth^1.5 - шаблон сверхлинейный.
+    """
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(42)
+    short_inputs = hostile_inputs(size, rng)
+    long_inputs = hostile_inputs(size * growth, rng)
+    limit = growth ** 1.5
+    superlinear = []
+
+    for name, function in fuzz_targets().items():
+        for family, text in short_inputs.items():
+            short_time = min(timed(function, text) for _ in range(3))
+            long_time = min(timed(function, long_inputs[family]) for _ in range(3))
+            ratio = long_time / max(short_time, 1e-7)
+            if ratio > limit and long_time > 1e-3:
+                superlinear.append((name, family, ratio, long_time))
+
+    for name, family, ratio, long_time in superlinear:
+        print(f"❌ {name} / {family}: x{growth} длины -> x{ratio:.0f} времени ({long_time * 1000:.0f} мс)")
+    print(f"🔍 Сверхлинейных сочетаний: {len(superlinear)}")
+
+    # Худшее время на одно сообщение с защитой: враждебный вход максимальной длины
+    worst = 0.0
+    guarded_targets = guarded_functions()
+    for text in hostile_inputs(MAX_MESSAGE_CHARS * 4, rng).values():
+        for function in guarded_targets.values():
+            worst = max(worst, timed(function, text))
+    print(f"⏱ Худшее время извлечения на одно сообщение с защитой: {worst * 1000:.1f} мс")
+    return not superlinear
+
+
+def guarded_functions():
+    import extraction
+    import chat_service
+    return {
+        'extract_dimensions': extraction.extract_dimensions,
+        'extract_volume': extraction.extract_volume,
+        'extract_contact_info': extraction.extract_contact_info,
+        'extract_delivery_info': chat_service.extract_delivery_info,
+        'has_delivery_parameters': chat_service.has_delivery_parameters,
+        'parse_cargo_items': chat_service.parse_cargo_items,
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Поиск входов со сверхлинейным временем разбора")
+    commands = parser.add_subparsers(dest='command', required=True)
+    fuzz_parser = commands.add_parser('fuzz')
+    fuzz_parser.add_argument('--size', type=int, default=2000)
+    fuzz_parser.add_argument('--growth', type=int, default=4)
+    args = parser.parse_args()
+
+    sys.exit(0 if fuzz(args.size, args.growth) else 1)
@@ -0,0 +1,206 @@
+"""
+Фото и документы приемки: хранилище файлов по хэшу содержимого.
+
+Файл лежит один раз под своим SHA-256 (PHOTO_STORE_DIR/blobs/ab/cd/<хэш>): одно и то же фото,
+присланное дважды или к двум грузам, на диске не дублируется, в базе хранится только ссылка (хэш).
+Файл скачивается из Telegram потоком кусками прямо во временный файл с подсчетом хэша,
+целиком в памяти не держится. Миниатюры (thumbs/ab/<хэш>.jpg) делает пул процессов,
+чтобы сжатие картинок не занимало цикл событий бота.
+
+    python photo_store.py bench --uploads 200 --size-mb 4 --concurrency 50
+"""
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PHOTO_STORE_DIR = os.getenv('PHOTO_STORE_DIR', 'data/photos')
+THUMBNAIL_WORKERS = int(os.getenv('PHOTO_THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_SIZE = 320
+CHUNK_BYTES = 64 * 1024
+# Больше Bot API боту не отдает (getFile)
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+
+
+def make_thumbnail(source, target, size=THUMBNAIL_SIZE):
+    """Миниатюра JPEG со стороной не больше size; выполняется в процессе пула"""
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert('RGB').save(temporary, 'JPEG', quality=80)
+    os.replace(temporary, target)
+    return target
+
+
+class BlobStore:
+    """Файлы по SHA-256 содержимого и миниатюры к ним"""
+
+    def __init__(self, root=PHOTO_STORE_DIR, thumbnail_workers=THUMBNAIL_WORKERS):
+        self.root = root
+        self.thumbnail_workers = thumbnail_workers
+        self.pool = None
+        self.client = None
+        self.thumbnails_disabled = False
+
+    def path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest[2:4], digest)
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self.root, 'thumbs', digest[:2], f"{digest}.jpg")
+
+    async def save_stream(self, chunks, limit=None):
+        """
+        Пишет куски (async-итератор bytes) во временный файл, считая хэш; возвращает (хэш, размер, новый ли файл).
+        Если файл с таким хэшем уже есть, временный удаляется.
+        """
+        # Каталоги создаются при первой записи, а не при импорте бота
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        temporary = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        digest, size = hashlib.sha256(), 0
+        try:
+            with open(temporary, 'wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if limit and size > limit:
+                        raise ValueError(f"Файл больше {limit // (1024 * 1024)} МБ")
+                    digest.update(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            target = self.path(digest)
+            if os.path.exists(target):
+                os.remove(temporary)
+                return digest, size, False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temporary, target)
+            return digest, size, True
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    async def download(self, url):
+        """Скачивает файл Telegram (File.file_path) потоком в хранилище"""
+        import httpx
+
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=httpx.Timeout(60, connect=10))
+        async with self.client.stream('GET', url) as response:
+            response.raise_for_status()
+            return await self.save_stream(response.aiter_bytes(CHUNK_BYTES), MAX_DOWNLOAD_BYTES)
+
+    async def thumbnail(self, digest):
+        """Миниатюра в пуле процессов; путь к ней или None, если картинку не удалось сжать"""
+        target = self.thumbnail_path(digest)
+        if os.path.exists(target):
+            return target
+        if self.thumbnails_disabled:
+            return None
+        if self.pool is None:
+            # spawn, а не fork: в процессе бота уже работают потоки (пул БД, очередь заданий)
+            self.pool = ProcessPoolExecutor(self.thumbnail_workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, make_thumbnail, self.path(digest), target)
+        except ImportError:
+            self.thumbnails_disabled = True
+            logger.warning("⚠️ Pillow не установлен - миниатюры не создаются (pip install Pillow)")
+        except Exception as e:
+            logger.warning(f"⚠️ Миниатюра {digest[:12]} не создана: {e}")
+        return None
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- ЗАМЕР ---
+async def upload(seed, size, chunk_bytes=CHUNK_BYTES):
+    """Загрузка из сети: size байт кусками, между кусками цикл событий свободен"""
+    block = hashlib.sha256(str(seed).encode()).digest() * (chunk_bytes // 32)
+    for offset in range(0, size, chunk_bytes):
+        await asyncio.sleep(0)
+        yield block[:min(chunk_bytes, size - offset)]
+
+
+async def bench(uploads, size_mb, concurrency, duplicates, root):
+    import shutil
+    import tracemalloc
+
+    shutil.rmtree(root, ignore_errors=True)
+    store = BlobStore(root)
+    size = int(size_mb * 1024 * 1024)
+    slots = asyncio.Semaphore(concurrency)
+    # Каждое duplicates-е фото - повтор уже присланного
+    seeds = [i - 1 if duplicates and i % duplicates == 0 else i for i in range(uploads)]
+
+    async def one(seed):
+        async with slots:
+            return await store.save_stream(upload(seed, size))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(seed) for seed in seeds))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stored = sum(1 for _, _, new in results if new)
+    total_mb = uploads * size / 1024 / 1024
+    print(f"📥 {uploads} загрузок по {size_mb} МБ, {concurrency} одновременно: {elapsed:.2f} с, "
+          f"{uploads / elapsed:.0f} файлов/с, {total_mb / elapsed:.0f} МБ/с")
+    print(f"🗂 Записано файлов: {stored}, повторов отброшено: {uploads - stored}; пик памяти {peak / 1024 / 1024:.1f} МБ")
+
+    try:
+        from PIL import Image
+    except ImportError:
+        print("⚠️ Pillow не установлен - замер миниатюр пропущен")
+        await store.close()
+        return
+    digests = []
+    for i in range(40):
+        path = os.path.join(root, 'tmp', f"photo{i}.jpg")
+        Image.effect_noise((2000, 1500), 40 + i).convert('RGB').save(path, 'JPEG')
+
+        async def chunks(path=path):
+            with open(path, 'rb') as f:
+                while chunk := f.read(CHUNK_BYTES):
+                    yield chunk
+
+        digests.append((await store.save_stream(chunks()))[0])
+        os.remove(path)
+    await store.thumbnail(digests[0])  # запуск процессов пула не считаем
+    started = time.perf_counter()
+    made = await asyncio.gather(*(store.thumbnail(digest) for digest in digests[1:]))
+    elapsed = time.perf_counter() - started
+    print(f"🖼 Миниатюры 2000x1500 -> {THUMBNAIL_SIZE}: {len(made) / elapsed:.0f}/с на {store.thumbnail_workers} процессах")
+    await store.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Хранилище фото приемки")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help="одновременные загрузки и миниатюры")
+    bench_parser.add_argument('--uploads', type=int, default=200)
+    bench_parser.add_argument('--size-mb', type=float, default=4)
+    bench_parser.add_argument('--concurrency', type=int, default=50)
+    bench_parser.add_argument('--duplicates', type=int, default=5, help="каждая N-я загрузка - повтор")
+    bench_parser.add_argument('--root', default='data/photos_bench')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    asyncio.run(bench(args.uploads, args.size_mb, args.concurrency, args.duplicates, args.root))
+    import shutil
+    shutil.rmtree(args.root, ignore_errors=True)
@@ -0,0 +1,284 @@
+"""
+Генератор прайс-листа и пересчет истории отправок.
+
+    python price_list.py grid -o rate_card.csv
+    python price_list.py grid -o rate_card.xlsx          # нужен openpyxl
+    python price_list.py reprice shipments.csv -o repriced.csv --chunk-size 5000
+
+Все суммы считаются теми же функциями и в том же порядке операций, что и в /chat (TariffCalculator
+по таблицам из config.json), поэтому цены совпадают с ответом бота до тенге. Курс фиксируется на весь прогон:
+текущий, заданный (--rate) или исторический (--rate-at, либо по дате отправки в колонке created_at).
+chat_service не импортируется: прайс не пишет лог приложения и не поднимает очередь заданий и модель.
+"""
+import sys
+import csv
+import math
+import argparse
+import logging
+from itertools import islice
+from contextlib import nullcontext
+
+from exchange_rates import RateSnapshot, create_rate_provider
+from extraction import find_product_category
+from tariffs import COMMISSION, DEFAULT_CATEGORY, TariffCalculator, load_config, reference_quote
+
+logger = logging.getLogger(__name__)
+
+config = load_config()
+PRODUCT_CATEGORIES = config.get("PRODUCT_CATEGORIES", {})
+tariff_calculator = TariffCalculator.from_config(config)
+tariff_tables = tariff_calculator.tables
+rate_provider = create_rate_provider(config)
+
+# Дополнительные весовые точки после прогрессивной сетки Т2 (до 20 кг)
+EXTRA_WEIGHTS = [30, 50, 100, 200, 300, 500, 1000]
+
+GRID_COLUMNS = [
+    'category', 'density_from', 'unit', 'price_usd', 'weight_kg', 'volume_m3',
+    'zone', 'city', 't1_usd', 't1_kzt', 't2_kzt', 'total_kzt'
+]
+
+REPRICE_COLUMNS = ['category', 'zone', 'density', 'exchange_rate', 't1_kzt', 't2_kzt', 'total_kzt', 'error']
+
+INPUT_ALIASES = {
+    'weight': ('weight', 'вес', 'declared_weight', 'actual_weight'),
+    'volume': ('volume', 'объем', 'объём', 'declared_volume', 'actual_volume'),
+    'product': ('product', 'товар', 'product_type'),
+    'city': ('city', 'город', 'client_city'),
+    'created_at': ('created_at', 'date', 'дата'),
+}
+
+
+def default_weights():
+    """Весовые точки прайса: все диапазоны прогрессивного Т2 + крупные веса"""
+    return tariff_tables.t2_weight_limits() + EXTRA_WEIGHTS
+
+
+def zone_cities():
+    """Первый город каждой зоны - по нему /chat посчитает ту же зону"""
+    cities = {}
+    for city, zone in tariff_tables.city_zones():
+        cities.setdefault(zone, city)
+    return cities
+
+
+def tier_volume(weight, min_density, next_density):
+    """
+    Объем, при котором плотность weight / volume попадает ровно в нужный диапазон.
+    Для нижнего диапазона (от 0) берется середина до следующего порога.
+    """
+    density = min_density if min_density > 0 else (next_density or 100) / 2
+    volume = weight / density
+    # Деление может дать плотность чуть ниже порога - сдвигаем объем вниз
+    while weight / volume < density:
+        volume = math.nextafter(volume, 0)
+    return volume
+
+
+def quote_product(weight, product, city, volume, rate):
+    """То же, что calculate_quick_cost в /chat: категория по названию товара, затем расчет Т1 + Т2"""
+    category = find_product_category(product, PRODUCT_CATEGORIES) or DEFAULT_CATEGORY
+    return tariff_calculator.quote(weight, category, city, volume, rate)
+
+
+def t1_cost(rule, weight, volume, rate):
+    """Т1 в том же порядке операций, что calculate_quick_cost"""
+    cost_usd = tariff_calculator.t1_cost_usd(rule, weight, volume)
+    return cost_usd, cost_usd * rate.rate
+
+
+def generate_grid(weights, rate):
+    """
+    Полная сетка категория × диапазон плотности × вес × зона.
+    Т2 считается один раз на пару (вес, зона), Т1 - один раз на (диапазон, вес); строки собираются из таблиц.
+    """
+    cities = zone_cities()
+    t2_table = {(weight, zone): tariff_calculator.t2_cost(weight, zone) for weight in weights for zone in cities}
+
+    for category in tariff_tables.category_names():
+        ordered = tariff_tables.rules(category)
+        for position, tier in enumerate(ordered):
+            next_density = ordered[position + 1]['min_density'] if position + 1 < len(ordered) else None
+            for weight in weights:
+                volume = tier_volume(weight, tier['min_density'], next_density)
+                rule = tariff_calculator.find_rule(category, weight / volume)
+                if not rule:
+                    continue
+                t1_usd, t1_kzt = t1_cost(rule, weight, volume, rate)
+                for zone, city in cities.items():
+                    t2_kzt = t2_table[(weight, zone)]
+                    total = (t1_kzt + t2_kzt) * COMMISSION
+                    yield {
+                        'category': category,
+                        'density_from': rule['min_density'],
+                        'unit': rule['unit'],
+                        'price_usd': rule['price'],
+                        'weight_kg': weight,
+                        'volume_m3': repr(volume),
+                        'zone': zone,
+                        'city': city,
+                        't1_usd': f"{t1_usd:.2f}",
+                        't1_kzt': f"{t1_kzt:.0f}",
+                        't2_kzt': f"{t2_kzt:.0f}",
+                        'total_kzt': f"{total:.0f}",
+                    }
+
+
+def verify_grid(rows, rate):
+    """Сверяет строки сетки с прежним расчетом calculate_quick_cost (tariffs.reference_quote)"""
+    keywords = {category: data["keywords"][0] for category, data in PRODUCT_CATEGORIES.items() if data.get("keywords")}
+    checked = mismatched = 0
+    for row in rows:
+        product = keywords.get(row['category'])
+        if not product or find_product_category(product, PRODUCT_CATEGORIES) != row['category']:
+            continue
+        quote = reference_quote(config, row['weight_kg'], row['category'], row['city'], float(row['volume_m3']), rate)
+        checked += 1
+        if not quote or f"{quote['total']:.0f}" != row['total_kzt']:
+            mismatched += 1
+            logger.error(f"Расхождение: {row} != {quote and quote['total']}")
+    print(f"🔍 Проверено строк: {checked}, расхождений: {mismatched}")
+    return mismatched == 0
+
+
+def write_rows(rows, output, columns):
+    """Потоковая запись строк в CSV (или XLSX в режиме write_only, если установлен openpyxl)"""
+    count = 0
+    if output.endswith('.xlsx'):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            print("❌ Для XLSX установите openpyxl: pip install openpyxl")
+            sys.exit(1)
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(columns)
+        for row in rows:
+            sheet.append([row.get(column) for column in columns])
+            count += 1
+        workbook.save(output)
+        return count
+
+    # sys.stdout не закрываем: в него может писать и вызывающий код после прайса
+    with (open(output, 'w', encoding='utf-8', newline='') if output != '-' else nullcontext(sys.stdout)) as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def reprice_row(row, columns, rate, use_row_dates):
+    """Пересчет одной исторической отправки функцией /chat по зафиксированному курсу"""
+    def value(name):
+        return (row.get(columns[name]) or '').strip() if name in columns else ''
+
+    result = dict(row)
+    try:
+        weight = float(value('weight').replace(',', '.'))
+        volume = float(value('volume').replace(',', '.'))
+    except ValueError:
+        weight = volume = math.nan
+    # float() принимает и "nan", "inf", "-5" - такие строки не пересчитываем
+    if not (math.isfinite(weight) and math.isfinite(volume) and weight > 0 and volume > 0):
+        result['error'] = "нет веса или объема"
+        return result
+
+    product, city = value('product'), value('city')
+    if use_row_dates and value('created_at'):
+        try:
+            rate = rate_provider.rate_at(value('created_at'))
+        except ValueError:
+            result['error'] = "неверная дата отправки"
+            return result
+    zone = tariff_tables.find_zone(city) if city else None
+    quote = quote_product(weight, product, city, volume, rate) if zone else None
+    if not quote:
+        result['error'] = "город не найден" if not zone else "тариф не подобран"
+        return result
+
+    result.update({
+        'category': find_product_category(product, PRODUCT_CATEGORIES) or DEFAULT_CATEGORY,
+        'zone': quote['zone'],
+        'density': f"{quote['density']:.1f}",
+        'exchange_rate': quote['exchange_rate'],
+        't1_kzt': f"{quote['t1_cost']:.0f}",
+        't2_kzt': f"{quote['t2_cost']:.0f}",
+        'total_kzt': f"{quote['total']:.0f}",
+        'error': '',
+    })
+    return result
+
+
+def reprice(input_path, output, chunk_size, rate, use_row_dates):
+    """Пересчитывает CSV с историей отправок порциями по chunk_size строк - память не растет с размером файла"""
+    with open(input_path, 'r', encoding='utf-8-sig', newline='') as source, \
+            open(output, 'w', encoding='utf-8', newline='') as target:
+        reader = csv.DictReader(source)
+        columns = {}
+        for field in reader.fieldnames or []:
+            for name, aliases in INPUT_ALIASES.items():
+                if field.strip().lower() in aliases and name not in columns:
+                    columns[name] = field
+
+        writer = csv.DictWriter(target, fieldnames=list(reader.fieldnames or []) + REPRICE_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+
+        total = 0
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+            writer.writerows(reprice_row(row, columns, rate, use_row_dates) for row in chunk)
+            target.flush()
+            total += len(chunk)
+            print(f"⏳ Пересчитано строк: {total}", file=sys.stderr)
+
+    print(f"✅ Готово: {total} строк -> {output}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прайс-лист Post Pro по текущему курсу из config.json")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    grid_parser = commands.add_parser('grid', help="полная сетка категория × плотность × вес × зона")
+    grid_parser.add_argument('-o', '--output', default='-', help="CSV/XLSX файл, по умолчанию stdout")
+    grid_parser.add_argument('--weights', help="весовые точки через запятую, по умолчанию сетка Т2 + крупные веса")
+    grid_parser.add_argument('--verify', action='store_true', help="сверить каждую строку с прежним расчетом (reference_quote)")
+
+    reprice_parser = commands.add_parser('reprice', help="пересчитать историю отправок из CSV")
+    reprice_parser.add_argument('input')
+    reprice_parser.add_argument('-o', '--output', required=True)
+    reprice_parser.add_argument('--chunk-size', type=int, default=5000)
+    reprice_parser.add_argument('--by-date', action='store_true', help="курс на дату отправки из колонки created_at")
+
+    for command_parser in (grid_parser, reprice_parser):
+        command_parser.add_argument('--rate', type=float, help="фиксированный курс тенге/$")
+        command_parser.add_argument('--rate-at', help="исторический курс на дату (ISO, например 2025-10-01)")
+
+    args = parser.parse_args()
+
+    if args.rate:
+        rate = RateSnapshot(rate=args.rate, timestamp=None, source="manual")
+    elif args.rate_at:
+        try:
+            rate = rate_provider.rate_at(args.rate_at)
+        except ValueError:
+            parser.error(f"--rate-at: ожидается дата ISO, например 2025-10-01, а не {args.rate_at!r}")
+    else:
+        rate = rate_provider.refresh()
+    print(f"💱 Курс: {rate.rate} тенге/$ ({rate.source}, {rate.timestamp})", file=sys.stderr)
+
+    if args.command == 'grid':
+        weights = [float(weight) for weight in args.weights.split(',')] if args.weights else default_weights()
+        if args.verify:
+            sys.exit(0 if verify_grid(generate_grid(weights, rate), rate) else 1)
+        count = write_rows(generate_grid(weights, rate), args.output, GRID_COLUMNS)
+        print(f"✅ Строк в прайсе: {count}", file=sys.stderr)
+    else:
+        reprice(args.input, args.output, args.chunk_size, rate, args.by_date)
+
+
+if __name__ == '__main__':
+    main()
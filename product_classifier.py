@@ -0,0 +1,91 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-zа-яё0-9]+')
+
+# Окончания русских существительных и прилагательных, от длинных к коротким
+ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ьями', 'ьев', 'ьям', 'ьях', 'ья', 'ье',
+    'ого', 'его', 'ому', 'ему', 'ими', 'ыми', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ой', 'ей', 'ий', 'ый',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ью', 'ия', 'ию', 'ии', 'ов', 'ев',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й'
+], key=len, reverse=True)
+
+# Короче основа не бывает: "чай" не превращается в "ча"
+MIN_STEM_LENGTH = 3
+
+
+def stem(word):
+    """Упрощенный стеммер: отрезает одно самое длинное окончание, если остается основа не короче 3 букв"""
+    word = word.lower().replace('ё', 'е')
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def stems(text):
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class ProductClassifier:
+    """
+    Классификатор товара по основам слов.
+    При создании ключевые слова PRODUCT_CATEGORIES приводятся к основам и собираются в словарь
+    основа -> [(основы фразы, категория)], поэтому формы слова ("косметика", "косметики"...) в конфиге не нужны.
+    Поиск - O(число слов в тексте); совпадение только по целым словам ("стол" не найдется в "столица").
+    Если подходят несколько категорий, побеждает набравшая больше баллов, при равенстве - первая в конфиге.
+    """
+
+    def __init__(self, product_categories):
+        self.order = {category: i for i, category in enumerate(product_categories)}
+        self.weights = {category: data.get("weight", 1.0) for category, data in product_categories.items()}
+
+        phrase_categories = {}
+        for category, data in product_categories.items():
+            for keyword in data.get("keywords", []):
+                phrase = tuple(stems(keyword))
+                if phrase:
+                    phrase_categories.setdefault(phrase, set()).add(category)
+
+        # Фраза, общая для нескольких категорий, дает каждой меньше баллов
+        self.index = {}
+        for phrase, categories in phrase_categories.items():
+            score = len(phrase) / len(categories)
+            self.index.setdefault(phrase[0], []).append((phrase, tuple(categories), score))
+
+    def scores(self, text):
+        """Баллы категорий для текста"""
+        tokens = stems(text)
+        scores = {}
+        for i, token in enumerate(tokens):
+            for phrase, categories, score in self.index.get(token, ()):
+                if tuple(tokens[i:i + len(phrase)]) != phrase:
+                    continue
+                for category in categories:
+                    scores[category] = scores.get(category, 0) + score * self.weights[category]
+        return scores
+
+    def classify(self, text):
+        """Категория товара или None"""
+        if not text:
+            return None
+        scores = self.scores(text)
+        if not scores:
+            return None
+        return max(scores, key=lambda category: (scores[category], -self.order[category]))
+
+
+_classifiers = {}
+
+
+def get_classifier(product_categories):
+    """Классификатор строится один раз на словарь категорий"""
+    key = id(product_categories)
+    cached = _classifiers.get(key)
+    if cached is None or cached[0] is not product_categories:
+        cached = (product_categories, ProductClassifier(product_categories))
+        _classifiers[key] = cached
+    return cached[1]
@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по умолчанию: емкость корзины и пополнение в минуту
+DEFAULT_RATE_LIMITS = {
+    "deterministic": {
+        "session": {"capacity": 30, "per_minute": 60},
+        "ip": {"capacity": 120, "per_minute": 240}
+    },
+    "llm": {
+        "session": {"capacity": 5, "per_minute": 10},
+        "ip": {"capacity": 20, "per_minute": 40}
+    }
+}
+
+# Сколько корзин держать в памяти, прежде чем чистить полные (давно неактивные)
+MAX_LOCAL_BUCKETS = 100_000
+
+# Сколько прокси перед приложением дописывают адрес в X-Forwarded-For (на Render - один).
+# Левые адреса заголовка присылает сам клиент, верить можно только добавленным своими прокси.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+
+# После ошибки Redis столько секунд лимиты считаются в локальных корзинах, не пытаясь подключиться
+REDIS_RETRY_SECONDS = int(os.getenv('REDIS_RETRY_SECONDS', '30'))
+
+# Атомарная проверка нескольких token bucket в Redis одной командой: токены списываются, только если
+# все корзины разрешают запрос. Ключ живет до полного пополнения.
+# Возвращает {0, 0} или {номер первой пустой корзины (с 1), через сколько секунд появится токен}.
+REDIS_TOKEN_BUCKETS = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + (now - ts) * rate)
+    if available < 1 then
+        return {i, tostring((1 - available) / rate)}
+    end
+    tokens[i] = available
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return {0, 0}
+"""
+
+
+class RateLimitExceeded(Exception):
+    """Бюджет запросов исчерпан; retry_after - через сколько секунд появится токен"""
+
+    def __init__(self, budget, scope, retry_after):
+        super().__init__(f"Превышен лимит {budget}/{scope}")
+        self.budget = budget
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class LocalBuckets:
+    """Token bucket в памяти процесса"""
+
+    def __init__(self, max_buckets=MAX_LOCAL_BUCKETS):
+        # key -> (токены, время обновления, когда корзина снова станет полной)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.max_buckets = max_buckets
+        self.prune_at = max_buckets
+
+    def take_all(self, buckets, now):
+        """
+        buckets - [(key, емкость, пополнение в секунду)]. Токен списывается из всех корзин, только если
+        все они разрешают запрос. Возвращает (None, 0) или (номер первой пустой корзины, retry_after).
+        """
+        with self.lock:
+            available = []
+            for position, (key, capacity, rate) in enumerate(buckets):
+                tokens, ts, _ = self.buckets.get(key, (capacity, now, now))
+                tokens = min(capacity, tokens + (now - ts) * rate)
+                if tokens < 1:
+                    return position, (1 - tokens) / rate
+                available.append(tokens)
+            for (key, capacity, rate), tokens in zip(buckets, available):
+                tokens -= 1
+                self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self.buckets) > self.prune_at:
+                self._prune(now)
+            return None, 0.0
+
+    def _prune(self, now):
+        """
+        Удаляет корзины, которые уже успели пополниться до конца: они ничем не отличаются от новых.
+        Следующая чистка - когда корзин станет вдвое больше оставшихся, так что полный проход
+        по словарю приходится в среднем на O(1) на запрос даже при потоке новых ключей.
+        """
+        stale = [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]
+        for key in stale:
+            del self.buckets[key]
+        self.prune_at = max(self.max_buckets, 2 * len(self.buckets))
+
+
+class RedisBuckets:
+    """Token bucket в Redis - общий для всех воркеров gunicorn"""
+
+    def __init__(self, redis_url):
+        import redis
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.script = self.client.register_script(REDIS_TOKEN_BUCKETS)
+
+    def take_all(self, buckets, now):
+        """То же, что LocalBuckets.take_all, одним вызовом скрипта"""
+        args = [now]
+        for _, capacity, rate in buckets:
+            args += [capacity, rate]
+        denied, retry_after = self.script(keys=[f"ratelimit:{key}" for key, _, _ in buckets], args=args)
+        denied = int(denied)
+        return (denied - 1 if denied else None), float(retry_after)
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов по сессии и по IP.
+    Два независимых бюджета: deterministic - любой запрос к /chat, llm - только запросы, которые дошли до Gemini.
+    Если задан REDIS_URL, состояние общее для всех воркеров; при недоступности Redis - локальные корзины
+    на REDIS_RETRY_SECONDS, чтобы не ждать таймаут подключения на каждом запросе.
+    """
+
+    def __init__(self, limits=None, redis_url=None):
+        self.limits = limits or DEFAULT_RATE_LIMITS
+        self.enabled = True
+        self.local = LocalBuckets()
+        self.redis = None
+        self.redis_retry_at = 0.0
+        if redis_url:
+            try:
+                self.redis = RedisBuckets(redis_url)
+                logger.info(">>> Лимиты запросов хранятся в Redis")
+            except Exception as e:
+                logger.error(f"!!! Redis недоступен, лимиты в памяти процесса: {e}")
+
+    def _take_all(self, buckets, now):
+        if self.redis and time.monotonic() >= self.redis_retry_at:
+            try:
+                return self.redis.take_all(buckets, now)
+            except Exception as e:
+                self.redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+                logger.warning(f"Redis недоступен для лимитов, {REDIS_RETRY_SECONDS} с на локальных корзинах: {e}")
+        return self.local.take_all(buckets, now)
+
+    def check(self, budget, identities):
+        """
+        Списывает по токену из корзин каждого идентификатора ({'session': ..., 'ip': ...}) - из всех сразу
+        или ни из одной. Бросает RateLimitExceeded, если хотя бы одна корзина пуста.
+        """
+        if not self.enabled:
+            return
+        scopes, buckets = [], []
+        for scope, identity in identities.items():
+            limit = self.limits.get(budget, {}).get(scope)
+            if not limit or not identity:
+                continue
+            scopes.append((scope, identity))
+            buckets.append((f"{budget}:{scope}:{identity}", limit["capacity"], limit["per_minute"] / 60))
+        if not buckets:
+            return
+
+        denied, retry_after = self._take_all(buckets, time.time())
+        if denied is not None:
+            scope, identity = scopes[denied]
+            logger.warning(f"=== ЛИМИТ {budget}/{scope}: {identity} ===")
+            raise RateLimitExceeded(budget, scope, retry_after)
+
+
+def client_ip(forwarded, peer, trusted_hops=TRUSTED_PROXY_HOPS):
+    """
+    IP клиента для лимитов: trusted_hops-й адрес X-Forwarded-For справа (его дописал наш прокси),
+    без заголовка или без доверенных прокси - адрес соединения. Как werkzeug ProxyFix(x_for=trusted_hops).
+    """
+    if trusted_hops and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    return peer
+
+
+def create_rate_limiter(config):
+    """Лимитер из секции RATE_LIMITS config.json и переменной окружения REDIS_URL"""
+    limits = (config or {}).get("RATE_LIMITS") or DEFAULT_RATE_LIMITS
+    return RateLimiter(limits, os.getenv('REDIS_URL'))
+
+
+def run_flood_benchmark(flood_threads, requests_per_thread, workers, llm_latency, limited):
+    """
+    Флуд с одного IP против обычного клиента при ограниченном числе воркеров и медленной (заглушка) модели.
+    Показывает задержку обычного клиента с лимитером и без.
+    """
+    import statistics
+    import app as chat_app
+    import chat_service
+
+    class StubResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class StubModel:
+        def generate_content(self, contents, generation_config=None):
+            time.sleep(llm_latency)
+            return StubResponse("Ответ заглушки")
+
+    chat_service.model = StubModel()
+    chat_service.rate_limiter.enabled = limited
+    worker_slots = threading.Semaphore(workers)
+    statuses = {}
+    status_lock = threading.Lock()
+
+    def post(client, ip, message):
+        with worker_slots:
+            started = time.perf_counter()
+            response = client.post('/chat', json={'message': message}, environ_base={'REMOTE_ADDR': ip})
+            return response.status_code, time.perf_counter() - started
+
+    def flood():
+        client = chat_app.app.test_client()
+        for _ in range(requests_per_thread):
+            status, _ = post(client, "10.0.0.66", "расскажи анекдот")
+            with status_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    customer_latencies = []
+
+    def customer():
+        client = chat_app.app.test_client()
+        for message in ["привет", "50 кг мебель", "в астану", "габариты 120x80x50", "что посоветуешь?"]:
+            started = time.perf_counter()
+            post(client, "10.0.0.1", message)
+            customer_latencies.append(time.perf_counter() - started)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=flood) for _ in range(flood_threads)]
+    for thread in threads:
+        thread.start()
+    customer_thread = threading.Thread(target=customer)
+    customer_thread.start()
+    for thread in threads + [customer_thread]:
+        thread.join()
+
+    mode = "С ЛИМИТЕРОМ" if limited else "БЕЗ ЛИМИТЕРА"
+    print(f"📊 {mode}: ответы флуда {statuses}")
+    print(f"   ⏱ Клиент: медиана {statistics.median(customer_latencies) * 1000:.0f} мс, "
+          f"максимум {max(customer_latencies) * 1000:.0f} мс")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка лимитов /chat с заглушкой Gemini")
+    parser.add_argument('--threads', type=int, default=20, help="потоков флуда")
+    parser.add_argument('--requests', type=int, default=20, help="запросов на поток")
+    parser.add_argument('--workers', type=int, default=4, help="воркеров (как в gunicorn)")
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="задержка заглушки модели, сек")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    for limited in (False, True):
+        run_flood_benchmark(args.threads, args.requests, args.workers, args.llm_latency, limited)
@@ -0,0 +1,175 @@
+"""
+Сверка заявленного и фактического веса принятых грузов.
+
+Для каждого груза, принятого на складе (actual_weight > 0), считается тариф Т1 по заявленной
+и по фактической плотности и цена Т1 в долларах по фактическим весу и объему (actual_price) -
+в той же валюте и за ту же часть пути, что итоговая сумма договора total_price_final из admin_bot.
+Груз, который фактическая плотность переводит в другую строку T1_RATES_DENSITY, помечается tier_changed.
+
+Грузы читаются страницами по ключу track_number, считаются в памяти (категория и зона - один раз
+на различный товар и город), а результат страницы пишется одним UPDATE ... FROM из временной таблицы,
+без запроса на каждую строку.
+
+    python reconciliation.py run --db postgres://...            # еще не сверенные грузы
+    python reconciliation.py run --db ... --all                 # все принятые (после смены тарифов)
+    python reconciliation.py run --db ... --since 2025-10-01
+    python reconciliation.py flagged --db ...                   # грузы со сменой тарифа
+
+Тарифы и категории товаров берутся из config.json (--config) напрямую, без импорта chat_service.
+"""
+import os
+import time
+import logging
+
+from shipments_db import ShipmentsDatabase
+from extraction import find_product_category
+from tariffs import DEFAULT_CATEGORY, TariffCalculator, load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+BATCH_TABLE = 'reconciliation_batch'
+RESULT_COLUMNS = ['track_number', 'declared_tier', 'actual_tier', 'tier_changed', 'actual_price']
+
+SELECT_RECEIVED = """
+SELECT track_number, product, client_city, declared_weight, declared_volume, actual_weight, actual_volume
+FROM shipments
+WHERE actual_weight > 0 AND status <> 'Оформлен' AND track_number > ? {condition}
+ORDER BY track_number
+LIMIT ?
+"""
+
+
+def tier_label(category, rule):
+    return f"{category} от {rule['min_density']:g}" if rule else None
+
+
+class Reconciler:
+    """Пересчет принятых грузов по текущим тарифам Т1 (в долларах, как договор)"""
+
+    def __init__(self, database, config):
+        self.database = database
+        self.calculator = TariffCalculator.from_config(config)
+        self.product_categories = config.get("PRODUCT_CATEGORIES", {})
+        self.categories = {}
+
+    def category(self, product):
+        category = self.categories.get(product)
+        if category is None:
+            category = find_product_category(product or '', self.product_categories) or DEFAULT_CATEGORY
+            if not self.calculator.has_category(category):
+                category = DEFAULT_CATEGORY
+            self.categories[product] = category
+        return category
+
+    def rule(self, category, weight, volume):
+        if not weight or not volume or volume <= 0:
+            return None
+        return self.calculator.find_rule(category, weight / volume)
+
+    def reconcile_row(self, row):
+        # client_city в договоре - город отправки в Китае, для Т1 он не нужен
+        track, product, _, declared_weight, declared_volume, actual_weight, actual_volume = row
+        # Объем при приемке по договору не перемеряют - тогда фактический объем равен заявленному
+        actual_volume = actual_volume if actual_volume and actual_volume > 0 else declared_volume
+        category = self.category(product)
+        declared_tier = tier_label(category, self.rule(category, declared_weight, declared_volume))
+        actual_rule = self.rule(category, actual_weight, actual_volume)
+        actual_tier = tier_label(category, actual_rule)
+        return (
+            track,
+            declared_tier,
+            actual_tier,
+            bool(declared_tier and actual_tier and declared_tier != actual_tier),
+            round(self.calculator.t1_cost_usd(actual_rule, actual_weight, actual_volume), 2) if actual_rule else None,
+        )
+
+    def write_back(self, results):
+        """Результаты страницы - во временную таблицу, затем один UPDATE ... FROM"""
+        database = self.database
+        database.execute(f"DELETE FROM {BATCH_TABLE}")
+        database.insert_many(BATCH_TABLE, RESULT_COLUMNS, results)
+        now = "NOW()" if database.dialect == 'postgres' else "datetime('now')"
+        database.execute(f"""
+            UPDATE shipments SET
+                declared_tier = b.declared_tier,
+                actual_tier = b.actual_tier,
+                tier_changed = b.tier_changed,
+                actual_price = b.actual_price,
+                reconciled_at = {now}
+            FROM {BATCH_TABLE} b
+            WHERE shipments.track_number = b.track_number
+        """)
+        database.commit()
+
+    def run(self, everything=False, since=None, batch_size=DEFAULT_BATCH_SIZE):
+        """Сверяет принятые грузы страницами по batch_size; возвращает (сверено, со сменой тарифа)"""
+        database = self.database
+        database.execute(f"""
+            CREATE TEMPORARY TABLE IF NOT EXISTS {BATCH_TABLE} (
+                track_number TEXT PRIMARY KEY, declared_tier TEXT, actual_tier TEXT,
+                tier_changed BOOLEAN, actual_price REAL
+            )
+        """)
+        condition, params = "", ()
+        if not everything:
+            condition += " AND reconciled_at IS NULL"
+        if since:
+            condition += " AND created_at >= ?"
+            params += (since,)
+
+        started = time.perf_counter()
+        total = flagged = 0
+        last_track = ''
+        while True:
+            rows = database.execute(SELECT_RECEIVED.format(condition=condition), (last_track,) + params + (batch_size,)).fetchall()
+            if not rows:
+                break
+            results = [self.reconcile_row(row) for row in rows]
+            self.write_back(results)
+            total += len(results)
+            flagged += sum(1 for result in results if result[3])
+            last_track = rows[-1][0]
+            logger.info(f"⏳ Сверено грузов: {total}, сменили тариф: {flagged}")
+
+        logger.info(f"✅ Сверка: {total} грузов за {time.perf_counter() - started:.1f} с, сменили тариф: {flagged}")
+        return total, flagged
+
+    def flagged(self, limit=50):
+        """
+        Грузы, которые фактическая плотность перевела в другой тариф, по разнице между суммой договора
+        и ценой Т1 по факту (обе в долларах); грузы без суммы в договоре - в конце
+        """
+        return self.database.execute("""
+            SELECT track_number, fio, declared_tier, actual_tier, total_price_final, actual_price
+            FROM shipments WHERE tier_changed
+            ORDER BY COALESCE(ABS(actual_price - NULLIF(total_price_final, 0)), -1) DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сверка заявленного и фактического веса")
+    parser.add_argument('--db', default=os.getenv('DATABASE_URL') or 'data/shipments.db', help="postgres://... или путь к SQLite")
+    parser.add_argument('--config', default='config.json', help="тарифы и категории товаров")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="пересчитать принятые грузы")
+    run_parser.add_argument('--all', action='store_true', help="все принятые, а не только еще не сверенные")
+    run_parser.add_argument('--since', help="только принятые с даты (YYYY-MM-DD)")
+    run_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    flagged_parser = commands.add_parser('flagged', help="грузы со сменой тарифа")
+    flagged_parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    reconciler = Reconciler(ShipmentsDatabase(args.db), load_config(args.config))
+    if args.command == 'run':
+        total, flagged = reconciler.run(args.all, args.since, args.batch_size)
+        print(f"✅ Сверено: {total}, сменили тариф: {flagged}")
+    else:
+        for track, fio, declared_tier, actual_tier, agreed, actual in reconciler.flagged(args.limit):
+            agreed = f"{agreed:.0f} $" if agreed else "без суммы"
+            actual = f"{actual:.0f} $" if actual is not None else "нет тарифа"
+            print(f"⚠️ {track} {fio}: {declared_tier} -> {actual_tier}, договор {agreed}, Т1 по факту {actual}")
@@ -0,0 +1,168 @@
+"""
+Подключение к базе грузов (shipments) для аналитики и сверки веса.
+
+Боевая база - PostgreSQL (строка postgres://...), локальный стенд - файл SQLite с той же
+таблицей shipments (STANDIN_SCHEMA). Запросы пишутся с плейсхолдером '?', для PostgreSQL
+он заменяется на '%s'.
+"""
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Локальный стенд: колонки shipments, которые пишут admin_bot и warehouse_bot (см. update_db.py)
+STANDIN_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shipments (
+    id INTEGER PRIMARY KEY,
+    track_number TEXT UNIQUE,
+    contract_num TEXT,
+    fio TEXT,
+    phone TEXT,
+    product TEXT,
+    declared_weight REAL DEFAULT 0,
+    actual_weight REAL DEFAULT 0,
+    declared_volume REAL DEFAULT 0,
+    actual_volume REAL DEFAULT 0,
+    agreed_rate REAL DEFAULT 0,
+    total_price_final REAL DEFAULT 0,
+    client_city TEXT,
+    status TEXT,
+    warehouse_code TEXT,
+    manager TEXT,
+    created_at TEXT,
+    declared_tier TEXT,
+    actual_tier TEXT,
+    tier_changed BOOLEAN DEFAULT FALSE,
+    actual_price REAL,
+    reconciled_at TEXT
+)
+"""
+
+# Горячие запросы складского бота (warehouse_bot). Индексы под них создает migrations.py,
+# а python migrations.py explain проверяет по EXPLAIN, что они используются.
+EXPECTED_COLUMNS = "id, created_at, contract_num, fio, product, declared_weight"
+
+
+def expected_filter(warehouse=None, date_from=None, date_to=None):
+    """Условия списка ожидаемых грузов: склад и даты [date_from, date_to) в виде строк YYYY-MM-DD"""
+    conditions, params = ["status = 'Оформлен'"], []
+    if warehouse:
+        conditions.append("warehouse_code = %s")
+        params.append(warehouse)
+    if date_from:
+        conditions.append("created_at >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("created_at < %s")
+        params.append(date_to)
+    return conditions, params
+
+
+def expected_page_query(limit, warehouse=None, date_from=None, date_to=None, after=None, before=None):
+    """
+    Страница ожидаемых грузов по ключу (created_at, id), новые сверху: диапазон индекса, а не OFFSET.
+    after=(created_at, id) - следующая страница (старше); before - предыдущая (новее), строки
+    тогда приходят в обратном порядке.
+    """
+    conditions, params = expected_filter(warehouse, date_from, date_to)
+    order = "DESC"
+    if after:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params += list(after)
+    elif before:
+        conditions.append("(created_at, id) > (%s, %s)")
+        params += list(before)
+        order = "ASC"
+    sql = (
+        f"SELECT {EXPECTED_COLUMNS} FROM shipments WHERE {' AND '.join(conditions)} "
+        f"ORDER BY created_at {order}, id {order} LIMIT %s"
+    )
+    return sql, params + [limit]
+
+
+def expected_count_query(warehouse=None, date_from=None, date_to=None):
+    conditions, params = expected_filter(warehouse, date_from, date_to)
+    return f"SELECT COUNT(*) FROM shipments WHERE {' AND '.join(conditions)}", params
+
+# Груз по трек-номеру или номеру договора: вместо "contract_num = %s OR track_number = %s"
+# две ветки UNION ALL, каждая по своему индексу. Параметры: (код, код, код).
+FIND_SHIPMENT = """
+SELECT track_number, fio, phone, actual_weight FROM shipments WHERE track_number = %s
+UNION ALL
+SELECT track_number, fio, phone, actual_weight FROM shipments WHERE contract_num = %s AND track_number <> %s
+LIMIT 1
+"""
+
+# Изменения - по трек-номеру, найденному FIND_SHIPMENT
+RECEIVE_SHIPMENT = """
+UPDATE shipments SET status = 'принят на складе', actual_weight = %s, created_at = CURRENT_TIMESTAMP
+WHERE track_number = %s
+"""
+SET_SHIPMENT_STATUS = "UPDATE shipments SET status = %s WHERE track_number = %s"
+
+# Фото и документы приемки: в базе только ссылка (хэш файла в photo_store), повтор того же файла к грузу не пишется
+ADD_SHIPMENT_PHOTO = """
+INSERT INTO shipment_photos (track_number, sha256, kind, content_type, size_bytes, file_name, warehouse_code, uploaded_by)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (track_number, sha256) DO NOTHING
+"""
+COUNT_SHIPMENT_PHOTOS = "SELECT COUNT(*) FROM shipment_photos WHERE track_number = %s"
+
+
+class ShipmentsDatabase:
+    """Соединение с базой грузов: свое у каждого потока, после ошибки открывается заново"""
+
+    def __init__(self, database):
+        self.database = database
+        self.dialect = 'postgres' if database.startswith(('postgres://', 'postgresql://')) else 'sqlite'
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            if self.dialect == 'postgres':
+                import psycopg2
+                connection = psycopg2.connect(self.database)
+            else:
+                connection = sqlite3.connect(self.database.replace('sqlite:///', ''), timeout=30)
+                connection.execute("PRAGMA journal_mode = WAL")
+            self.local.connection = connection
+        return connection
+
+    def execute(self, sql, params=()):
+        if self.dialect == 'postgres':
+            sql = sql.replace('?', '%s')
+        cursor = self.connection().cursor()
+        try:
+            cursor.execute(sql, params)
+        except Exception:
+            # Соединение после ошибки (или обрыва) не переиспользуем
+            self.connection().rollback()
+            self.local.connection = None
+            raise
+        return cursor
+
+    def insert_many(self, table, columns, rows):
+        """Пакетная вставка: execute_values для PostgreSQL (одна команда на страницу), executemany для SQLite"""
+        if self.dialect == 'postgres':
+            from psycopg2.extras import execute_values
+            execute_values(
+                self.connection().cursor(),
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                rows,
+                page_size=5000
+            )
+        else:
+            self.connection().executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows
+            )
+
+    def execute_many(self, sql, rows):
+        if self.dialect == 'postgres':
+            sql = sql.replace('?', '%s')
+        self.connection().cursor().executemany(sql, rows)
+
+    def commit(self):
+        self.connection().commit()
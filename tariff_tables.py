@@ -0,0 +1,379 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'PPTF'
+FILE_VERSION = 1
+HEADER = struct.Struct('<4sHI')  # magic, версия, длина JSON с описанием разделов
+
+# Таблицы, из которых собирается файл (остальные ключи config.json в нем не нужны)
+TABLE_KEYS = ("T1_RATES_DENSITY", "DESTINATION_ZONES", "T2_RATES", "T2_RATES_DETAILED")
+
+TARIFF_TABLES_PATH = os.getenv('TARIFF_TABLES_PATH', 'data/tariffs.bin')
+
+
+def config_digest(config):
+    """Хэш таблиц тарифов: по нему воркер понимает, что файл собран из текущего config.json"""
+    tables = {key: config.get(key) or {} for key in TABLE_KEYS}
+    return hashlib.sha256(json.dumps(tables, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def typed_numbers(values):
+    """Числа -> (array('d'), array('B') с флагом int): цены из конфига возвращаются того же типа, что в JSON"""
+    return array('d', values), array('B', [isinstance(value, int) for value in values])
+
+
+class TariffTables:
+    """
+    Скомпилированные таблицы тарифов в одном непрерывном буфере.
+    Пороги плотности Т1, диапазоны и цены Т2 и справочник городов лежат типизированными массивами:
+    при загрузке через mmap они не копируются в память процесса, страницы общие у всех воркеров gunicorn.
+    В памяти процесса остаются только короткие списки категорий и зон из заголовка.
+    """
+
+    def __init__(self, buffer, meta):
+        self._buffer = buffer
+        self.meta = meta
+        view = memoryview(buffer)
+        self.sections = {}
+        for name, (offset, typecode, length) in meta['sections'].items():
+            size = array(typecode).itemsize
+            section = view[offset:offset + length * size]
+            if typecode != 'B' and sys.byteorder != 'little':
+                section = array(typecode, section.tobytes())
+                section.byteswap()
+            else:
+                section = section.cast(typecode)
+            self.sections[name] = section
+
+        self.categories = {category: i for i, category in enumerate(meta['categories'])}
+        self.zones = meta['zones']
+        self.t2_zones = {zone: i for i, zone in enumerate(meta['t2_zones'])}
+        self.t2_rates = meta['t2_rates']
+        self.digest = meta['digest']
+
+    # --- СБОРКА ---
+    @staticmethod
+    def compile(t1_rates_density, destination_zones, t2_rates=None, t2_rates_detailed=None):
+        """Таблицы из конфига -> (bytes, meta) в формате файла"""
+        categories = list(t1_rates_density)
+        units = []
+        bounds, thresholds, prices, unit_ids = [0], [], [], []
+        for category in categories:
+            for rule in sorted(t1_rates_density[category], key=lambda rule: rule['min_density']):
+                if rule['unit'] not in units:
+                    units.append(rule['unit'])
+                thresholds.append(rule['min_density'])
+                prices.append(rule['price'])
+                unit_ids.append(units.index(rule['unit']))
+            bounds.append(len(thresholds))
+
+        zones = list(dict.fromkeys(str(zone) for zone in destination_zones.values()))
+        zone_ids = {zone: i for i, zone in enumerate(zones)}
+        names = [city.encode('utf-8') for city in destination_zones]
+        city_offsets = [0]
+        for name in names:
+            city_offsets.append(city_offsets[-1] + len(name))
+
+        large_parcel = (t2_rates_detailed or {}).get("large_parcel", {})
+        ranges = sorted(large_parcel.get("weight_ranges", []), key=lambda weight_range: weight_range["max"])
+        t2_zones = set(large_parcel.get("extra_kg_rate", {}))
+        for weight_range in ranges:
+            t2_zones &= set(weight_range["zones"])
+        t2_zones = sorted(t2_zones)
+
+        min_density, min_density_int = typed_numbers(thresholds)
+        price, price_int = typed_numbers(prices)
+        t2_max, t2_max_int = typed_numbers([weight_range["max"] for weight_range in ranges])
+        t2_price, t2_price_int = typed_numbers([weight_range["zones"][zone] for zone in t2_zones for weight_range in ranges])
+        t2_extra, t2_extra_int = typed_numbers([large_parcel["extra_kg_rate"][zone] for zone in t2_zones])
+
+        arrays = {
+            'rule_bounds': array('I', bounds),
+            'min_density': min_density, 'min_density_int': min_density_int,
+            'price': price, 'price_int': price_int,
+            'unit': array('B', unit_ids),
+            'city_offsets': array('I', city_offsets),
+            'city_zone': array('I', [zone_ids[str(zone)] for zone in destination_zones.values()]),
+            # Порядок городов по байтам UTF-8 - для бинарного поиска точного совпадения
+            'city_sorted': array('I', sorted(range(len(names)), key=names.__getitem__)),
+            'city_text': array('B', b''.join(names)),
+            't2_max': t2_max, 't2_max_int': t2_max_int,
+            't2_price': t2_price, 't2_price_int': t2_price_int,
+            't2_extra': t2_extra, 't2_extra_int': t2_extra_int,
+        }
+        meta = {
+            'digest': config_digest({
+                "T1_RATES_DENSITY": t1_rates_density, "DESTINATION_ZONES": destination_zones,
+                "T2_RATES": t2_rates, "T2_RATES_DETAILED": t2_rates_detailed,
+            }),
+            'categories': categories,
+            'units': units,
+            'zones': zones,
+            't2_zones': t2_zones,
+            't2_rates': t2_rates or {},
+            'sections': {},
+        }
+
+        # Разделы выровнены по 8 байт от начала данных: так их можно читать из mmap как массивы
+        body = bytearray()
+        for name, values in arrays.items():
+            body += b'\0' * ((-len(body)) % 8)
+            meta['sections'][name] = [len(body), values.typecode, len(values)]
+            if sys.byteorder != 'little' and values.typecode != 'B':
+                values = array(values.typecode, values)
+                values.byteswap()
+            body += values.tobytes()
+        return bytes(body), meta
+
+    @classmethod
+    def from_config(cls, t1_rates_density, destination_zones, t2_rates=None, t2_rates_detailed=None):
+        """Таблицы в памяти процесса (без файла)"""
+        body, meta = cls.compile(t1_rates_density, destination_zones, t2_rates, t2_rates_detailed)
+        return cls(body, meta)
+
+    @classmethod
+    def save_binary(cls, config, path):
+        """
+        Заголовок, JSON с описанием разделов, затем данные. Файл пишется рядом и подменяется атомарно,
+        чтобы воркер не отобразил недописанный файл
+        """
+        body, meta = cls.compile(*(config.get(key, {}) for key in TABLE_KEYS))
+        encoded = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        padding = (-(HEADER.size + len(encoded))) % 8
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(FILE_MAGIC, FILE_VERSION, len(encoded) + padding))
+            f.write(encoded + b' ' * padding)
+            f.write(body)
+        os.replace(temp_path, path)
+        return meta
+
+    @classmethod
+    def from_binary_file(cls, path):
+        """Загрузка через mmap: массивы читаются прямо из страниц файла, общих для всех процессов"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, meta_length = HEADER.unpack_from(mapped, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            mapped.close()
+            raise ValueError(f"Неверный формат файла тарифов: {path}")
+
+        meta = json.loads(bytes(mapped[HEADER.size:HEADER.size + meta_length]).decode('utf-8'))
+        offset = HEADER.size + meta_length
+        return cls(memoryview(mapped)[offset:], meta)
+
+    # --- ЧТЕНИЕ ---
+    def number(self, name, index):
+        value = self.sections[name][index]
+        return int(value) if self.sections[f"{name}_int"][index] else value
+
+    def has_category(self, category):
+        return category in self.categories
+
+    def category_rules(self, category):
+        """(пороги плотности по возрастанию, номер первого правила) или None, если категории нет"""
+        index = self.categories.get(category)
+        if index is None:
+            return None
+        bounds = self.sections['rule_bounds']
+        start, end = bounds[index], bounds[index + 1]
+        return self.sections['min_density'][start:end], start
+
+    def rule(self, index):
+        """Правило Т1 в том же виде, что в config.json"""
+        return {
+            'min_density': self.number('min_density', index),
+            'price': self.number('price', index),
+            'unit': self.meta['units'][self.sections['unit'][index]],
+        }
+
+    def category_names(self):
+        """Категории Т1 в порядке config.json"""
+        return self.meta['categories']
+
+    def rules(self, category):
+        """Правила Т1 категории по возрастанию min_density (пустой список, если категории нет)"""
+        tier = self.category_rules(category)
+        if tier is None:
+            return []
+        thresholds, start = tier
+        return [self.rule(start + i) for i in range(len(thresholds))]
+
+    def city_count(self):
+        return len(self.sections['city_zone'])
+
+    def city_name(self, index):
+        offsets = self.sections['city_offsets']
+        return str(self.sections['city_text'][offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def city_names(self):
+        """Города в порядке config.json"""
+        for index in range(self.city_count()):
+            yield self.city_name(index)
+
+    def city_zones(self):
+        """(город, зона) в порядке config.json"""
+        city_zone = self.sections['city_zone']
+        for index in range(self.city_count()):
+            yield self.city_name(index), self.zones[city_zone[index]]
+
+    def find_zone(self, city_name):
+        """
+        То же, что tariffs.find_zone: точное совпадение (бинарный поиск по файлу),
+        затем первый город в порядке конфига, входящий в название или содержащий его
+        """
+        city_lower = city_name.lower().strip()
+        key = city_lower.encode('utf-8')
+        offsets, text, order = self.sections['city_offsets'], self.sections['city_text'], self.sections['city_sorted']
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            index = order[middle]
+            name = text[offsets[index]:offsets[index + 1]].tobytes()
+            if name < key:
+                low = middle + 1
+            elif name > key:
+                high = middle
+            else:
+                return self.zones[self.sections['city_zone'][index]]
+
+        for index in range(self.city_count()):
+            city = self.city_name(index)
+            if city in city_lower or city_lower in city:
+                return self.zones[self.sections['city_zone'][index]]
+        return None
+
+    def t2_table(self, zone):
+        """(цены по диапазонам веса, цена доп. кг) для зоны из прогрессивной таблицы или None"""
+        index = self.t2_zones.get(zone)
+        if index is None:
+            return None
+        count = len(self.sections['t2_max'])
+        prices = [self.number('t2_price', index * count + i) for i in range(count)]
+        return prices, self.number('t2_extra', index)
+
+    def t2_maxes(self):
+        return self.sections['t2_max']
+
+    def t2_weight_limits(self):
+        """Верхние границы диапазонов веса Т2 по возрастанию, числа того же типа, что в config.json"""
+        return [self.number('t2_max', i) for i in range(len(self.sections['t2_max']))]
+
+    def memory_bytes(self):
+        """Размер данных таблиц (для mmap - отображенная область)"""
+        return sum(section.nbytes for section in self.sections.values())
+
+
+def load_tariff_tables(config, binary_path):
+    """
+    Таблицы из бинарного файла через mmap. Если файла нет или он собран из другого config.json,
+    файл пересобирается (обычно это уже сделал мастер gunicorn в on_starting).
+    """
+    digest = config_digest(config)
+    if os.path.exists(binary_path):
+        try:
+            tables = TariffTables.from_binary_file(binary_path)
+            if tables.digest == digest:
+                return tables
+        except (ValueError, OSError) as e:
+            logger.warning(f"⚠️ Файл тарифов {binary_path} не прочитан: {e}")
+    build_tariff_tables(config, binary_path)
+    return TariffTables.from_binary_file(binary_path)
+
+
+def open_tariff_tables(config, binary_path=TARIFF_TABLES_PATH):
+    """Таблицы через mmap (load_tariff_tables); если файл недоступен - собранные в памяти процесса"""
+    try:
+        return load_tariff_tables(config, binary_path)
+    except OSError as e:
+        logger.error(f"!!! Файл тарифов {binary_path} недоступен, таблицы собираются в памяти: {e}")
+        return TariffTables.from_config(*(config.get(key) or {} for key in TABLE_KEYS))
+
+
+def build_tariff_tables(config, binary_path):
+    os.makedirs(os.path.dirname(binary_path) or '.', exist_ok=True)
+    meta = TariffTables.save_binary(config, binary_path)
+    logger.info(f"✅ Таблицы тарифов собраны в {binary_path}: {len(meta['categories'])} категорий, {len(meta['zones'])} зон")
+
+
+# --- ЗАМЕР ---
+
+def synthetic_config(config, cities):
+    """Конфиг с тем же набором тарифов и cities городами (для оценки роста справочника)"""
+    zones = list(dict.fromkeys(config["DESTINATION_ZONES"].values()))
+    destination_zones = dict(config["DESTINATION_ZONES"])
+    for i in range(cities - len(destination_zones)):
+        destination_zones[f"город{i:06d}"] = zones[i % len(zones)]
+    return dict(config, DESTINATION_ZONES=destination_zones)
+
+
+def run_benchmark(config, cities, path):
+    """Память процесса: справочники из config.json в словарях против таблиц из файла через mmap"""
+    import gc
+    import tracemalloc
+    from tariffs import TariffCalculator
+
+    config = synthetic_config(config, cities)
+    TariffTables.save_binary(config, path)
+    encoded = json.dumps(config, ensure_ascii=False).encode('utf-8')
+    del config
+    gc.collect()
+
+    tracemalloc.start()
+    parsed = json.loads(encoded)
+    TariffCalculator(*(parsed[key] for key in TABLE_KEYS))
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    del parsed
+    gc.collect()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    tables = TariffTables.from_binary_file(path)
+    calculator = TariffCalculator.from_tables(tables)
+    mapped_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    probes = [tables.city_name(i) for i in range(0, tables.city_count(), max(1, tables.city_count() // 1000))]
+    for city in probes:
+        calculator.tables.find_zone(city)
+    lookup_us = (time.perf_counter() - started) / len(probes) * 1e6
+
+    print(f"📊 Городов: {tables.city_count()}, файл: {os.path.getsize(path) / 1024:.0f} кБ")
+    print(f"💾 Словари из config.json: {dict_bytes / 1024:.0f} кБ на процесс")
+    print(f"💾 Таблицы через mmap: {mapped_bytes / 1024:.0f} кБ на процесс (данные - общие страницы файла)")
+    print(f"⏱ Поиск города в файле: {lookup_us:.1f} мкс")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Бинарный файл таблиц тарифов для mmap")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="config.json -> бинарный файл")
+    build_parser.add_argument('--config', default='config.json')
+    build_parser.add_argument('--output', default='data/tariffs.bin')
+    bench_parser = commands.add_parser('bench', help="память на процесс при росте справочника городов")
+    bench_parser.add_argument('--config', default='config.json')
+    bench_parser.add_argument('--cities', type=int, default=100_000)
+    bench_parser.add_argument('--output', default='/tmp/tariffs_bench.bin')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.config, 'r', encoding='utf-8') as f:
+        tariff_config = json.load(f)
+
+    if args.command == 'build':
+        build_tariff_tables(tariff_config, args.output)
+    else:
+        run_benchmark(tariff_config, args.cities, args.output)
@@ -0,0 +1,315 @@
+import json
+import time
+import logging
+from bisect import bisect_left, bisect_right
+from tariff_tables import TariffTables, TABLE_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Категория по умолчанию, если товар не распознан или для категории нет тарифов
+DEFAULT_CATEGORY = "мебель"
+
+# Комиссия компании поверх Т1 + Т2
+COMMISSION = 1.20
+
+# Т2 по городу Алматы - за кг (в прогрессивной таблице Алматы нет)
+ALMATY_ZONE = "алматы"
+ALMATY_T2_PER_KG = 250
+
+# Т2 за кг для зоны, которой нет в прогрессивной таблице
+FLAT_T2_PER_KG = 300
+
+# Сколько распознанных городов помнить
+MAX_CACHED_CITIES = 4096
+
+
+def load_config(path='config.json'):
+    """config.json для CLI: без импорта chat_service (логирование, очередь заданий, модель Gemini)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_zone(city_name, destination_zones):
+    """Зона по названию города: точное совпадение, затем вхождение одного названия в другое"""
+    city_lower = city_name.lower().strip()
+    if city_lower in destination_zones:
+        return destination_zones[city_lower]
+    for city, zone in destination_zones.items():
+        if city in city_lower or city_lower in city:
+            return zone
+    return None
+
+
+class TariffCalculator:
+    """
+    Единый расчет Т1 + Т2 для /chat, прайс-листа и сборных грузов.
+    Таблицы компилируются один раз (TariffTables): пороги плотности Т1 и весовые диапазоны Т2 отсортированы
+    для бинарного поиска, распознанные города кэшируются. В quote() каждый поиск выполняется ровно один раз.
+    """
+
+    def __init__(self, t1_rates_density, destination_zones, t2_rates=None, t2_rates_detailed=None):
+        self.use_tables(TariffTables.from_config(t1_rates_density, destination_zones, t2_rates, t2_rates_detailed))
+
+    @classmethod
+    def from_config(cls, config):
+        """Расчет по таблицам из config.json, собранным в памяти процесса"""
+        return cls(*(config.get(key) or {} for key in TABLE_KEYS))
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Расчет по уже собранным таблицам (например, из общего для воркеров файла через mmap)"""
+        calculator = cls.__new__(cls)
+        calculator.use_tables(tables)
+        return calculator
+
+    def use_tables(self, tables):
+        self.tables = tables
+        self.t2_rates = tables.t2_rates
+        self.zone_cache = {}
+        # Пороги, правила и строки Т2 копируются из таблиц при первом обращении: их немного,
+        # и число не зависит от числа городов. Справочник городов остается в таблицах.
+        self.t2_maxes = list(tables.t2_maxes())
+        self.tiers = {}
+        self.rules = {}
+        self.t2_tables = {}
+
+    # --- ПОИСК ---
+    def zone(self, city):
+        """Зона города с кэшем (None, если город не найден)"""
+        if city in self.zone_cache:
+            return self.zone_cache[city]
+        zone = self.tables.find_zone(city)
+        if len(self.zone_cache) >= MAX_CACHED_CITIES:
+            self.zone_cache.clear()
+        self.zone_cache[city] = zone
+        return zone
+
+    def has_category(self, category):
+        return self.tables.has_category(category)
+
+    def find_rule(self, category, density):
+        """Правило Т1 с наибольшим min_density, не превышающим плотность"""
+        if not self.tables.has_category(category):
+            category = DEFAULT_CATEGORY
+        tier = self.tiers.get(category)
+        if tier is None:
+            tier = self.tables.category_rules(category)
+            if tier is None:
+                return None
+            tier = self.tiers[category] = (list(tier[0]), tier[1])
+        thresholds, start = tier
+        position = bisect_right(thresholds, density) - 1
+        if position < 0:
+            return None
+        index = start + position
+        rule = self.rules.get(index)
+        if rule is None:
+            rule = self.rules[index] = self.tables.rule(index)
+        return rule
+
+    # --- ТАРИФЫ ---
+    @staticmethod
+    def t1_cost_usd(rule, weight, volume):
+        if rule['unit'] == "m3":
+            return rule['price'] * volume
+        return rule['price'] * weight
+
+    def t2_cost(self, weight, zone):
+        """
+        Т2 по прогрессивной таблице: до последнего диапазона - цена диапазона,
+        сверх него - весь вес по тарифу доп. кг (так бот считал всегда)
+        """
+        zone = str(zone)
+        if zone not in self.t2_tables:
+            self.t2_tables[zone] = self.tables.t2_table(zone)
+        table = self.t2_tables[zone]
+        if table is None:
+            if zone == ALMATY_ZONE:
+                return weight * self.t2_rates.get(ALMATY_ZONE, ALMATY_T2_PER_KG)
+            return weight * self.t2_rates.get(zone, FLAT_T2_PER_KG)
+        prices, extra_kg_rate = table
+        position = bisect_left(self.t2_maxes, weight)
+        if position < len(prices):
+            return prices[position]
+        return weight * extra_kg_rate
+
+    def quote(self, weight, category, city, volume, rate):
+        """
+        Расчет Т1 + Т2 по уже определенной категории и курсу rate (RateSnapshot).
+        None, если нет объема, не подобран тариф или не найден город.
+        """
+        if not volume or volume <= 0:
+            return None
+        density = weight / volume
+        rule = self.find_rule(category, density)
+        if not rule:
+            return None
+        zone = self.zone(city)
+        if not zone:
+            return None
+
+        t1_cost_usd = self.t1_cost_usd(rule, weight, volume)
+        t1_cost_kzt = t1_cost_usd * rate.rate
+        t2_cost_kzt = self.t2_cost(weight, zone)
+
+        return {
+            't1_cost': t1_cost_kzt,
+            't2_cost': t2_cost_kzt,
+            'total': (t1_cost_kzt + t2_cost_kzt) * COMMISSION,
+            'zone': ALMATY_ZONE if zone == ALMATY_ZONE else f"зона {zone}",
+            't2_rate': f"прогрессивный тариф (зона {zone})",
+            'volume': volume,
+            'density': density,
+            'rule': rule,
+            't1_cost_usd': t1_cost_usd,
+            'category': category if self.tables.has_category(category) else DEFAULT_CATEGORY,
+            'exchange_rate': rate.rate,
+            'rate_timestamp': rate.timestamp,
+        }
+
+
+def reference_quote(config, weight, category, city, volume, rate):
+    """
+    Прежний расчет calculate_quick_cost без изменений в логике (пересортировка правил на каждый запрос,
+    линейный проход по диапазонам Т2, поиск зоны без кэша). Эталон для verify и bench.
+    """
+    if not volume or volume <= 0:
+        return None
+    density = weight / volume
+    rules = config["T1_RATES_DENSITY"].get(category) or config["T1_RATES_DENSITY"].get(DEFAULT_CATEGORY)
+    rule = None
+    for candidate in sorted(rules, key=lambda x: x['min_density'], reverse=True):
+        if density >= candidate['min_density']:
+            rule = candidate
+            break
+    if not rule:
+        return None
+
+    cost_usd = rule['price'] * volume if rule['unit'] == "m3" else rule['price'] * weight
+    t1_cost_kzt = cost_usd * rate.rate
+
+    zone = find_zone(city, config["DESTINATION_ZONES"])
+    if not zone:
+        return None
+    zone = str(zone)
+    try:
+        t2_rates = config["T2_RATES_DETAILED"]["large_parcel"]
+        base_cost = 0
+        remaining_weight = weight
+        for weight_range in t2_rates["weight_ranges"]:
+            if weight <= weight_range["max"]:
+                base_cost = weight_range["zones"][zone]
+                remaining_weight = 0
+                break
+            elif weight > 20:
+                if weight_range["max"] == 20:
+                    base_cost = weight_range["zones"][zone]
+                    remaining_weight = weight - 20
+                break
+        if remaining_weight > 0:
+            base_cost += remaining_weight * t2_rates["extra_kg_rate"][zone]
+        t2_cost_kzt = base_cost
+    except Exception:
+        t2_cost_kzt = weight * 250 if zone == ALMATY_ZONE else weight * config["T2_RATES"].get(zone, 300)
+
+    return {
+        't1_cost': t1_cost_kzt,
+        't2_cost': t2_cost_kzt,
+        'total': (t1_cost_kzt + t2_cost_kzt) * 1.20,
+        'density': density,
+        'rule': rule,
+        't1_cost_usd': cost_usd,
+    }
+
+
+# --- ПРОВЕРКА И ЗАМЕР ---
+
+def random_cases(config, count, seed):
+    """Случайные входы с упором на границы: пороги плотности, границы весовых диапазонов, опечатки в городах"""
+    import random
+    rng = random.Random(seed)
+    categories = list(config["T1_RATES_DENSITY"]) + ["неизвестная категория"]
+    cities = list(config["DESTINATION_ZONES"])
+    cities += [city.upper() for city in cities[:10]] + [f" {city} " for city in cities[:10]]
+    cities += ["г. Астана", "караган", "алм", "москва", "", "x"]
+    thresholds = sorted({rule['min_density'] for rules in config["T1_RATES_DENSITY"].values() for rule in rules})
+    maxes = [weight_range["max"] for weight_range in config["T2_RATES_DETAILED"]["large_parcel"]["weight_ranges"]]
+
+    for _ in range(count):
+        if rng.random() < 0.3:
+            weight = rng.choice(maxes) + rng.choice([-1e-9, 0, 1e-9, 0.5])
+        else:
+            weight = round(rng.uniform(0.1, 3000), rng.choice([0, 1, 3]))
+        if rng.random() < 0.3 and thresholds:
+            density = rng.choice(thresholds) + rng.choice([-1e-6, 0, 1e-6])
+            volume = weight / density if density > 0 else rng.uniform(0.01, 50)
+        else:
+            volume = rng.choice([0, -1, rng.uniform(0.001, 50)]) if rng.random() < 0.05 else rng.uniform(0.001, 50)
+        yield weight, rng.choice(categories), rng.choice(cities), volume
+
+
+def verify(config, count, seed):
+    """Сверка TariffCalculator с прежним расчетом на случайных входах"""
+    from exchange_rates import RateSnapshot
+    calculator = TariffCalculator(
+        config["T1_RATES_DENSITY"], config["DESTINATION_ZONES"], config["T2_RATES"], config["T2_RATES_DETAILED"]
+    )
+    rate = RateSnapshot(rate=config["EXCHANGE_RATE"]["rate"], timestamp=None, source="config")
+    checked = quoted = mismatched = 0
+    for weight, category, city, volume in random_cases(config, count, seed):
+        expected = reference_quote(config, weight, category, city, volume, rate)
+        actual = calculator.quote(weight, category, city, volume, rate)
+        checked += 1
+        if expected is None or actual is None:
+            if expected is not actual:
+                mismatched += 1
+                logger.error(f"Расхождение {weight, category, city, volume}: {expected} != {actual}")
+            continue
+        quoted += 1
+        if any(expected[key] != actual[key] for key in expected) or actual['total'] != (actual['t1_cost'] + actual['t2_cost']) * COMMISSION:
+            mismatched += 1
+            logger.error(f"Расхождение {weight, category, city, volume}: {expected} != {actual}")
+    print(f"🔍 Проверено: {checked} (с расчетом: {quoted}), расхождений: {mismatched}")
+    return mismatched == 0
+
+
+def bench(config, count):
+    """Наносекунд на расчет: прежний путь против TariffCalculator (категория уже определена)"""
+    from exchange_rates import RateSnapshot
+    calculator = TariffCalculator(
+        config["T1_RATES_DENSITY"], config["DESTINATION_ZONES"], config["T2_RATES"], config["T2_RATES_DETAILED"]
+    )
+    rate = RateSnapshot(rate=config["EXCHANGE_RATE"]["rate"], timestamp=None, source="config")
+    cases = list(random_cases(config, count, seed=1))
+
+    started = time.perf_counter_ns()
+    for weight, category, city, volume in cases:
+        reference_quote(config, weight, category, city, volume, rate)
+    reference_ns = (time.perf_counter_ns() - started) / len(cases)
+
+    started = time.perf_counter_ns()
+    for weight, category, city, volume in cases:
+        calculator.quote(weight, category, city, volume, rate)
+    calculator_ns = (time.perf_counter_ns() - started) / len(cases)
+
+    print(f"⏱ Прежний расчет: {reference_ns:,.0f} нс/расчет")
+    print(f"⏱ TariffCalculator: {calculator_ns:,.0f} нс/расчет ({reference_ns / calculator_ns:.1f}x)")
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Проверка и замер единого расчета тарифов")
+    parser.add_argument('command', choices=['verify', 'bench'])
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--cases', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    tariff_config = load_config(args.config)
+
+    if args.command == 'verify':
+        sys.exit(0 if verify(tariff_config, args.cases, args.seed) else 1)
+    bench(tariff_config, args.cases)
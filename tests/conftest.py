@@ -0,0 +1,7 @@
+"""Модули проекта лежат в корне репозитория: тесты запускаются как python -m pytest из корня или просто pytest"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,44 @@
+"""Проверка позиций сборного груза из CSV и JSON"""
+import pytest
+
+from cargo import MAX_QUANTITY, MAX_SESSION_ITEMS, pack_items, parse_items_from_csv, parse_items_from_json, unpack_items
+
+HEADER = "товар,количество,вес,объем\n"
+
+
+def no_category(product):
+    return None
+
+
+@pytest.mark.parametrize('row', [
+    "диван,-2,75,1", "диван,inf,75,1", "диван,nan,75,1", "диван,0,75,1", "диван,1.5,75,1",
+    f"диван,{MAX_QUANTITY + 1},75,1", "диван,2,nan,1", "диван,2,-75,1", "диван,2,75,inf", "диван,2,75,abc",
+])
+def test_csv_rejects_bad_row(row):
+    with pytest.raises(ValueError):
+        parse_items_from_csv(HEADER + row + "\n", no_category)
+
+
+def test_csv_totals_per_item():
+    items = parse_items_from_csv(HEADER + "диван,2,75,1\nстул,,5,\n", no_category)
+    assert [(item['quantity'], item['weight'], item['volume']) for item in items] == [(2, 150, 2)]
+
+
+def test_csv_volume_from_dimensions():
+    items = parse_items_from_csv("товар;кол-во;вес;длина;ширина;высота\nстул;3;5;40;40;80\n", no_category)
+    assert items[0]['volume'] == pytest.approx(3 * 0.128)
+
+
+@pytest.mark.parametrize('raw', [{'weight': 'nan', 'volume': 1}, {'weight': 1, 'volume': 1, 'quantity': -1}])
+def test_json_rejects_bad_item(raw):
+    with pytest.raises(ValueError):
+        parse_items_from_json([raw], no_category)
+
+
+def test_session_items_are_compact_and_capped():
+    items = [{'product': f"позиция {n}", 'category': f"категория {n % 3}", 'quantity': 1, 'weight': 10, 'volume': 0.1}
+             for n in range(MAX_SESSION_ITEMS + 1)]
+    packed = pack_items(items)
+    assert len(packed) == 3
+    assert sum(entry[2] for entry in packed) == 10 * len(items)
+    assert unpack_items(pack_items(items[:2]))[0]['category'] == "категория 0"
@@ -0,0 +1,27 @@
+"""ETA: грузы без движения не копятся в памяти модели"""
+from eta import BACKTEST_SCHEMA, BUCKET_SECONDS, MAX_BUCKETS, STAGES, EtaModel, format_time
+from shipments_db import ShipmentsDatabase
+
+START = 1_735_689_600  # 2025-01-01 UTC
+
+
+def test_refresh_evicts_tracks_without_events(tmp_path):
+    database = ShipmentsDatabase(str(tmp_path / 'eta.db'))
+    database.connection().executescript(BACKTEST_SCHEMA)
+    late = START + (MAX_BUCKETS + 1) * BUCKET_SECONDS
+    events = [
+        ("LOST", STAGES[0], START),
+        ("MOVING", STAGES[0], START),
+        ("MOVING", STAGES[1], late),
+        ("NEW", STAGES[0], late - BUCKET_SECONDS),
+    ]
+    database.execute_many(
+        "INSERT INTO shipment_status (track_number, status, timestamp) VALUES (?, ?, ?)",
+        [(track, status, format_time(when)) for track, status, when in events]
+    )
+    database.commit()
+
+    model = EtaModel(database, write_back=False)
+    model.refresh()
+    assert set(model.entered) == {"MOVING", "NEW"}
+    assert set(model.current) == {"MOVING", "NEW"}
@@ -0,0 +1,54 @@
+"""История курса: поиск курса на момент и запись изменения одним процессом"""
+import json
+from datetime import datetime
+
+import pytest
+
+from exchange_rates import ExchangeRateProvider, RateSnapshot
+
+HISTORY = [
+    {'rate': 500, 'timestamp': '2025-10-01T09:00:00', 'source': 'file'},
+    {'rate': 510, 'timestamp': '2025-10-01T12:00:00', 'source': 'file'},
+    {'rate': 520, 'timestamp': '2025-10-02T00:00:00', 'source': 'file'},
+]
+
+
+class StaticSource:
+    name = "static"
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def fetch(self):
+        return RateSnapshot(rate=self.rate, timestamp=datetime.now().isoformat(timespec='seconds'), source=self.name)
+
+
+@pytest.fixture
+def history_path(tmp_path):
+    path = tmp_path / 'exchange_rates.jsonl'
+    path.write_text("".join(json.dumps(snapshot) + "\n" for snapshot in HISTORY), encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('when, rate', [
+    ('2025-10-01 12:00:00', 510), ('2025-10-01T12:00:00', 510), ('2025-10-01 11:59:59', 500),
+    ('2025-10-01', 500), ('2025-10-02', 520), (datetime(2025, 10, 1, 13), 510), ('2025-09-30', 500),
+])
+def test_rate_at_compares_moments(history_path, when, rate):
+    provider = ExchangeRateProvider(StaticSource(550), history_path=history_path)
+    assert provider.rate_at(when).rate == rate
+
+
+def test_rate_at_rejects_garbage(history_path):
+    with pytest.raises(ValueError):
+        ExchangeRateProvider(StaticSource(550), history_path=history_path).rate_at("вчера")
+
+
+def test_rate_change_written_once_by_all_workers(history_path):
+    # Каждый воркер gunicorn держит свой провайдер и сам обновляет курс
+    workers = [ExchangeRateProvider(StaticSource(530), history_path=history_path) for _ in range(4)]
+    for provider in workers:
+        provider.refresh()
+    with open(history_path, encoding='utf-8') as f:
+        rates = [json.loads(line)['rate'] for line in f]
+    assert rates == [500, 510, 520, 530]
@@ -0,0 +1,26 @@
+"""Локальные ответы FAQ: слова ключей целиком, окончания - только у основ из faq_stems"""
+import os
+
+import pytest
+
+from faq_engine import FaqEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return FaqEngine(os.path.join(ROOT, 'intent_config.json'), os.path.join(ROOT, 'response_rules.txt'))
+
+
+@pytest.mark.parametrize('message', ["покажи", "покажите", "hint", "добрыйвечер"])
+def test_no_prefix_match_for_whole_words(engine, message):
+    assert engine.answer(message) is None
+
+
+@pytest.mark.parametrize('message, intent', [
+    ("пока", "goodbye"), ("до свидания", "goodbye"), ("здравствуйте", "greetings"),
+    ("hi", "greetings"), ("благодарю", "thanks"), ("расскажите о себе", "about_bot"),
+])
+def test_intent(engine, message, intent):
+    assert engine.classify(message)[0] == intent
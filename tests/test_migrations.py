@@ -0,0 +1,27 @@
+"""Миграции на стенде SQLite и EXPLAIN горячих запросов warehouse_bot"""
+import pytest
+
+from migrations import HOT_QUERIES, MIGRATIONS, MigrationRunner, full_scans, query_plan
+from shipments_db import STANDIN_SCHEMA, ShipmentsDatabase
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = ShipmentsDatabase(str(tmp_path / 'shipments.db'))
+    database.connection().executescript(STANDIN_SCHEMA)
+    MigrationRunner(database).migrate()
+    return database
+
+
+def test_migrate_applies_each_version_once(database):
+    runner = MigrationRunner(database)
+    assert runner.pending() == []
+    assert runner.migrate() == []
+    assert runner.applied() == {migration[0] for migration in MIGRATIONS}
+
+
+@pytest.mark.parametrize('name', list(HOT_QUERIES))
+def test_hot_query_uses_index(database, name):
+    sql, params = HOT_QUERIES[name]
+    plan = query_plan(database, sql, params)
+    assert full_scans(database.dialect, plan) == [], "\n".join(plan)
@@ -0,0 +1,42 @@
+"""Лимиты запросов: списание из всех корзин сразу и переход на локальные корзины без Redis"""
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, RateLimitExceeded
+
+LIMITS = {"llm": {"session": {"capacity": 3, "per_minute": 0.001}, "ip": {"capacity": 2, "per_minute": 0.001}}}
+
+
+def test_denied_request_keeps_session_tokens():
+    limiter = RateLimiter(LIMITS)
+    for _ in range(2):
+        limiter.check("llm", {'session': "a", 'ip': "1.1.1.1"})
+    with pytest.raises(RateLimitExceeded) as denied:
+        limiter.check("llm", {'session': "a", 'ip': "1.1.1.1"})
+    assert denied.value.scope == "ip"
+    # Отказ по IP не тратит бюджет сессии: с другого адреса остается 3 - 2 = 1 запрос
+    limiter.check("llm", {'session': "a", 'ip': "2.2.2.2"})
+    with pytest.raises(RateLimitExceeded) as denied:
+        limiter.check("llm", {'session': "a", 'ip': "2.2.2.2"})
+    assert denied.value.scope == "session"
+
+
+class DownRedis:
+    def __init__(self):
+        self.calls = 0
+
+    def take_all(self, buckets, now):
+        self.calls += 1
+        raise ConnectionError("нет соединения")
+
+
+def test_redis_failure_opens_circuit(monkeypatch):
+    limiter = RateLimiter(LIMITS)
+    limiter.redis = DownRedis()
+    for _ in range(2):
+        limiter.check("llm", {'session': "b"})
+    assert limiter.redis.calls == 1
+
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: limiter.redis_retry_at)
+    limiter.check("llm", {'session': "b"})
+    assert limiter.redis.calls == 2
@@ -0,0 +1,47 @@
+"""TariffCalculator против прежнего расчета calculate_quick_cost (tariffs.reference_quote)"""
+import os
+
+import pytest
+
+from exchange_rates import RateSnapshot
+from tariff_tables import TariffTables
+from tariffs import TariffCalculator, load_config, random_cases, reference_quote, verify
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
+CASES = 30_000
+SEED = 42
+
+
+@pytest.fixture(scope='module')
+def config():
+    return load_config(CONFIG_PATH)
+
+
+def mismatches(config, calculator, count, seed):
+    rate = RateSnapshot(rate=config["EXCHANGE_RATE"]["rate"], timestamp=None, source="config")
+    found = []
+    for weight, category, city, volume in random_cases(config, count, seed):
+        expected = reference_quote(config, weight, category, city, volume, rate)
+        actual = calculator.quote(weight, category, city, volume, rate)
+        if expected is None or actual is None:
+            if expected is not actual:
+                found.append((weight, category, city, volume))
+        elif any(expected[key] != actual[key] for key in expected):
+            found.append((weight, category, city, volume))
+    return found
+
+
+def test_verify_without_mismatches(config):
+    assert verify(config, CASES, SEED)
+
+
+def test_config_tables_match_reference(config):
+    assert mismatches(config, TariffCalculator.from_config(config), CASES, SEED + 1) == []
+
+
+def test_binary_tables_match_reference(config, tmp_path):
+    # Воркеры читают тарифы из data/tariffs.bin через mmap - проверяем и этот путь
+    path = str(tmp_path / 'tariffs.bin')
+    TariffTables.save_binary(config, path)
+    calculator = TariffCalculator.from_tables(TariffTables.from_binary_file(path))
+    assert mismatches(config, calculator, CASES, SEED + 2) == []
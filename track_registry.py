@@ -0,0 +1,208 @@
+import re
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Трек = префикс + номер фиксированной ширины + суффикс: PP12345678KZ, GZ123456, CN-101512, DOC-CN-101512
+TRACK_PATTERN = re.compile(r'^([A-Z]+(?:-[A-Z]+)*-?)(\d{1,16})([A-Z]*)$')
+
+# Старшие 8 бит кода - номер формата (префикс, ширина, суффикс), младшие 56 - сам номер
+FORMAT_SHIFT = 56
+MAX_FORMATS = 256
+
+FILE_MAGIC = b'PPTR'
+FILE_VERSION = 1
+HEADER = struct.Struct('<4sHI')  # magic, версия, длина JSON с форматами
+
+
+class TrackRegistry:
+    """
+    Компактный реестр трек-номеров.
+    Вместо списка строк - отсортированный array('Q') с кодами "формат + номер" (8 байт на трек)
+    и бинарный поиск: проверка существования за O(log n).
+    Треки, которые не укладываются в формат, хранятся в обычном множестве.
+    """
+
+    def __init__(self, formats=None, codes=None, extra=None):
+        self.formats = list(formats or [])
+        self.format_ids = {tuple(fmt): i for i, fmt in enumerate(self.formats)}
+        self.codes = codes if codes is not None else array('Q')
+        self.extra = set(extra or ())
+        self._mmap = None
+
+    # --- КОДИРОВАНИЕ ---
+    def encode(self, track, create=False):
+        """Трек -> 64-битный код или None, если трек не укладывается в известный формат"""
+        match = TRACK_PATTERN.match(track)
+        if not match:
+            return None
+        prefix, digits, suffix = match.groups()
+        fmt = (prefix, len(digits), suffix)
+        format_id = self.format_ids.get(fmt)
+        if format_id is None:
+            if not create or len(self.formats) >= MAX_FORMATS:
+                return None
+            format_id = len(self.formats)
+            self.formats.append(fmt)
+            self.format_ids[fmt] = format_id
+        return (format_id << FORMAT_SHIFT) | int(digits)
+
+    def decode(self, code):
+        prefix, width, suffix = self.formats[code >> FORMAT_SHIFT]
+        number = code & ((1 << FORMAT_SHIFT) - 1)
+        return f"{prefix}{number:0{width}d}{suffix}"
+
+    @staticmethod
+    def normalize(track):
+        return track.strip().upper()
+
+    # --- ЗАГРУЗКА ---
+    @classmethod
+    def from_tracks(cls, tracks):
+        registry = cls()
+        codes = []
+        for track in tracks:
+            track = cls.normalize(track)
+            if not track:
+                continue
+            code = registry.encode(track, create=True)
+            if code is None:
+                registry.extra.add(track)
+            else:
+                codes.append(code)
+        registry.codes = array('Q', sorted(set(codes)))
+        return registry
+
+    @classmethod
+    def from_text_file(cls, path):
+        """Текстовый файл: по одному треку на строку. Строки читаются потоком, без списка строк в памяти."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_tracks(line for line in f)
+
+    def save_binary(self, path):
+        """Бинарный файл: заголовок, JSON с форматами и нестандартными треками, затем коды uint64 little-endian"""
+        meta = json.dumps({'formats': self.formats, 'extra': sorted(self.extra)}, ensure_ascii=False).encode('utf-8')
+        # Выравниваем начало кодов по 8 байт, чтобы mmap можно было читать как массив uint64
+        padding = (-(HEADER.size + len(meta))) % 8
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(FILE_MAGIC, FILE_VERSION, len(meta) + padding))
+            f.write(meta + b' ' * padding)
+            codes = self.codes
+            if sys.byteorder != 'little':
+                codes = array('Q', codes)
+                codes.byteswap()
+            codes.tofile(f)
+
+    @classmethod
+    def from_binary_file(cls, path):
+        """
+        Загрузка через mmap: коды не копируются в память процесса, страницы подгружаются ОС по мере поиска
+        и разделяются между воркерами
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, meta_length = HEADER.unpack_from(mapped, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            mapped.close()
+            raise ValueError(f"Неверный формат файла треков: {path}")
+
+        meta = json.loads(bytes(mapped[HEADER.size:HEADER.size + meta_length]).decode('utf-8'))
+        offset = HEADER.size + meta_length
+        if sys.byteorder == 'little':
+            codes = memoryview(mapped)[offset:].cast('Q')
+        else:
+            codes = array('Q', mapped[offset:])
+            codes.byteswap()
+
+        registry = cls([tuple(fmt) for fmt in meta['formats']], codes, meta['extra'])
+        registry._mmap = mapped
+        return registry
+
+    # --- ПОИСК ---
+    def __contains__(self, track):
+        track = self.normalize(track)
+        code = self.encode(track)
+        if code is None:
+            return track in self.extra
+        position = bisect_left(self.codes, code)
+        return position < len(self.codes) and self.codes[position] == code
+
+    def __len__(self):
+        return len(self.codes) + len(self.extra)
+
+    def __iter__(self):
+        for code in self.codes:
+            yield self.decode(code)
+        yield from sorted(self.extra)
+
+    def memory_bytes(self):
+        """Память под коды (для mmap - размер отображенной области)"""
+        return len(self.codes) * 8
+
+
+def load_track_registry(text_path, binary_path=None):
+    """Загружает реестр из бинарного файла, если он есть, иначе из текстового"""
+    if binary_path and os.path.exists(binary_path):
+        return TrackRegistry.from_binary_file(binary_path)
+    return TrackRegistry.from_text_file(text_path)
+
+
+def run_benchmark(count):
+    """Память и скорость: список строк против реестра на count треках"""
+    import random
+    random.seed(42)
+    tracks = [f"PP{random.randrange(10 ** 8):08d}KZ" for _ in range(count // 2)]
+    tracks += [f"GZ{random.randrange(10 ** 6):06d}" for _ in range(count // 4)]
+    tracks += [f"CN-{random.randrange(10 ** 6):06d}" for _ in range(count - len(tracks))]
+
+    list_bytes = sys.getsizeof(tracks) + sum(sys.getsizeof(track) for track in tracks)
+
+    started = time.perf_counter()
+    registry = TrackRegistry.from_tracks(tracks)
+    build_seconds = time.perf_counter() - started
+
+    probes = random.sample(tracks, 1000) + [f"PP{n:08d}XX" for n in range(1000)]
+    started = time.perf_counter()
+    found = sum(1 for track in probes if track in registry)
+    registry_lookup = (time.perf_counter() - started) / len(probes)
+
+    list_probes = probes[:50]
+    started = time.perf_counter()
+    sum(1 for track in list_probes if track in tracks)
+    list_lookup = (time.perf_counter() - started) / len(list_probes)
+
+    per_million = 1_000_000 / count
+    print(f"📊 Треков: {count}, найдено при проверке: {found}/{len(probes)}")
+    print(f"💾 Список строк: {list_bytes * per_million / 2 ** 20:.1f} МБ на миллион треков")
+    print(f"💾 Реестр array('Q'): {registry.memory_bytes() * per_million / 2 ** 20:.1f} МБ на миллион треков")
+    print(f"⏱ Построение реестра: {build_seconds:.2f} с")
+    print(f"⏱ Проверка в списке: {list_lookup * 1e6:.1f} мкс, в реестре: {registry_lookup * 1e6:.2f} мкс")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Реестр трек-номеров")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="текстовый файл треков -> бинарный файл для mmap")
+    build_parser.add_argument('input')
+    build_parser.add_argument('output')
+    bench_parser = commands.add_parser('bench', help="память и скорость на синтетических треках")
+    bench_parser.add_argument('--count', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        registry = TrackRegistry.from_text_file(args.input)
+        registry.save_binary(args.output)
+        print(f"✅ Сохранено {len(registry)} треков в {args.output}")
+    else:
+        run_benchmark(args.count)
@@ -0,0 +1,515 @@
+"""
+Складские боты: один процесс и один цикл asyncio на все склады из warehouses.json.
+
+Каждый склад - свой Telegram-бот (токен из переменной token_env) со своим названием и префиксом
+трек-номеров. Общие на все склады: пул соединений PostgreSQL (запросы идут в потоках и не держат
+цикл событий) и очередь уведомлений в Make (jobs.JobQueue с повторами). Новый склад - запись
+в warehouses.json и токен в окружении, а не копия файла и еще один процесс.
+
+    python warehouse_bot.py                  # все склады, у которых задан токен
+    python warehouse_bot.py guangzhou        # только выбранные
+
+Обновления - long polling или webhook (BOT_MODE, см. bot_webhooks.py).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
+from dotenv import load_dotenv
+
+from jobs import JobQueue
+from bot_webhooks import application_builder, serve
+from photo_store import BlobStore, MAX_DOWNLOAD_BYTES
+from shipments_db import (
+    FIND_SHIPMENT, RECEIVE_SHIPMENT, SET_SHIPMENT_STATUS, ADD_SHIPMENT_PHOTO, COUNT_SHIPMENT_PHOTOS,
+    expected_page_query, expected_count_query
+)
+
+# --- НАСТРОЙКИ ---
+load_dotenv()
+# База данных (берется из настроек Render)
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Ссылка на Make (для уведомлений клиенту)
+MAKE_WAREHOUSE_WEBHOOK = os.getenv('MAKE_WAREHOUSE_WEBHOOK', "https://hook.eu1.make.com/qjsepifbths7ek1hkv91cdid7kt4xjqx")
+WAREHOUSES_CONFIG = os.getenv('WAREHOUSES_CONFIG', 'warehouses.json')
+# Соединений с БД на все склады вместе
+DB_POOL_SIZE = int(os.getenv('WAREHOUSE_DB_POOL_SIZE', '5'))
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Состояния диалогов
+WAITING_FIO, WAITING_PRODUCT, WAITING_WEIGHT, WAITING_VOLUME, WAITING_PHONE = range(5)
+WAITING_ACTUAL_WEIGHT = 5
+WAITING_STATUS_TRACK = 6
+
+# Список ожидаемых грузов: строк на странице, сколько секунд помнить общее число
+EXPECTED_PAGE_SIZE = 10
+EXPECTED_COUNT_TTL = 60
+# Поля строки обрезаются, чтобы страница гарантированно влезла в сообщение Telegram (4096 символов)
+EXPECTED_FIELD_CHARS = 40
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+INSERT_CARGO = """
+INSERT INTO shipments (
+    track_number, fio, phone, product,
+    declared_weight, actual_weight, declared_volume, actual_volume,
+    status, route_progress, warehouse_code, manager, created_at
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+"""
+
+def load_warehouses(path=WAREHOUSES_CONFIG):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def parse_day(text):
+    for pattern in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, pattern).date()
+        except ValueError:
+            pass
+    return None
+
+def parse_expected_filters(args, default_warehouse=None):
+    """
+    /expected [склад] [с ДАТА] [по ДАТА]: даты - ГГГГ-ММ-ДД или ДД.ММ.ГГГГ, остальные слова - склад.
+    Без склада - склад этого бота (default_warehouse), "все" - грузы всех складов.
+    """
+    days, words = [], []
+    for arg in args:
+        day = parse_day(arg)
+        if day:
+            days.append(day)
+        elif arg.lower() not in ("с", "по"):
+            words.append(arg)
+    date_from = days[0].isoformat() if days else None
+    # Дата "по" включительно: в запросе - строго меньше следующего дня
+    date_to = (days[1] + timedelta(days=1)).isoformat() if len(days) > 1 else None
+    warehouse = " ".join(words) or default_warehouse
+    if warehouse and warehouse.lower() == "все":
+        warehouse = None
+    return {'warehouse': warehouse, 'date_from': date_from, 'date_to': date_to}
+
+def shorten(value):
+    value = str(value or '')
+    return value if len(value) <= EXPECTED_FIELD_CHARS else value[:EXPECTED_FIELD_CHARS - 1] + "…"
+
+
+# --- ОБЩИЕ РЕСУРСЫ ---
+class WarehouseDatabase:
+    """
+    Пул соединений PostgreSQL на все склады. Запрос выполняется в потоке (asyncio.to_thread):
+    медленная БД у одного склада не останавливает остальные. Соединений не больше size.
+    """
+
+    def __init__(self, database_url, size=DB_POOL_SIZE):
+        self.database_url = database_url
+        self.size = size
+        self.pool = None
+        self.slots = threading.BoundedSemaphore(size)
+        self.pool_lock = threading.Lock()
+        self.expected_counts = {}
+
+    def connection_pool(self):
+        if self.pool is None:
+            with self.pool_lock:
+                if self.pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self.pool = ThreadedConnectionPool(1, self.size, self.database_url)
+        return self.pool
+
+    def execute(self, work, *args):
+        """work(cursor, *args) в одной транзакции на соединении из пула"""
+        with self.slots:
+            pool = self.connection_pool()
+            conn = pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    result = work(cur, *args)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                pool.putconn(conn)
+
+    async def run(self, work, *args):
+        return await asyncio.to_thread(self.execute, work, *args)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+
+    # --- ЗАПРОСЫ ---
+    @staticmethod
+    def insert_cargo(cur, values):
+        cur.execute(INSERT_CARGO, values)
+
+    @staticmethod
+    def find_shipment(cur, code):
+        cur.execute(FIND_SHIPMENT, (code, code, code))
+        return cur.fetchone()
+
+    def receive_shipment(self, cur, track_number, actual_weight):
+        cur.execute(RECEIVE_SHIPMENT, (actual_weight, track_number))
+        self.expected_counts.clear()
+
+    def set_status(self, cur, code, status):
+        """Строка груза (track_number, fio, phone, actual_weight) после смены статуса или None"""
+        row = self.find_shipment(cur, code)
+        if row:
+            cur.execute(SET_SHIPMENT_STATUS, (status, row[0]))
+        return row
+
+    @staticmethod
+    def add_photo(cur, values):
+        """Ссылка на файл груза; (добавлена ли, сколько файлов у груза)"""
+        cur.execute(ADD_SHIPMENT_PHOTO, values)
+        added = cur.rowcount > 0
+        cur.execute(COUNT_SHIPMENT_PHOTOS, (values[0],))
+        return added, cur.fetchone()[0]
+
+    def expected_count(self, cur, expected_filters):
+        """Число ожидаемых по фильтру: COUNT(*) не чаще раза в EXPECTED_COUNT_TTL секунд"""
+        key = tuple(sorted(expected_filters.items()))
+        cached = self.expected_counts.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        sql, params = expected_count_query(**expected_filters)
+        cur.execute(sql, params)
+        count = cur.fetchone()[0]
+        self.expected_counts[key] = (count, time.monotonic() + EXPECTED_COUNT_TTL)
+        return count
+
+    def expected_rows(self, cur, expected_filters, after, before):
+        sql, params = expected_page_query(EXPECTED_PAGE_SIZE + 1, after=after, before=before, **expected_filters)
+        cur.execute(sql, params)
+        return cur.fetchall(), self.expected_count(cur, expected_filters)
+
+
+# --- УВЕДОМЛЕНИЯ В MAKE ---
+# Очередь общая на все склады: уведомление не ждет Make в обработчике и повторяется при сбое
+outbox = JobQueue()
+
+def post_to_make(payload):
+    response = requests.post(MAKE_WAREHOUSE_WEBHOOK, json=payload, timeout=10)
+    response.raise_for_status()
+
+outbox.register('warehouse.notify', post_to_make)
+
+# Фото и документы приемки всех складов
+photo_store = BlobStore()
+
+
+class WarehouseBot:
+    """Бот одного склада: config - запись warehouses.json, database - общий пул"""
+
+    def __init__(self, config, database):
+        self.config = config
+        self.database = database
+        self.token = os.getenv(config['token_env'])
+        self.application = None
+        self.setup_bot()
+
+    def setup_bot(self):
+        if not self.token:
+            logger.warning(f"⚠️ Склад {self.config['warehouse_name']} пропущен: токен не найден, проверьте {self.config['token_env']} в Render.")
+            return
+        self.application = application_builder(self.token, state=self.config['code']).build()
+        self.setup_handlers()
+
+    def notify_make(self, event_type, data):
+        if not MAKE_WAREHOUSE_WEBHOOK: return
+
+        outbox.enqueue('warehouse.notify', {
+            "event": event_type, # received, sent, delivered
+            "warehouse": self.config['warehouse_name'],
+            "track": data.get('track_number'),
+            "fio": data.get('fio'),
+            "phone": data.get('phone'),
+            "weight": data.get('actual_weight') or data.get('weight'),
+            "status": data.get('status'),
+            "manager": data.get('manager'),
+            "timestamp": datetime.now().isoformat()
+        })
+
+    async def on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        logger.error(f"❌ Ошибка склада {self.config['warehouse_name']}: {context.error}")
+        if isinstance(update, Update) and update.effective_message:
+            await update.effective_message.reply_text("❌ Ошибка БД, попробуйте еще раз.")
+
+    # --- СЦЕНАРИЙ 1: НОВЫЙ ГРУЗ (С УЛИЦЫ) ---
+    async def start_new_cargo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text("👤 **ФИО клиента:**")
+        return WAITING_FIO
+
+    async def get_fio(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        context.user_data['new_fio'] = update.message.text
+        await update.message.reply_text("📦 **Товар:**")
+        return WAITING_PRODUCT
+
+    async def get_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        context.user_data['new_product'] = update.message.text
+        await update.message.reply_text("⚖️ **Вес (кг):**")
+        return WAITING_WEIGHT
+
+    async def get_weight(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            w = float(update.message.text.replace(',', '.'))
+            context.user_data['new_weight'] = w
+            await update.message.reply_text("📏 **Объем (м³):**")
+            return WAITING_VOLUME
+        except ValueError:
+            await update.message.reply_text("❌ Введите число.")
+            return WAITING_WEIGHT
+
+    async def get_volume(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            v = float(update.message.text.replace(',', '.'))
+            context.user_data['new_volume'] = v
+            await update.message.reply_text("📞 **Телефон:**")
+            return WAITING_PHONE
+        except ValueError:
+            await update.message.reply_text("❌ Введите число.")
+            return WAITING_VOLUME
+
+    async def get_phone_and_save(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        phone = update.message.text
+        track = f"{self.config['track_prefix']}{random.randint(100000, 999999)}"
+        w = context.user_data['new_weight']
+        v = context.user_data['new_volume']
+        manager = update.message.from_user.first_name
+
+        await self.database.run(self.database.insert_cargo, (
+            track, context.user_data['new_fio'], phone, context.user_data['new_product'],
+            w, w, v, v, "принят на складе", 0,
+            self.config['warehouse_name'], manager
+        ))
+
+        self.notify_make("received", {"track_number": track, "fio": context.user_data['new_fio'], "weight": w, "status": "принят на складе", "manager": manager})
+        context.user_data['last_track'] = track
+        await update.message.reply_text(f"✅ **Груз {track} создан!**")
+        return ConversationHandler.END
+
+    # --- СЦЕНАРИЙ 2: ПРИЕМКА ПО ДОГОВОРУ (ОЖИДАЕМЫЕ) ---
+    async def expected_page(self, expected_filters, after=None, before=None):
+        """Текст и кнопки страницы ожидаемых; after/before - ключ (created_at, id) соседней строки"""
+        rows, total = await self.database.run(self.database.expected_rows, expected_filters, after, before)
+
+        has_more = len(rows) > EXPECTED_PAGE_SIZE
+        rows = rows[:EXPECTED_PAGE_SIZE]
+        if before:
+            rows.reverse()
+        if not rows:
+            return "📋 Список пуст.", None
+
+        header = "📋 **ОЖИДАЮТСЯ"
+        if expected_filters['warehouse']:
+            header += f" ({expected_filters['warehouse']})"
+        text = header + f":** всего {total}\n"
+        for row in rows:
+            text += f"🔹 `{row[2]}` — {shorten(row[3])} ({shorten(row[4])}, ~{row[5]}кг)\n"
+        text += "\n👇 **Введи номер CN-..., чтобы принять.**"
+
+        # Назад - если пришли со следующей страницы или перед первой строкой есть еще; вперед - наоборот
+        buttons = []
+        if (after is not None) or (before is not None and has_more):
+            buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"exp|p|{rows[0][1]}|{rows[0][0]}"))
+        if (before is not None) or has_more:
+            buttons.append(InlineKeyboardButton("Старее ➡️", callback_data=f"exp|n|{rows[-1][1]}|{rows[-1][0]}"))
+        return text[:TELEGRAM_MESSAGE_LIMIT], InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def show_expected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        expected_filters = parse_expected_filters(context.args or [], self.config['warehouse_name'])
+        context.user_data['expected_filters'] = expected_filters
+        text, markup = await self.expected_page(expected_filters)
+        await update.message.reply_text(text, reply_markup=markup)
+
+    async def expected_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        _, direction, created_at, shipment_id = query.data.split('|')
+        key = (created_at, int(shipment_id))
+        expected_filters = context.user_data.get('expected_filters') or parse_expected_filters([], self.config['warehouse_name'])
+        text, markup = await self.expected_page(expected_filters, after=key if direction == 'n' else None, before=key if direction == 'p' else None)
+        await query.edit_message_text(text, reply_markup=markup)
+
+    async def start_contract_receive(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        track = update.message.text.strip().upper()
+        context.user_data['receiving_track'] = track
+
+        row = await self.database.run(self.database.find_shipment, track)
+        if row:
+            context.user_data['receiving_track_number'] = row[0]
+            context.user_data['receiving_fio'] = row[1]
+            context.user_data['receiving_phone'] = row[2]
+            await update.message.reply_text(f"📥 Приемка **{track}**\n👤 {row[1]}\n⚖️ **Введите ФАКТ. вес (кг):**")
+            return WAITING_ACTUAL_WEIGHT
+        else:
+            await update.message.reply_text("❌ Не найдено.")
+            return ConversationHandler.END
+
+    async def save_contract_receive(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            actual_weight = float(update.message.text.replace(',', '.'))
+        except ValueError:
+            await update.message.reply_text("❌ Введите число.")
+            return WAITING_ACTUAL_WEIGHT
+
+        track = context.user_data['receiving_track']
+        await self.database.run(self.database.receive_shipment, context.user_data.get('receiving_track_number', track), actual_weight)
+        context.user_data['last_track'] = context.user_data.get('receiving_track_number', track)
+
+        self.notify_make("received", {
+            "track_number": track,
+            "fio": context.user_data.get('receiving_fio'),
+            "actual_weight": actual_weight,
+            "status": "принят на складе",
+            "manager": update.message.from_user.first_name
+        })
+        await update.message.reply_text(f"✅ **{track} принят!** Вес: {actual_weight} кг")
+        return ConversationHandler.END
+
+    # --- СЦЕНАРИЙ 3: СМЕНА СТАТУСА ---
+    async def set_status_mode(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text
+        mode = "sent" if "ОТПРАВЛЕНО" in text else "border" if "НА ГРАНИЦЕ" in text else "delivered"
+        context.user_data['status_mode'] = mode
+        await update.message.reply_text(f"🔄 Режим: **{text}**\n👇 Сканируй треки:")
+        return WAITING_STATUS_TRACK
+
+    async def update_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        track = update.message.text.strip().upper()
+        if track in ["➕ НОВЫЙ ГРУЗ", "📋 ОЖИДАЕМЫЕ ГРУЗЫ", "🚚 ОТПРАВЛЕНО", "🛃 НА ГРАНИЦЕ", "✅ ДОСТАВЛЕНО"]: return ConversationHandler.END
+
+        mode = context.user_data.get('status_mode')
+        status_map = {"sent": "в пути до границы", "border": "на границе", "delivered": "доставлен"}
+
+        if mode in status_map:
+            new_status = status_map[mode]
+            row = await self.database.run(self.database.set_status, track, new_status)
+            if row:
+                self.notify_make(mode, {
+                    "track_number": track,
+                    "fio": row[1],
+                    "status": new_status,
+                    "manager": update.message.from_user.first_name
+                })
+                await update.message.reply_text(f"✅ {new_status}: {track}")
+            else:
+                await update.message.reply_text("❌ Не найден.")
+        return WAITING_STATUS_TRACK
+
+    # --- СЦЕНАРИЙ 4: ФОТО И ДОКУМЕНТЫ ПРИЕМКИ ---
+    async def receive_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Фото или документ с подписью-номером груза; без подписи - к последнему принятому грузу"""
+        message = update.message
+        code = (message.caption or '').strip().upper() or context.user_data.get('last_track')
+        if not code:
+            await message.reply_text("📷 Подпиши фото номером груза (CN-... или трек) или сначала прими груз.")
+            return
+        row = await self.database.run(self.database.find_shipment, code)
+        if not row:
+            await message.reply_text("❌ Не найдено.")
+            return
+
+        if message.photo:
+            # Самый большой из размеров, которые прислал Telegram
+            attachment, kind, content_type, file_name = message.photo[-1], 'photo', 'image/jpeg', None
+        else:
+            attachment, kind = message.document, 'document'
+            content_type, file_name = attachment.mime_type, attachment.file_name
+        if attachment.file_size and attachment.file_size > MAX_DOWNLOAD_BYTES:
+            await message.reply_text("❌ Файл больше 20 МБ - Telegram не отдает такие ботам.")
+            return
+
+        telegram_file = await attachment.get_file()
+        digest, size, _ = await photo_store.download(telegram_file.file_path)
+        added, total = await self.database.run(self.database.add_photo, (
+            row[0], digest, kind, content_type, size, file_name,
+            self.config['warehouse_name'], message.from_user.first_name
+        ))
+        if (content_type or '').startswith('image/'):
+            context.application.create_task(photo_store.thumbnail(digest))
+        context.user_data['last_track'] = row[0]
+        await message.reply_text(f"📷 {'Добавлено' if added else 'Уже есть'} к {row[0]}, файлов у груза: {total}")
+
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text("🏠 Меню.")
+        return ConversationHandler.END
+
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        keyboard = [
+            [KeyboardButton("➕ НОВЫЙ ГРУЗ"), KeyboardButton("📋 ОЖИДАЕМЫЕ ГРУЗЫ")],
+            [KeyboardButton("🚚 ОТПРАВЛЕНО"), KeyboardButton("🛃 НА ГРАНИЦЕ")],
+            [KeyboardButton("✅ ДОСТАВЛЕНО")]
+        ]
+        await update.message.reply_text(f"🏭 **СКЛАД {self.config['warehouse_name'].upper()}**\nОжидание команд...", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+
+    def setup_handlers(self):
+        self.application.add_handler(CommandHandler("start", self.start_command))
+        self.application.add_handler(MessageHandler(filters.Regex('^(📋 ОЖИДАЕМЫЕ ГРУЗЫ)$'), self.show_expected))
+        self.application.add_handler(CommandHandler("expected", self.show_expected))
+        self.application.add_handler(CallbackQueryHandler(self.expected_page_callback, pattern=r'^exp\|'))
+
+        self.application.add_handler(ConversationHandler(
+            entry_points=[MessageHandler(filters.Regex('^(➕ НОВЫЙ ГРУЗ)'), self.start_new_cargo)],
+            states={WAITING_FIO: [MessageHandler(filters.TEXT, self.get_fio)], WAITING_PRODUCT: [MessageHandler(filters.TEXT, self.get_product)], WAITING_WEIGHT: [MessageHandler(filters.TEXT, self.get_weight)], WAITING_VOLUME: [MessageHandler(filters.TEXT, self.get_volume)], WAITING_PHONE: [MessageHandler(filters.TEXT, self.get_phone_and_save)]},
+            fallbacks=[CommandHandler('cancel', self.cancel)],
+            name='new_cargo',
+            persistent=True
+        ))
+
+        self.application.add_handler(ConversationHandler(
+            entry_points=[MessageHandler(filters.Regex(r'^CN-\d+'), self.start_contract_receive)],
+            states={WAITING_ACTUAL_WEIGHT: [MessageHandler(filters.TEXT, self.save_contract_receive)]},
+            fallbacks=[CommandHandler('cancel', self.cancel)],
+            name='contract_receive',
+            persistent=True
+        ))
+
+        self.application.add_handler(ConversationHandler(
+            entry_points=[MessageHandler(filters.Regex('^(🚚|🛃|✅)'), self.set_status_mode)],
+            states={WAITING_STATUS_TRACK: [MessageHandler(filters.TEXT, self.update_status)]},
+            fallbacks=[CommandHandler('cancel', self.cancel), MessageHandler(filters.Regex('^➕'), self.cancel)],
+            name='status',
+            persistent=True
+        ))
+        self.application.add_handler(MessageHandler(filters.PHOTO | filters.Document.ALL, self.receive_photo))
+        self.application.add_error_handler(self.on_error)
+
+
+# --- ЗАПУСК ---
+def build_bots(database=None, codes=None):
+    """{код склада: Application} для складов из warehouses.json, у которых задан токен"""
+    database = database or WarehouseDatabase(DATABASE_URL)
+    configs = [config for config in load_warehouses() if not codes or config['code'] in codes]
+    bots = (WarehouseBot(config, database) for config in configs)
+    return {bot.config['code']: bot.application for bot in bots if bot.application}
+
+def main(codes=None):
+    database = WarehouseDatabase(DATABASE_URL)
+    bots = build_bots(database, codes)
+    if not bots:
+        logger.error("❌ Ни одного склада с токеном - нечего запускать")
+        return
+    outbox.start()
+    logger.info(f"🏭 Складов в процессе: {len(bots)}, соединений с БД не больше {database.size}")
+    try:
+        serve(bots)
+    finally:
+        outbox.stop()
+        database.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])